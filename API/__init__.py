@@ -2,7 +2,22 @@
 TripBot API Package
 """
 
-from .openAIAPI import TravelPreferences, generate_itinerary
-from .ml.model_interface import ModelInterface
+import importlib
 
-__all__ = ['TravelPreferences', 'generate_itinerary', 'ModelInterface']
\ No newline at end of file
+# Submodules are imported on first attribute access, so importing the package
+# (e.g. for a uvicorn worker or test collection) does not pull in torch or
+# require provider keys
+_LAZY_ATTRIBUTES = {
+    'TravelPreferences': '.openAIAPI',
+    'generate_itinerary': '.openAIAPI',
+    'ModelInterface': '.ml.model_interface',
+}
+
+__all__ = ['TravelPreferences', 'generate_itinerary', 'ModelInterface']
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,4 @@
+"""
+Performance benchmarks for the TripBot API, run as modules, e.g.
+python -m API.benchmarks.cache_codecs
+"""
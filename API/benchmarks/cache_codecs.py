@@ -0,0 +1,122 @@
+"""
+Compare cache codecs on realistic itineraries: encoded size and
+encode/decode time for every installed serializer/compressor pair.
+
+    python -m API.benchmarks.cache_codecs --days 7 --iterations 200
+"""
+import argparse
+import json
+import random
+import time
+from typing import Dict, List
+
+from API.services.codecs import (
+    COMPRESSORS,
+    SERIALIZERS,
+    ItineraryCodec,
+    _compressor_available,
+    _serializer_available
+)
+
+PLACES = [
+    ("Hawa Mahal", 26.9239, 75.8267),
+    ("Amber Fort", 26.9855, 75.8513),
+    ("City Palace", 26.9258, 75.8237),
+    ("Jantar Mantar", 26.9248, 75.8246),
+    ("Nahargarh Fort", 26.9373, 75.8155),
+    ("Jal Mahal", 26.9535, 75.8462),
+    ("Albert Hall Museum", 26.9116, 75.8195),
+    ("Johari Bazaar", 26.9196, 75.8267)
+]
+
+def sample_itinerary(num_days: int = 7, activities_per_day: int = 5, seed: int = 0) -> Dict:
+    """Build an itinerary shaped like an enriched API response."""
+    rng = random.Random(seed)
+
+    def photos() -> List[str]:
+        return [
+            "https://maps.googleapis.com/maps/api/place/photo?maxwidth=800&photoreference="
+            + "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-") for _ in range(200))
+            + "&key=YOUR_API_KEY_HERE"
+            for _ in range(3)
+        ]
+
+    days = []
+    for day in range(num_days):
+        activities = []
+        for index in range(activities_per_day):
+            name, lat, lng = rng.choice(PLACES)
+            activities.append({
+                "time": f"{9 + 2 * index:02d}:00",
+                "location": name,
+                "coordinates": {"lat": lat + rng.uniform(-0.001, 0.001), "lng": lng + rng.uniform(-0.001, 0.001)},
+                "description": f"Explore {name}, one of Jaipur's best-known landmarks, with a local guide.",
+                "cost": f"INR {rng.randint(100, 2000)}",
+                "distance_from_prev": f"{rng.uniform(0.5, 15):.1f} km",
+                "duration_from_prev": f"{rng.randint(5, 45)} mins",
+                "place_id": "ChIJ" + "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(23)),
+                "photos": photos()
+            })
+        days.append({"day": day + 1, "activities": activities})
+
+    return {
+        "destination": "Jaipur",
+        "hotels": [
+            {
+                "name": f"Heritage Haveli {index}",
+                "location": {"lat": 26.92 + index / 1000, "lng": 75.82 + index / 1000},
+                "price": "INR 4500/night",
+                "distance": f"{index + 1}.2 km",
+                "rating": 4.3,
+                "photos": photos()
+            }
+            for index in range(5)
+        ],
+        "days": days
+    }
+
+def benchmark(itinerary: Dict, iterations: int) -> List[Dict]:
+    """Measure every installed codec on one itinerary."""
+    json_size = len(json.dumps(itinerary).encode("utf-8"))
+    results = []
+    for serializer in SERIALIZERS:
+        for compression in COMPRESSORS:
+            if not (_serializer_available(serializer) and _compressor_available(compression)):
+                continue
+            codec = ItineraryCodec(serializer, compression)
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                encoded = codec.encode(itinerary)
+            encode_time = (time.perf_counter() - start) / iterations
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                decoded = codec.decode(encoded)
+            decode_time = (time.perf_counter() - start) / iterations
+
+            assert decoded == itinerary, f"{codec.name} did not round-trip"
+            results.append({
+                "codec": codec.name,
+                "size_bytes": len(encoded),
+                "ratio_vs_json": len(encoded) / json_size,
+                "encode_us": encode_time * 1e6,
+                "decode_us": decode_time * 1e6
+            })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--activities_per_day", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    itinerary = sample_itinerary(args.days, args.activities_per_day)
+    print(f"Plain JSON size: {len(json.dumps(itinerary).encode('utf-8'))} bytes")
+    print(f"{'codec':<18}{'size':>10}{'ratio':>8}{'encode us':>12}{'decode us':>12}")
+    for row in benchmark(itinerary, args.iterations):
+        print(
+            f"{row['codec']:<18}{row['size_bytes']:>10}{row['ratio_vs_json']:>8.2f}"
+            f"{row['encode_us']:>12.1f}{row['decode_us']:>12.1f}"
+        )
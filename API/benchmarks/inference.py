@@ -0,0 +1,92 @@
+"""
+Compare CPU inference variants of the model (fp32, int8, TorchScript):
+checkpoint size, private memory after loading and generation latency per
+batch size. Each checkpoint is measured in a fresh interpreter so memory
+numbers don't mix.
+
+    python -m API.benchmarks.inference checkpoints/best_model.pt checkpoints/model_int8.pt
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROBE = """
+import json, time, torch
+from API.ml.model import ItineraryEncoderDecoder
+
+def private_mb():
+    with open('/proc/self/statm') as f:
+        fields = f.read().split()
+    return (int(fields[1]) - int(fields[2])) * 4096 / 2 ** 20
+
+torch.set_num_threads({threads})
+before = private_mb()
+start = time.perf_counter()
+model = ItineraryEncoderDecoder.from_pretrained({path!r}, mmap=True).eval()
+load_seconds = time.perf_counter() - start
+
+vocab_size = model.config['vocab_size']
+latencies = {{}}
+with torch.inference_mode():
+    for batch_size in {batch_sizes!r}:
+        src_tokens = torch.randint(3, vocab_size, (batch_size, {src_length}))
+        model.generate(src_tokens, max_length=8)
+        samples = []
+        for _ in range({runs}):
+            start = time.perf_counter()
+            model.generate(src_tokens, max_length={max_length}, eos_token_id=None)
+            samples.append(time.perf_counter() - start)
+        latencies[batch_size] = samples
+
+print(json.dumps({{
+    "load_seconds": load_seconds,
+    "private_mb": private_mb() - before,
+    "quantized": model.is_quantized,
+    "latencies": latencies
+}}))
+"""
+
+def measure(path: str, batch_sizes: List[int], runs: int, max_length: int, src_length: int, threads: int) -> Dict:
+    """Load and time one checkpoint in a fresh interpreter."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    probe = PROBE.format(
+        path=os.path.abspath(path), batch_sizes=batch_sizes, runs=runs,
+        max_length=max_length, src_length=src_length, threads=threads
+    )
+    result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, env=env, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmarking {path} failed:\n{result.stderr}")
+    row = json.loads(result.stdout.strip().splitlines()[-1])
+    row["path"] = path
+    row["size_mb"] = os.path.getsize(path) / 2 ** 20
+    row["p50_ms"] = {
+        int(batch_size): statistics.median(samples) * 1000
+        for batch_size, samples in row.pop("latencies").items()
+    }
+    return row
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checkpoints", nargs="+")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max_length", type=int, default=64)
+    parser.add_argument("--src_length", type=int, default=24)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    header = f"{'checkpoint':<36}{'size MB':>9}{'mem MB':>9}{'load s':>8}"
+    header += "".join(f"{f'p50 ms b={size}':>14}" for size in args.batch_sizes)
+    print(header)
+    for path in args.checkpoints:
+        row = measure(path, args.batch_sizes, args.runs, args.max_length, args.src_length, args.threads)
+        line = f"{os.path.basename(path):<36}{row['size_mb']:>9.1f}{row['private_mb']:>9.1f}{row['load_seconds']:>8.2f}"
+        line += "".join(f"{row['p50_ms'][size]:>14.1f}" for size in args.batch_sizes)
+        print(line)
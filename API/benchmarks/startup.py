@@ -0,0 +1,88 @@
+"""
+Measure how long a fresh interpreter takes to import the API modules a
+uvicorn worker or test run starts from, and check that none of them loads
+heavy or network-bound modules as a side effect.
+
+    python -m API.benchmarks.startup --runs 5
+    python -m API.benchmarks.startup --max-seconds 2.0   # non-zero exit on regression
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODULES = ["API", "API.main", "API.routes.slm"]
+
+# Loaded only when a request needs them, never at import
+FORBIDDEN_MODULES = ["torch", "transformers", "API.ml.model", "API.openAIAPI", "API.maps_interface"]
+
+PROBE = """
+import json, socket, sys, time
+opened = []
+_connect = socket.socket.connect
+def connect(self, address):
+    opened.append(str(address))
+    return _connect(self, address)
+socket.socket.connect = connect
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "forbidden": [name for name in {forbidden!r} if name in sys.modules],
+    "connections": opened
+}}))
+"""
+
+def measure_import(module: str) -> Dict:
+    """Import module in a fresh interpreter without provider keys."""
+    env = {
+        name: value for name, value in os.environ.items()
+        if name not in ("TOGETHER_API_KEY", "OPENAI_API_KEY", "GOOGLE_MAPS_API_KEY")
+    }
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, forbidden=FORBIDDEN_MODULES)],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=ROOT
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def benchmark(modules: List[str], runs: int) -> List[Dict]:
+    """Median import time per module over several fresh interpreters."""
+    results = []
+    for module in modules:
+        samples = [measure_import(module) for _ in range(runs)]
+        results.append({
+            "module": module,
+            "median_seconds": statistics.median(sample["seconds"] for sample in samples),
+            "forbidden": sorted({name for sample in samples for name in sample["forbidden"]}),
+            "connections": sorted({address for sample in samples for address in sample["connections"]})
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<20}{'median s':>10}  side effects")
+    for row in benchmark(args.modules, args.runs):
+        side_effects = row["forbidden"] + [f"connect {address}" for address in row["connections"]]
+        print(f"{row['module']:<20}{row['median_seconds']:>10.3f}  {', '.join(side_effects) or '-'}")
+        too_slow = args.max_seconds is not None and row["median_seconds"] > args.max_seconds
+        failed = failed or too_slow or bool(side_effects)
+
+    sys.exit(1 if failed else 0)
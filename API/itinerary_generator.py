@@ -1,17 +1,159 @@
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional
+from collections import deque
+from concurrent.futures import Executor
+import asyncio
 import json
-from .openAIAPI import TravelPreferences, generate_itinerary
+from .openAIAPI import TravelPreferences, generate_itinerary, generate_itinerary_stream
 from .maps_interface import (
-    get_place_details,
-    calculate_distances,
+    calculate_leg_distances,
     find_nearby_hotels,
-    get_place_photos
+    enrich_places,
+    RateLimiter
 )
 
 class ItineraryGenerator:
-    def __init__(self):
-        """Initialize the itinerary generator."""
-        pass
+    def __init__(self, max_workers: int = 8, requests_per_second: float = 10.0):
+        """
+        Initialize the itinerary generator.
+        
+        Args:
+            max_workers (int): Maximum number of concurrent Google Maps lookups
+            requests_per_second (float): Limit on Google Maps calls during
+                enrichment, shared by all calls on this generator, including
+                days enriched concurrently
+        """
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+
+    def _enrich_activities(self, activities: List[Dict]) -> None:
+        """Add coordinates, place IDs and photos to activities, in parallel."""
+        places = enrich_places(
+            [activity['location'] for activity in activities],
+            max_workers=self.max_workers,
+            rate_limiter=self.rate_limiter
+        )
+        for activity in activities:
+            place_details = places.get(activity['location'])
+            if place_details:
+                activity['coordinates'] = place_details['coordinates']
+                activity['place_id'] = place_details['place_id']
+                activity['photos'] = place_details['photos']
+
+    def _apply_leg_distances(self, days: List[Dict]) -> None:
+        """Set distance/duration from the previous activity for all given days at once."""
+        leg_distances = calculate_leg_distances(
+            [day['activities'] for day in days],
+            max_workers=self.max_workers,
+            rate_limiter=self.rate_limiter
+        )
+        for day, legs in zip(days, leg_distances):
+            # Clear values left from an earlier order (the first activity has
+            # no leg, and removed activities change which leg comes first)
+            for activity in day['activities']:
+                activity.pop('distance_from_prev', None)
+                activity.pop('duration_from_prev', None)
+            for i, leg in enumerate(legs, start=1):
+                if leg:
+                    day['activities'][i]['distance_from_prev'] = leg['distance']
+                    day['activities'][i]['duration_from_prev'] = leg['duration']
+
+    def enrich_day(self, day: Dict, find_hotels: bool = False) -> Optional[List[Dict]]:
+        """
+        Enrich one day's activities and legs in place.
+        
+        Args:
+            day (Dict): A day from the generated itinerary
+            find_hotels (bool): Also look up hotels near the day's first activity
+            
+        Returns:
+            Optional[List[Dict]]: Nearby hotels if find_hotels is True
+        """
+        self._enrich_activities(day['activities'])
+        self._apply_leg_distances([day])
+        if find_hotels:
+            return self._find_hotels_near(day)
+        return None
+
+    def _find_hotels_near(self, day: Dict) -> Optional[List[Dict]]:
+        """Hotels near the day's first activity; None if it is missing or could not be located."""
+        if day['activities'] and 'coordinates' in day['activities'][0]:
+            return find_nearby_hotels({
+                'coordinates': day['activities'][0]['coordinates']
+            })
+        return None
+
+    async def stream_complete_itinerary(
+        self,
+        destination: Optional[str],
+        group_type: str,
+        num_days: int,
+        budget: str,
+        num_people: int,
+        executor: Optional[Executor] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Stream a complete itinerary, enriching each day as soon as it is generated.
+        
+        Enrichment of finished days runs on executor while later days are still
+        being generated. Days are yielded in order.
+        
+        Yields:
+            Dict: {"type": "day", "day": {...}} per enriched day,
+            {"type": "hotels", "hotels": [...]} once the first day is enriched, and
+            finally {"type": "itinerary", "itinerary": {...}} with everything
+        """
+        preferences = TravelPreferences(
+            destination=destination,
+            group_type=group_type,
+            num_days=num_days,
+            budget=budget,
+            num_people=num_people
+        )
+        loop = asyncio.get_running_loop()
+        days: List[Dict] = []
+        pending = deque()
+        hotels = []
+        
+        def enrich(day: Dict, find_hotels: bool):
+            return loop.run_in_executor(executor, self.enrich_day, day, find_hotels)
+        
+        async def finish_day(day: Dict, future) -> List[Dict]:
+            events = [{"type": "day", "day": day}]
+            found = await future
+            if found is not None:
+                hotels.extend(found)
+                events.append({"type": "hotels", "hotels": found})
+            return events
+        
+        try:
+            async for event in generate_itinerary_stream(preferences):
+                if event["type"] == "day":
+                    day = event["day"]
+                    pending.append((day, enrich(day, find_hotels=not days)))
+                    days.append(day)
+                else:
+                    itinerary = event["itinerary"]
+                    # Pick up any days the incremental parser could not split out
+                    for day in itinerary.get('days', [])[len(days):]:
+                        pending.append((day, enrich(day, find_hotels=not days)))
+                        days.append(day)
+                
+                # Emit days whose enrichment has already finished, in order
+                while pending and pending[0][1].done():
+                    for ready in await finish_day(*pending.popleft()):
+                        yield ready
+            
+            while pending:
+                for ready in await finish_day(*pending.popleft()):
+                    yield ready
+            
+            itinerary['days'] = days
+            itinerary['hotels'] = hotels
+            yield {"type": "itinerary", "itinerary": itinerary}
+        
+        except Exception as e:
+            print(f"Error streaming itinerary: {str(e)}")
+            raise
 
     def generate_complete_itinerary(
         self,
@@ -46,38 +188,22 @@ class ItineraryGenerator:
             
             basic_itinerary = generate_itinerary(preferences)
             
-            # 2. Enhance with place details and coordinates
-            for day in basic_itinerary['days']:
-                for activity in day['activities']:
-                    # Get detailed place information
-                    place_details = get_place_details(activity['location'])
-                    if place_details:
-                        activity['coordinates'] = place_details['coordinates']
-                        activity['place_id'] = place_details['place_id']
-                        
-                        # Add place photos
-                        activity['photos'] = get_place_photos(place_details['place_id'])
+            # 2. Enhance with place details and coordinates, looking up
+            # each distinct location once and concurrently
+            self._enrich_activities([
+                activity
+                for day in basic_itinerary['days']
+                for activity in day['activities']
+            ])
 
             # 3. Find and add nearby hotels for first day's activities
             if basic_itinerary['days']:
-                first_activity = basic_itinerary['days'][0]['activities'][0]
-                nearby_hotels = find_nearby_hotels({
-                    'coordinates': first_activity['coordinates']
-                })
-                basic_itinerary['hotels'] = nearby_hotels
+                nearby_hotels = self._find_hotels_near(basic_itinerary['days'][0])
+                if nearby_hotels is not None:
+                    basic_itinerary['hotels'] = nearby_hotels
 
             # 4. Calculate distances between consecutive locations
-            for day in basic_itinerary['days']:
-                activities = day['activities']
-                if len(activities) > 1:
-                    for i in range(1, len(activities)):
-                        distances = calculate_distances(
-                            [activities[i-1]],
-                            [activities[i]]
-                        )
-                        if distances:
-                            activities[i]['distance_from_prev'] = distances[0]['distance']
-                            activities[i]['duration_from_prev'] = distances[0]['duration']
+            self._apply_leg_distances(basic_itinerary['days'])
 
             return basic_itinerary
 
@@ -100,39 +226,35 @@ class ItineraryGenerator:
             # Deep copy the original itinerary
             updated_itinerary = json.loads(json.dumps(itinerary))
             
-            # Apply updates
+            # Apply updates, tracking which days changed
+            changed_days = set()
             if 'remove_activities' in updates:
                 for day_idx, activity_idx in updates['remove_activities']:
                     if 0 <= day_idx < len(updated_itinerary['days']):
                         day = updated_itinerary['days'][day_idx]
                         if 0 <= activity_idx < len(day['activities']):
                             day['activities'].pop(activity_idx)
+                            changed_days.add(day_idx)
             
             if 'add_activities' in updates:
-                for day_idx, new_activity in updates['add_activities']:
-                    if 0 <= day_idx < len(updated_itinerary['days']):
-                        # Get place details for new activity
-                        place_details = get_place_details(new_activity['location'])
-                        if place_details:
-                            new_activity['coordinates'] = place_details['coordinates']
-                            new_activity['place_id'] = place_details['place_id']
-                            new_activity['photos'] = get_place_photos(place_details['place_id'])
-                        
-                        updated_itinerary['days'][day_idx]['activities'].append(new_activity)
+                new_activities = [
+                    (day_idx, new_activity)
+                    for day_idx, new_activity in updates['add_activities']
+                    if 0 <= day_idx < len(updated_itinerary['days'])
+                ]
+                
+                # Get place details for all new activities at once
+                self._enrich_activities([new_activity for _, new_activity in new_activities])
+                
+                for day_idx, new_activity in new_activities:
+                    updated_itinerary['days'][day_idx]['activities'].append(new_activity)
+                    changed_days.add(day_idx)
             
-            # Recalculate distances if activities were modified
-            if 'remove_activities' in updates or 'add_activities' in updates:
-                for day in updated_itinerary['days']:
-                    activities = day['activities']
-                    if len(activities) > 1:
-                        for i in range(1, len(activities)):
-                            distances = calculate_distances(
-                                [activities[i-1]],
-                                [activities[i]]
-                            )
-                            if distances:
-                                activities[i]['distance_from_prev'] = distances[0]['distance']
-                                activities[i]['duration_from_prev'] = distances[0]['duration']
+            # Recalculate distances only for the days that were modified
+            if changed_days:
+                self._apply_leg_distances([
+                    updated_itinerary['days'][day_idx] for day_idx in sorted(changed_days)
+                ])
             
             return updated_itinerary
 
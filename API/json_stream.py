@@ -0,0 +1,94 @@
+import json
+from typing import Any, Dict, List, Optional
+
+class JSONStreamParser:
+    """
+    Incremental parser for a JSON object that arrives in chunks.
+
+    Elements of the top-level array named array_key are returned by feed()
+    as soon as each one is complete, so callers can act on the first days
+    of an itinerary while the rest is still being generated. Text before
+    the first '{' (e.g. a stray markdown fence) is ignored.
+    """
+
+    def __init__(self, array_key: str = "days"):
+        self.array_key = array_key
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._current_key: Optional[str] = None
+        self._in_array = False
+        self._element_start: Optional[int] = None
+        self._root_start: Optional[int] = None
+        self._root_end: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Add a chunk of text; returns the array elements completed by it."""
+        self._buffer += chunk
+        completed = []
+        buffer = self._buffer
+
+        while self._pos < len(buffer) and self._root_end is None:
+            i = self._pos
+            char = buffer[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_string = json.loads(buffer[self._string_start:i + 1])
+                continue
+
+            if self._root_start is None:
+                if char == "{":
+                    self._root_start = i
+                    self._stack.append("{")
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ":" and len(self._stack) == 1:
+                self._current_key = self._last_string
+            elif char in "{[":
+                if len(self._stack) == 1 and char == "[" and self._current_key == self.array_key:
+                    self._in_array = True
+                elif self._in_array and len(self._stack) == 2:
+                    self._element_start = i
+                self._stack.append(char)
+            elif char in "}]":
+                self._stack.pop()
+                if self._in_array and len(self._stack) == 2 and self._element_start is not None:
+                    completed.append(json.loads(buffer[self._element_start:i + 1]))
+                    self._element_start = None
+                elif self._in_array and len(self._stack) == 1:
+                    self._in_array = False
+                elif not self._stack:
+                    self._root_end = i + 1
+
+        return completed
+
+    @property
+    def complete(self) -> bool:
+        """True once the closing brace of the top-level object has been seen."""
+        return self._root_end is not None
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Parse the whole object.
+
+        Raises:
+            json.JSONDecodeError: If the text received so far is not a complete JSON object
+        """
+        start = self._root_start or 0
+        end = self._root_end or len(self._buffer)
+        return json.loads(self._buffer[start:end])
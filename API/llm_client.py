@@ -0,0 +1,316 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+TOGETHER_BASE_URL = "https://api.together.xyz/v1"
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter; a server's Retry-After wins."""
+    max_retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number attempt (0-based)."""
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class _Waiter:
+    __slots__ = ("wake", "granted")
+
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.granted = False
+
+class ConcurrencyBudget:
+    """
+    Cap on in-flight requests that sync and async clients can share.
+
+    Waiters of both kinds queue in one FIFO and a released slot is handed
+    straight to the oldest one: a thread is woken through an Event, a
+    coroutine through its event loop. A cancelled coroutine leaves the
+    queue, or passes on a slot it was handed, so it never holds one.
+    """
+
+    def __init__(self, max_concurrency: int):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._available = max_concurrency
+        self._waiters: Deque[_Waiter] = deque()
+
+    def _acquire_or_enqueue(self, waiter: _Waiter) -> bool:
+        """Take a free slot (True) or join the queue; call with _lock held."""
+        if self._available and not self._waiters:
+            self._available -= 1
+            return True
+        self._waiters.append(waiter)
+        return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self._available += 1
+
+    def __enter__(self):
+        event = threading.Event()
+        with self._lock:
+            if self._acquire_or_enqueue(_Waiter(event.set)):
+                return self
+        event.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(resolve))
+        with self._lock:
+            if self._acquire_or_enqueue(waiter):
+                return self
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return (retry_at - datetime.now(timezone.utc)).total_seconds()
+
+class LLMClient:
+    """
+    Chat completion client with a keep-alive connection pool, connect/read
+    timeouts, retries with backoff, and a cap on concurrent requests.
+
+    Use get_llm_client() so all callers with the same API key share one
+    client, and therefore one connection pool. Its concurrency cap is also
+    shared with the key's AsyncLLMClient.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = TOGETHER_BASE_URL,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        max_connections: int = 10,
+        max_concurrency: int = 4,
+        retry_policy: Optional[RetryPolicy] = None,
+        concurrency_budget: Optional[ConcurrencyBudget] = None
+    ):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_policy = retry_policy or RetryPolicy()
+        # A shared budget overrides max_concurrency
+        self._budget = concurrency_budget or ConcurrencyBudget(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def chat_completion(self, payload: Dict) -> Dict:
+        """
+        POST a chat completion request, retrying on connection errors and
+        retryable status codes.
+
+        Raises:
+            requests.RequestException: If the request still fails after all retries
+        """
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(self.retry_policy.max_retries + 1):
+            retry_after = None
+            try:
+                with self._budget:
+                    response = self.session.post(url, json=payload, timeout=self.timeout)
+                if response.status_code not in self.retry_policy.retry_statuses:
+                    response.raise_for_status()
+                    return response.json()
+                if attempt == self.retry_policy.max_retries:
+                    response.raise_for_status()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retry_policy.max_retries:
+                    raise
+
+            time.sleep(self.retry_policy.delay(attempt, retry_after))
+
+    def close(self):
+        self.session.close()
+
+class AsyncLLMClient:
+    """Async variant of LLMClient on a shared httpx connection pool."""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = TOGETHER_BASE_URL,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        max_connections: int = 10,
+        max_concurrency: int = 4,
+        retry_policy: Optional[RetryPolicy] = None,
+        concurrency_budget: Optional[ConcurrencyBudget] = None
+    ):
+        self.base_url = base_url
+        self.retry_policy = retry_policy or RetryPolicy()
+        # A shared budget overrides max_concurrency
+        self._budget = concurrency_budget or ConcurrencyBudget(max_concurrency)
+        self.client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+    async def chat_completion(self, payload: Dict) -> Dict:
+        """
+        POST a chat completion request, retrying on connection errors and
+        retryable status codes.
+
+        Raises:
+            httpx.HTTPError: If the request still fails after all retries
+        """
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(self.retry_policy.max_retries + 1):
+            retry_after = None
+            try:
+                async with self._budget:
+                    response = await self.client.post(url, json=payload)
+                if response.status_code not in self.retry_policy.retry_statuses:
+                    response.raise_for_status()
+                    return response.json()
+                if attempt == self.retry_policy.max_retries:
+                    response.raise_for_status()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except (httpx.ConnectError, httpx.TimeoutException):
+                if attempt == self.retry_policy.max_retries:
+                    raise
+
+            await asyncio.sleep(self.retry_policy.delay(attempt, retry_after))
+
+    async def stream_chat_completion(self, payload: Dict) -> AsyncIterator[str]:
+        """
+        Stream a chat completion, yielding content deltas as they arrive.
+
+        Only opening the stream is retried; once content has been yielded a
+        failure propagates, since the caller has already consumed part of it.
+
+        Raises:
+            httpx.HTTPError: If the stream cannot be opened after all retries
+        """
+        url = f"{self.base_url}/chat/completions"
+        payload = {**payload, "stream": True}
+        streamed = False
+        for attempt in range(self.retry_policy.max_retries + 1):
+            retry_after = None
+            try:
+                # Hold a slot only while connected, not while backing off
+                async with self._budget, self.client.stream("POST", url, json=payload) as response:
+                    if response.status_code not in self.retry_policy.retry_statuses:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            # Server-sent events: "data: {...}", ending with "data: [DONE]"
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                return
+                            choices = json.loads(data).get("choices") or [{}]
+                            content = (choices[0].get("delta") or {}).get("content")
+                            if content:
+                                streamed = True
+                                yield content
+                        return
+                    if attempt == self.retry_policy.max_retries:
+                        response.raise_for_status()
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except (httpx.ConnectError, httpx.TimeoutException):
+                if streamed or attempt == self.retry_policy.max_retries:
+                    raise
+
+            await asyncio.sleep(self.retry_policy.delay(attempt, retry_after))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+_clients: Dict[str, LLMClient] = {}
+_async_clients: Dict[str, AsyncLLMClient] = {}
+_budgets: Dict[str, ConcurrencyBudget] = {}
+_clients_lock = threading.Lock()
+
+def _get_budget(api_key: str, max_concurrency: int) -> ConcurrencyBudget:
+    """One concurrency budget per API key for the sync and async clients; call with _clients_lock held."""
+    if api_key not in _budgets:
+        _budgets[api_key] = ConcurrencyBudget(max_concurrency)
+    return _budgets[api_key]
+
+def get_llm_client(api_key: str, max_concurrency: int = 4, **kwargs) -> LLMClient:
+    """Get the shared client for an API key, creating it on first use."""
+    with _clients_lock:
+        if api_key not in _clients:
+            budget = _get_budget(api_key, max_concurrency)
+            _clients[api_key] = LLMClient(api_key, concurrency_budget=budget, **kwargs)
+        return _clients[api_key]
+
+def get_async_llm_client(api_key: str, max_concurrency: int = 4, **kwargs) -> AsyncLLMClient:
+    """Get the shared async client for an API key; call from the event loop that uses it."""
+    with _clients_lock:
+        if api_key not in _async_clients:
+            budget = _get_budget(api_key, max_concurrency)
+            _async_clients[api_key] = AsyncLLMClient(api_key, concurrency_budget=budget, **kwargs)
+        return _async_clients[api_key]
@@ -1,5 +1,9 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.config import Config
 from .routes import slm
 import logging
 
@@ -7,7 +11,33 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="TripBot API")
+config = Config(".env")
+SLM_MODEL_PATH = config("SLM_MODEL_PATH", default="")
+SLM_TOKENIZER_PATH = config("SLM_TOKENIZER_PATH", default="")
+SLM_WARMUP = config("SLM_WARMUP", cast=bool, default=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the local model once per worker before it accepts requests, and warm
+    it up so the first request doesn't pay for lazy initialization. Weights are
+    memory-mapped, so all workers share one copy of them.
+    """
+    app.state.model_interface = None
+    if SLM_MODEL_PATH:
+        from .ml.model_interface import get_shared_interface
+        
+        app.state.model_interface = await run_in_threadpool(
+            get_shared_interface,
+            SLM_MODEL_PATH,
+            SLM_TOKENIZER_PATH or os.path.join(os.path.dirname(SLM_MODEL_PATH), "tokenizer"),
+            warmup=SLM_WARMUP
+        )
+    yield
+    if app.state.model_interface is not None:
+        app.state.model_interface.close()
+
+app = FastAPI(title="TripBot API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
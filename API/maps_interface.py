@@ -1,19 +1,58 @@
+import math
 import os
-from typing import Dict, List, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 try:
     import googlemaps
+    from dotenv import load_dotenv
 except ImportError:
-    print("Please install googlemaps: pip install googlemaps")
+    print("Please install required packages: pip install googlemaps python-dotenv")
     raise
 
-# Initialize the Google Maps client
-MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", "YOUR_API_KEY_HERE")
-gmaps = googlemaps.Client(key=MAPS_API_KEY)
+from .services.place_store import PlaceStore
+
+# Google Maps client, created on first use so importing this module is cheap
+_gmaps: Optional[googlemaps.Client] = None
+_gmaps_lock = threading.Lock()
+
+def get_gmaps_client() -> googlemaps.Client:
+    """Get the shared Google Maps client, reading GOOGLE_MAPS_API_KEY on first use."""
+    global _gmaps
+    if _gmaps is None:
+        with _gmaps_lock:
+            if _gmaps is None:
+                load_dotenv()
+                _gmaps = googlemaps.Client(key=os.getenv("GOOGLE_MAPS_API_KEY", "YOUR_API_KEY_HERE"))
+    return _gmaps
+
+# Persistent place store; set PLACE_STORE_PATH to "" to disable it
+PLACE_STORE_PATH = os.getenv(
+    "PLACE_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "places.sqlite3")
+)
+_place_store: Optional[PlaceStore] = None
+_place_store_lock = threading.Lock()
+
+def get_place_store() -> Optional[PlaceStore]:
+    """Get the shared place store, opening it on first use."""
+    global _place_store
+    if not PLACE_STORE_PATH:
+        return None
+    if _place_store is None:
+        with _place_store_lock:
+            if _place_store is None:
+                _place_store = PlaceStore(PLACE_STORE_PATH)
+    return _place_store
 
 def get_place_details(location: str) -> Dict:
     """
     Get detailed information about a place using Google Places API.
     
+    Always a live search; only the place ID and coordinates are stored (see
+    get_place_location).
+    
     Args:
         location (str): Name of the location to search for
         
@@ -21,12 +60,14 @@ def get_place_details(location: str) -> Dict:
         Dict: Place details including coordinates and address
     """
     try:
+        store = get_place_store()
+        
         # Search for the place
-        places_result = gmaps.places(location)
+        places_result = get_gmaps_client().places(location)
         
         if places_result['status'] == 'OK' and len(places_result['results']) > 0:
             place = places_result['results'][0]
-            return {
+            details = {
                 'name': place['name'],
                 'address': place['formatted_address'],
                 'coordinates': {
@@ -35,11 +76,35 @@ def get_place_details(location: str) -> Dict:
                 },
                 'place_id': place['place_id']
             }
+            if store:
+                store.put_place(details, query_name=location)
+            return details
         return None
     except Exception as e:
         print(f"Error fetching place details: {str(e)}")
         raise
 
+def get_place_location(location: str) -> Optional[Dict]:
+    """
+    Get the place ID and coordinates for a location name, from the place
+    store when it has fresh coordinates, else with a live search.
+    
+    Args:
+        location (str): Name of the location to search for
+        
+    Returns:
+        Optional[Dict]: 'place_id' and 'coordinates', or None if not found
+    """
+    store = get_place_store()
+    if store:
+        cached = store.get_by_name(location)
+        if cached:
+            return cached
+    details = get_place_details(location)
+    if not details:
+        return None
+    return {'place_id': details['place_id'], 'coordinates': details['coordinates']}
+
 def calculate_distances(origins: List[Dict], destinations: List[Dict]) -> List[Dict]:
     """
     Calculate distances between consecutive locations using Google Distance Matrix API.
@@ -57,7 +122,7 @@ def calculate_distances(origins: List[Dict], destinations: List[Dict]) -> List[D
         dest_coords = [(loc['coordinates']['lat'], loc['coordinates']['lng']) for loc in destinations]
         
         # Get distance matrix
-        matrix = gmaps.distance_matrix(
+        matrix = get_gmaps_client().distance_matrix(
             origin_coords,
             dest_coords,
             mode="driving",
@@ -80,50 +145,248 @@ def calculate_distances(origins: List[Dict], destinations: List[Dict]) -> List[D
         print(f"Error calculating distances: {str(e)}")
         raise
 
-def find_nearby_hotels(location: Dict, radius_meters: int = 5000) -> List[Dict]:
+class RateLimiter:
+    """Thread-safe limiter that spaces calls to at most rate per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+# Shared by every enrich_places and calculate_leg_distances call that doesn't
+# bring its own limiter, so concurrent calls (e.g. several days enriched at
+# once) split one budget
+_default_rate_limiter = RateLimiter(10.0)
+
+# Distance Matrix request limits
+MAX_MATRIX_ELEMENTS = 100
+MAX_MATRIX_DIMENSION = 25
+
+def calculate_leg_distances(
+    stop_sequences: List[List[Dict]],
+    max_legs_per_request: Optional[int] = None,
+    max_elements: int = MAX_MATRIX_ELEMENTS,
+    max_dimension: int = MAX_MATRIX_DIMENSION,
+    max_workers: int = 8,
+    rate_limiter: Optional[RateLimiter] = None
+) -> List[List[Optional[Dict]]]:
+    """
+    Calculate the distance of every consecutive leg in one or more ordered
+    stop sequences (e.g. one per day), batching the legs of all sequences.
+    
+    k legs are one request with the legs' origins and destinations, whose
+    diagonal holds the leg results. Legs are independent, so the legs of
+    all sequences are packed into as few requests as the element limit
+    allows (k * k <= max_elements, i.e. 10 legs by default) and the
+    requests run concurrently. Google bills every element of the matrix:
+    a smaller max_legs_per_request bills fewer elements per leg at the
+    cost of more requests (1 bills one element per leg).
+    
+    Args:
+        stop_sequences (List[List[Dict]]): Ordered stops with coordinates, per sequence
+        max_legs_per_request (Optional[int]): Legs measured by one request,
+            defaults to as many as max_elements and max_dimension allow
+        max_elements (int): Maximum origins * destinations per request
+        max_dimension (int): Maximum origins or destinations per request
+        max_workers (int): Maximum number of concurrent requests
+        rate_limiter (Optional[RateLimiter]): Limiter shared with other calls,
+            defaults to the process-wide one
+        
+    Returns:
+        List[List[Optional[Dict]]]: For each sequence, one entry per leg with
+        'distance' and 'duration', or None if the leg could not be measured
+    """
+    results: List[List[Optional[Dict]]] = [
+        [None] * max(0, len(stops) - 1) for stops in stop_sequences
+    ]
+    chunk_size = min(max_dimension, math.isqrt(max_elements))
+    if max_legs_per_request:
+        chunk_size = min(chunk_size, max_legs_per_request)
+    chunk_size = max(1, chunk_size)
+    
+    # Legs whose two stops both have coordinates, from all sequences
+    legs = [
+        (seq_idx, leg_idx)
+        for seq_idx, stops in enumerate(stop_sequences)
+        for leg_idx in range(len(stops) - 1)
+        if stops[leg_idx].get('coordinates') and stops[leg_idx + 1].get('coordinates')
+    ]
+    chunks = [legs[i:i + chunk_size] for i in range(0, len(legs), chunk_size)]
+    if not chunks:
+        return results
+    
+    limiter = rate_limiter or _default_rate_limiter
+    
+    def coords(seq_idx: int, stop_idx: int) -> Tuple[float, float]:
+        location = stop_sequences[seq_idx][stop_idx]['coordinates']
+        return (location['lat'], location['lng'])
+    
+    def measure(chunk: List[Tuple[int, int]]) -> List[Optional[Dict]]:
+        limiter.acquire()
+        matrix = get_gmaps_client().distance_matrix(
+            [coords(seq_idx, leg_idx) for seq_idx, leg_idx in chunk],
+            [coords(seq_idx, leg_idx + 1) for seq_idx, leg_idx in chunk],
+            mode="driving",
+            units="metric"
+        )
+        if matrix['status'] != 'OK':
+            return [None] * len(chunk)
+        
+        measured = []
+        for i in range(len(chunk)):
+            element = matrix['rows'][i]['elements'][i]
+            measured.append({
+                'distance': element['distance']['text'],
+                'duration': element['duration']['text']
+            } if element['status'] == 'OK' else None)
+        return measured
+    
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            for chunk, measured in zip(chunks, executor.map(measure, chunks)):
+                for (seq_idx, leg_idx), leg in zip(chunk, measured):
+                    results[seq_idx][leg_idx] = leg
+        return results
+    except Exception as e:
+        print(f"Error calculating leg distances: {str(e)}")
+        raise
+
+# Only the Place Details fields find_nearby_hotels uses (billed per field group)
+HOTEL_DETAIL_FIELDS = [
+    'name',
+    'formatted_address',
+    'geometry/location',
+    'rating',
+    'price_level',
+    'place_id',
+    'website',
+    'formatted_phone_number'
+]
+
+def _hotel_rank(hotel: Dict) -> Tuple:
+    """Sort key: highest rating first, then cheapest; unknown price last."""
+    price_level = hotel.get('price_level')
+    return (-(hotel.get('rating') or 0), price_level if isinstance(price_level, int) else 99)
+
+def get_hotel_details(place_id: str) -> Dict:
+    """
+    Get website, phone and full address for one hotel (always live).
+    
+    Args:
+        place_id (str): Google Places place ID
+        
+    Returns:
+        Dict: Hotel with details ('details_loaded' is True)
+    """
+    try:
+        details = get_gmaps_client().place(place_id, fields=HOTEL_DETAIL_FIELDS)['result']
+        hotel = {
+            'name': details.get('name'),
+            'address': details.get('formatted_address'),
+            'coordinates': {
+                'lat': details['geometry']['location']['lat'],
+                'lng': details['geometry']['location']['lng']
+            },
+            'rating': details.get('rating'),
+            'price_level': details.get('price_level', 'N/A'),
+            'place_id': details.get('place_id', place_id),
+            'details_loaded': True
+        }
+        
+        # Add website and phone if available
+        if 'website' in details:
+            hotel['website'] = details['website']
+        if 'formatted_phone_number' in details:
+            hotel['phone'] = details['formatted_phone_number']
+            
+        store = get_place_store()
+        if store:
+            store.put_place(hotel)
+        return hotel
+    except Exception as e:
+        print(f"Error fetching hotel details: {str(e)}")
+        raise
+
+def find_nearby_hotels(
+    location: Dict,
+    radius_meters: int = 5000,
+    max_hotels: int = 5,
+    include_details: bool = True,
+    max_workers: int = 5
+) -> List[Dict]:
     """
     Find hotels near a specific location using Google Places API.
     
+    Hotels are ranked by rating and price level from the single nearby
+    search; details are fetched only for the top max_hotels, concurrently.
+    A hotel whose details can't be loaded is returned as found by the search.
+    With include_details=False no details are fetched at all and each hotel
+    has 'details_loaded': False, so the frontend can call get_hotel_details
+    (GET /api/slm/hotels/{place_id}) for the ones the user opens.
+    
     Args:
         location (Dict): Location dictionary with coordinates
         radius_meters (int): Search radius in meters
+        max_hotels (int): Maximum number of hotels to return
+        include_details (bool): Fetch website/phone/full address for each hotel
+        max_workers (int): Maximum number of concurrent detail lookups
         
     Returns:
-        List[Dict]: List of nearby hotels with details
+        List[Dict]: List of nearby hotels, best first
     """
     try:
         # Search for nearby hotels
-        places_result = gmaps.places_nearby(
+        places_result = get_gmaps_client().places_nearby(
             location=location['coordinates'],
             radius=radius_meters,
             type='lodging'
         )
         
-        hotels = []
+        candidates = []
         if places_result['status'] == 'OK':
             for place in places_result['results']:
-                # Get detailed information for each hotel
-                details = gmaps.place(place['place_id'])['result']
-                
-                hotel = {
-                    'name': details.get('name'),
-                    'address': details.get('formatted_address'),
+                candidates.append({
+                    'name': place.get('name'),
+                    'address': place.get('vicinity'),
                     'coordinates': {
-                        'lat': details['geometry']['location']['lat'],
-                        'lng': details['geometry']['location']['lng']
+                        'lat': place['geometry']['location']['lat'],
+                        'lng': place['geometry']['location']['lng']
                     },
-                    'rating': details.get('rating'),
-                    'price_level': details.get('price_level', 'N/A'),
-                    'place_id': details['place_id']
-                }
+                    'rating': place.get('rating'),
+                    'price_level': place.get('price_level', 'N/A'),
+                    'place_id': place['place_id'],
+                    'details_loaded': False
+                })
                 
-                # Add website and phone if available
-                if 'website' in details:
-                    hotel['website'] = details['website']
-                if 'formatted_phone_number' in details:
-                    hotel['phone'] = details['formatted_phone_number']
-                    
-                hotels.append(hotel)
+            store = get_place_store()
+            if store:
+                store.put_places(candidates)
+        
+        hotels = sorted(candidates, key=_hotel_rank)[:max_hotels]
+        if not include_details:
+            return hotels
+        
+        def load_details(hotel: Dict) -> Dict:
+            # A failed lookup keeps the search result ('details_loaded' stays
+            # False) instead of failing the whole list
+            try:
+                return get_hotel_details(hotel['place_id'])
+            except Exception as e:
+                print(f"Error loading details for hotel {hotel['place_id']}: {str(e)}")
+                return hotel
+        
+        # Get detailed information only for the top hotels, concurrently
+        if hotels:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(hotels))) as executor:
+                hotels = list(executor.map(load_details, hotels))
                 
         return hotels
     except Exception as e:
@@ -132,7 +395,10 @@ def find_nearby_hotels(location: Dict, radius_meters: int = 5000) -> List[Dict]:
 
 def get_place_photos(place_id: str, max_photos: int = 3) -> List[str]:
     """
-    Get photo references for a place using Google Places API.
+    Get photo URLs for a place using Google Places API.
+    
+    Always live: photo references may not be cached, and the URLs carry
+    the API key, so they are never stored.
     
     Args:
         place_id (str): Google Places place ID
@@ -143,7 +409,7 @@ def get_place_photos(place_id: str, max_photos: int = 3) -> List[str]:
     """
     try:
         # Get place details including photos
-        place_details = gmaps.place(
+        place_details = get_gmaps_client().place(
             place_id,
             fields=['photo']
         )
@@ -155,10 +421,53 @@ def get_place_photos(place_id: str, max_photos: int = 3) -> List[str]:
             for photo in photos:
                 if 'photo_reference' in photo:
                     # Construct the URL for the photo
-                    photo_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=800&photoreference={photo['photo_reference']}&key={MAPS_API_KEY}"
+                    photo_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=800&photoreference={photo['photo_reference']}&key={get_gmaps_client().key}"
                     photo_refs.append(photo_url)
                     
         return photo_refs
     except Exception as e:
         print(f"Error fetching place photos: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def enrich_places(
+    locations: List[str],
+    max_workers: int = 8,
+    rate_limiter: Optional[RateLimiter] = None,
+    max_photos: int = 3
+) -> Dict[str, Optional[Dict]]:
+    """
+    Look up details and photos for many locations concurrently.
+    
+    Duplicate names are looked up once. A failed lookup is logged and maps
+    to None, so one bad location never fails the whole batch.
+    
+    Args:
+        locations (List[str]): Location names, possibly repeated
+        max_workers (int): Maximum number of concurrent lookups
+        rate_limiter (Optional[RateLimiter]): Limiter shared with other calls,
+            defaults to a process-wide one allowing 10 requests per second
+        max_photos (int): Maximum number of photos per place
+        
+    Returns:
+        Dict[str, Optional[Dict]]: Place details (with 'photos') keyed by location name
+    """
+    unique_locations = list(dict.fromkeys(locations))
+    if not unique_locations:
+        return {}
+        
+    limiter = rate_limiter or _default_rate_limiter
+    
+    def lookup(location: str) -> Optional[Dict]:
+        try:
+            limiter.acquire()
+            place_details = get_place_location(location)
+            if place_details:
+                limiter.acquire()
+                place_details['photos'] = get_place_photos(place_details['place_id'], max_photos)
+            return place_details
+        except Exception as e:
+            print(f"Error enriching {location}: {str(e)}")
+            return None
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_locations))) as executor:
+        return dict(zip(unique_locations, executor.map(lookup, unique_locations)))
@@ -2,8 +2,20 @@
 TripBot ML Package for itinerary generation
 """
 
-from .model import ItineraryEncoderDecoder
-from .tokenizer import ItineraryTokenizer
-from .model_interface import ModelInterface
+import importlib
 
-__all__ = ['ItineraryEncoderDecoder', 'ItineraryTokenizer', 'ModelInterface']
\ No newline at end of file
+# Imported on first use so that importing the package does not load torch
+_LAZY_ATTRIBUTES = {
+    'ItineraryEncoderDecoder': '.model',
+    'ItineraryTokenizer': '.tokenizer',
+    'ModelInterface': '.model_interface',
+}
+
+__all__ = ['ItineraryEncoderDecoder', 'ItineraryTokenizer', 'ModelInterface']
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,149 @@
+import threading
+import queue
+import time
+import logging
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class MicroBatchScheduler:
+    """
+    Collects concurrent requests into micro-batches and runs them through a
+    single batched function on a dedicated worker thread.
+
+    A batch is dispatched as soon as it reaches max_batch_size, or when the
+    oldest queued request has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        name: str = "micro-batch-scheduler"
+    ):
+        """
+        Args:
+            batch_fn (Callable): Takes a list of items and returns one result per item.
+                A returned Exception instance fails only that item's future.
+            max_batch_size (int): Maximum number of items per batch
+            max_wait_ms (float): Maximum time to wait for a batch to fill up
+            name (str): Name of the worker thread
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+
+        # Tuning statistics
+        self.batch_size_histogram: Counter = Counter()
+        self.queue_depth_histogram: Counter = Counter()
+        self.total_batches = 0
+        self.total_items = 0
+        self.total_wait = 0.0
+        self.max_queue_depth = 0
+
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item and return a future resolved with its result"""
+        if self._closed:
+            raise RuntimeError("Scheduler is closed")
+
+        future: Future = Future()
+        self._queue.put((item, future, time.monotonic()))
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self.queue_depth_histogram[depth] += 1
+        return future
+
+    def _collect_batch(self) -> Optional[List[tuple]]:
+        """Block for the first request, then gather more until full or timed out"""
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                # Finish this batch, then stop
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            # Skip requests whose callers already gave up
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            dispatch_time = time.monotonic()
+            with self._stats_lock:
+                self.batch_size_histogram[len(batch)] += 1
+                self.total_batches += 1
+                self.total_items += len(batch)
+                self.total_wait += sum(dispatch_time - entry[2] for entry in batch)
+
+            try:
+                results = self.batch_fn([entry[0] for entry in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"Batch function returned {len(results)} results for {len(batch)} items"
+                    )
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} failed: {str(e)}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def get_stats(self) -> Dict:
+        """Get queue depth and batch size statistics; queue depths are as seen by each submit"""
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'queue_depth_histogram': dict(sorted(self.queue_depth_histogram.items())),
+                'total_batches': self.total_batches,
+                'average_batch_size': self.total_items / max(1, self.total_batches),
+                'average_wait_ms': 1000.0 * self.total_wait / max(1, self.total_items),
+                'batch_size_histogram': dict(sorted(self.batch_size_histogram.items()))
+            }
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop accepting requests and wait for queued batches to finish"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
@@ -0,0 +1,160 @@
+"""
+Resumable training checkpoints, written in the background.
+
+A checkpoint is a directory, step_<optimizer step>/, holding
+    state.pt             model, optimizer, scheduler, scaler and loop position (rank 0)
+    rng_rank<r>.pt       RNG state of each rank
+    done_rank<r>_of_<n>  written by each of n ranks once its files are on disk
+
+Only directories with every rank's marker count as complete, so a run
+killed mid-write resumes from the previous checkpoint instead.
+"""
+import logging
+import random
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+try:
+    from numpy._core.multiarray import _reconstruct
+except ImportError:  # numpy < 2
+    from numpy.core.multiarray import _reconstruct
+
+logger = logging.getLogger(__name__)
+
+# Besides tensors and plain containers, checkpoints hold numpy's RNG state
+# array; allowlisting just these keeps weights_only loading
+_CHECKPOINT_GLOBALS = [_reconstruct, np.ndarray, np.dtype, type(np.dtype(np.uint32))]
+
+def capture_rng_state() -> Dict[str, Any]:
+    """RNG state of python, numpy and torch (CPU and CUDA)"""
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def restore_rng_state(state: Dict[str, Any]):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def _snapshot(value: Any) -> Any:
+    """Copy of a (nested) state dict with every tensor cloned to CPU"""
+    if isinstance(value, torch.Tensor):
+        return value.detach().to('cpu', copy=True)
+    if isinstance(value, dict):
+        return {key: _snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_snapshot(item) for item in value)
+    return value
+
+class CheckpointManager:
+    """
+    Saves and finds training checkpoints under directory.
+
+    save() copies the state to CPU on the calling thread, which is quick,
+    and writes it to disk on a background thread while training goes on.
+    At most one save is in flight; a new save waits for the previous one.
+    Rank 0 then deletes all but the newest keep_last complete checkpoints.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        keep_last: int = 3,
+        rank: int = 0,
+        world_size: int = 1
+    ):
+        self.directory = Path(directory)
+        self.keep_last = keep_last
+        self.rank = rank
+        self.world_size = world_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-writer')
+        self._pending: Optional[Future] = None
+
+    @staticmethod
+    def _is_complete(path: Path) -> bool:
+        if not (path / 'state.pt').exists():
+            return False
+        markers = [marker.name for marker in path.glob('done_rank*_of_*')]
+        return bool(markers) and len(markers) == int(markers[0].rsplit('_', 1)[1])
+
+    def checkpoints(self) -> List[Path]:
+        """Complete checkpoints, oldest first"""
+        return sorted(path for path in self.directory.glob('step_*') if path.is_dir() and self._is_complete(path))
+
+    def latest(self) -> Optional[Path]:
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, step: int, state: Dict[str, Any]) -> Future:
+        """
+        Write a checkpoint for optimizer step in the background.
+
+        Args:
+            step: Global optimizer step, used to name and order checkpoints
+            state: Training state; only rank 0's is written, other ranks
+                contribute their RNG state
+
+        Returns:
+            Future: Resolved with the checkpoint path once written
+        """
+        self.wait()
+        path = self.directory / f'step_{step:08d}'
+        snapshot = _snapshot(state) if self.rank == 0 else None
+        rng_state = capture_rng_state()
+        self._pending = self._executor.submit(self._write, path, snapshot, rng_state)
+        return self._pending
+
+    def _write(self, path: Path, snapshot: Optional[Dict[str, Any]], rng_state: Dict[str, Any]) -> Path:
+        path.mkdir(parents=True, exist_ok=True)
+        if snapshot is not None:
+            # Write under a temporary name so a partial file is never loaded
+            torch.save(snapshot, path / 'state.pt.tmp')
+            (path / 'state.pt.tmp').replace(path / 'state.pt')
+        torch.save(rng_state, path / f'rng_rank{self.rank}.pt')
+        (path / f'done_rank{self.rank}_of_{self.world_size}').touch()
+
+        if self.rank == 0:
+            self._prune()
+        logger.info(f'Wrote checkpoint {path}')
+        return path
+
+    def _prune(self):
+        """Delete old complete checkpoints; incomplete ones may still be in progress"""
+        checkpoints = self.checkpoints()
+        for path in checkpoints[:max(0, len(checkpoints) - self.keep_last)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def wait(self):
+        """Block until the in-flight save (if any) is on disk, re-raising its error"""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def load(self, path: Union[str, Path], map_location: Any = 'cpu') -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Load a checkpoint's training state and this rank's RNG state (None if
+        the checkpoint was written by fewer ranks).
+        """
+        path = Path(path)
+        rng_path = path / f'rng_rank{self.rank}.pt'
+        with torch.serialization.safe_globals(_CHECKPOINT_GLOBALS):
+            state = torch.load(path / 'state.pt', map_location=map_location, weights_only=True)
+            rng_state = torch.load(rng_path, weights_only=True) if rng_path.exists() else None
+        return state, rng_state
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
@@ -0,0 +1,506 @@
+"""
+Grammar-constrained decoding: at every step, logits of tokens that cannot
+continue a valid itinerary are masked out, so the model's output always
+parses as JSON in the itinerary's structure (unless it runs out of
+max_length first).
+
+The grammar is a character-level pushdown automaton compiled from a small
+JSON-schema subset (object, array, string, number, integer). Output follows
+json.dumps formatting - ", " and ": " separators, properties in schema order -
+which is how the training targets are serialized. For each grammar state,
+the set of allowed tokens is found by walking a prefix tree of the
+vocabulary, and cached.
+"""
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+ITINERARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "destination": {"type": "string"},
+        "hotels": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "location": {"$ref": "coordinates"},
+                    "price": {"type": "string"},
+                    "distance": {"type": "string"}
+                },
+                "required": ["name"]
+            }
+        },
+        "days": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "day": {"type": "integer"},
+                    "activities": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "time": {"type": "string"},
+                                "location": {"type": "string"},
+                                "coordinates": {"$ref": "coordinates"},
+                                "description": {"type": "string"},
+                                "cost": {"type": "string"},
+                                "distance_from_prev": {"type": "string"}
+                            },
+                            "required": ["time", "location", "description"]
+                        }
+                    }
+                },
+                "required": ["day", "activities"]
+            }
+        }
+    },
+    "required": ["destination", "hotels", "days"],
+    "definitions": {
+        "coordinates": {
+            "type": "object",
+            "properties": {
+                "lat": {"type": "number"},
+                "lng": {"type": "number"}
+            },
+            "required": ["lat", "lng"]
+        }
+    }
+}
+
+# Longest string and number values the grammar lets the model write
+MAX_STRING_LENGTH = 256
+MAX_NUMBER_LENGTH = 24
+
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+_DIGITS = frozenset("0123456789")
+_NUMBER_END = frozenset(["zero", "int", "frac", "exp"])
+# Number phase after a digit; a leading zero can't be followed by more digits
+_AFTER_DIGIT = {"int": "int", "dot": "frac", "frac": "frac", "e": "exp", "esign": "exp", "exp": "exp"}
+
+def itinerary_schema(num_days: Optional[int] = None) -> Dict[str, Any]:
+    """The itinerary schema, requiring exactly num_days days if given"""
+    schema = copy.deepcopy(ITINERARY_SCHEMA)
+    if num_days:
+        days = schema["properties"]["days"]
+        days["minItems"] = days["maxItems"] = num_days
+    return schema
+
+def _is_plain(text: str) -> bool:
+    """True if text can appear inside a JSON string without escaping"""
+    return all(char >= " " and char not in '"\\' for char in text)
+
+class TokenVocabulary:
+    """
+    Decoded text of every token, indexed for fast allowed-token lookups.
+
+    Tokens are stored in a prefix tree TREE_DEPTH characters deep; longer
+    tokens keep the rest of their text at the deepest node and are checked
+    one by one. Special tokens and tokens without text are never allowed.
+    """
+
+    TREE_DEPTH = 3
+
+    def __init__(self, token_strings: Sequence[str], eos_token_id: int, special_token_ids: Sequence[int] = ()):
+        """
+        Args:
+            token_strings (Sequence[str]): Text of each token id, e.g. from
+                ItineraryTokenizer.token_strings()
+            eos_token_id (int): Token allowed once the output is complete
+            special_token_ids (Sequence[int]): Tokens never allowed inside the output
+        """
+        self.size = len(token_strings)
+        self.eos_token_id = eos_token_id
+        special = set(special_token_ids) | {eos_token_id}
+
+        # node = (children by character, ids ending here, (id, remaining text) of longer ids)
+        self.root: Tuple[Dict[str, tuple], List[int], List[Tuple[int, str]]] = ({}, [], [])
+        self.max_token_length = 1
+        plain_lengths = torch.full((self.size,), torch.iinfo(torch.long).max, dtype=torch.long)
+        self.escaped: List[Tuple[int, str]] = []
+
+        for token_id, text in enumerate(token_strings):
+            if token_id in special or not text:
+                continue
+            self.max_token_length = max(self.max_token_length, len(text))
+            if _is_plain(text):
+                plain_lengths[token_id] = len(text)
+            else:
+                self.escaped.append((token_id, text))
+
+            node = self.root
+            for char in text[:self.TREE_DEPTH]:
+                node = node[0].setdefault(char, ({}, [], []))
+            if len(text) <= self.TREE_DEPTH:
+                node[1].append(token_id)
+            else:
+                node[2].append((token_id, text[self.TREE_DEPTH:]))
+
+        # Length of each token that can go into a string as-is; others are too long to ever fit
+        self.plain_lengths = plain_lengths
+
+class JSONSchemaGrammar:
+    """
+    Pushdown automaton accepting json.dumps-formatted JSON that matches a schema.
+
+    A state is a tuple of frames, innermost last; the empty tuple means a
+    complete document. Frames are plain tuples so states can key a cache:
+
+        ("v", node)                              a value of node comes next
+        ("s", remaining, escape)                 inside a string
+        ("n", integer, remaining, phase)         inside a number
+        ("o", node, last, phase, typed)          inside an object
+        ("a", node, need, left, phase)           inside an array
+
+    Objects write their properties in schema order and may skip optional
+    ones. Arrays count how many items they still need (minItems) and may
+    still take (maxItems, None if unbounded).
+    """
+
+    def __init__(self, schema: Dict[str, Any], vocabulary: TokenVocabulary, cache_size: int = 4096):
+        """
+        Args:
+            schema (Dict): JSON schema using object, array, string, number and
+                integer types, required, minItems/maxItems, maxLength and
+                $ref to entries of "definitions"
+            vocabulary (TokenVocabulary): Tokens the masks are computed over
+            cache_size (int): Number of allowed-token sets to keep
+        """
+        self.vocabulary = vocabulary
+        self.cache_size = cache_size
+        self._definitions = schema.get("definitions", {})
+        self._nodes: List[tuple] = []
+        self._keys: Dict[Tuple[int, int], List[Tuple[str, int, int]]] = {}
+        self._closable: Dict[Tuple[int, int], bool] = {}
+        self.root = self._compile(schema)
+
+        # Counters above these values behave the same for any single token
+        self._length_clamp = vocabulary.max_token_length
+        self._count_clamp = vocabulary.max_token_length // 3 + 2
+
+        self._masks: "OrderedDict[tuple, Tuple[bool, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _compile(self, schema: Dict[str, Any]) -> int:
+        """Add a schema node (and its children) and return its id"""
+        if "$ref" in schema:
+            schema = self._definitions[schema["$ref"].split("/")[-1]]
+
+        node_type = schema.get("type")
+        node_id = len(self._nodes)
+        self._nodes.append(())
+
+        if node_type == "object":
+            required = set(schema.get("required", []))
+            properties = tuple(
+                (name, self._compile(child), name in required)
+                for name, child in schema.get("properties", {}).items()
+            )
+            self._nodes[node_id] = ("object", properties)
+            for last in range(-1, len(properties)):
+                following = properties[last + 1:]
+                candidates = []
+                for offset, (name, child, is_required) in enumerate(following):
+                    candidates.append((f'"{name}": ', last + 1 + offset, child))
+                    if is_required:
+                        break
+                self._keys[(node_id, last)] = candidates
+                self._closable[(node_id, last)] = not any(is_required for _, _, is_required in following)
+        elif node_type == "array":
+            item = self._compile(schema.get("items", {"type": "string"}))
+            self._nodes[node_id] = ("array", item, schema.get("minItems", 0), schema.get("maxItems"))
+        elif node_type == "string":
+            self._nodes[node_id] = ("string", schema.get("maxLength", MAX_STRING_LENGTH))
+        elif node_type in ("number", "integer"):
+            self._nodes[node_id] = ("number", node_type == "integer")
+        else:
+            raise ValueError(f"Unsupported schema type: {node_type}")
+        return node_id
+
+    def initial_state(self) -> tuple:
+        return (("v", self.root),)
+
+    @staticmethod
+    def is_complete(state: Optional[tuple]) -> bool:
+        return state == ()
+
+    def _start_value(self, node_id: int, char: str) -> Optional[tuple]:
+        """Frames for a value of node_id that begins with char"""
+        node = self._nodes[node_id]
+        kind = node[0]
+        if kind == "string":
+            return (("s", node[1], 0),) if char == '"' else None
+        if kind == "number":
+            if char == "-":
+                phase = "sign"
+            elif char == "0":
+                phase = "zero"
+            elif char in _DIGITS:
+                phase = "int"
+            else:
+                return None
+            return (("n", node[1], MAX_NUMBER_LENGTH - 1, phase),)
+        if kind == "object":
+            return (("o", node_id, -1, "open", ""),) if char == "{" else None
+        if kind == "array":
+            return (("a", node_id, node[2], node[3], "open"),) if char == "[" else None
+        return None
+
+    def advance(self, state: Optional[tuple], char: str) -> Optional[tuple]:
+        """The state after writing char, or None if char isn't allowed"""
+        while state:
+            frame = state[-1]
+            kind = frame[0]
+
+            if kind == "v":
+                started = self._start_value(frame[1], char)
+                return state[:-1] + started if started else None
+
+            if kind == "s":
+                _, remaining, escape = frame
+                if escape == 0:
+                    if char == '"':
+                        return state[:-1]
+                    if remaining <= 0 or char < " ":
+                        return None
+                    return state[:-1] + (("s", remaining - 1, -1 if char == "\\" else 0),)
+                if escape == -1:
+                    if char == "u":
+                        return state[:-1] + (("s", remaining - 1, 4),)
+                    if char in '"\\/bfnrt':
+                        return state[:-1] + (("s", remaining - 1, 0),)
+                    return None
+                if char in _HEX_DIGITS:
+                    return state[:-1] + (("s", remaining - 1, escape - 1),)
+                return None
+
+            if kind == "n":
+                _, integer, remaining, phase = frame
+                next_phase = None
+                if remaining > 0:
+                    if char in _DIGITS:
+                        if phase == "sign":
+                            next_phase = "zero" if char == "0" else "int"
+                        else:
+                            next_phase = _AFTER_DIGIT.get(phase)
+                    elif char == "." and phase in ("zero", "int") and not integer:
+                        next_phase = "dot"
+                    elif char in "eE" and phase in ("zero", "int", "frac") and not integer:
+                        next_phase = "e"
+                    elif char in "+-" and phase == "e":
+                        next_phase = "esign"
+                if next_phase is not None:
+                    return state[:-1] + (("n", integer, remaining - 1, next_phase),)
+                if phase not in _NUMBER_END:
+                    return None
+                # The number ended; char belongs to the enclosing object or array
+                state = state[:-1]
+                continue
+
+            if kind == "o":
+                _, node_id, last, phase, typed = frame
+                if phase in ("open", "after") and char == "}":
+                    return state[:-1] if self._closable[(node_id, last)] else None
+                if phase == "after":
+                    if char == "," and self._keys[(node_id, last)]:
+                        return state[:-1] + (("o", node_id, last, "comma", ""),)
+                    return None
+                if phase == "comma":
+                    return state[:-1] + (("o", node_id, last, "key", ""),) if char == " " else None
+
+                # Writing a property name, '"name": ' in full
+                typed += char
+                for literal, index, child in self._keys[(node_id, last)]:
+                    if literal == typed:
+                        return state[:-1] + (("o", node_id, index, "after", ""), ("v", child))
+                    if literal.startswith(typed):
+                        return state[:-1] + (("o", node_id, last, "key", typed),)
+                return None
+
+            if kind == "a":
+                _, node_id, need, left, phase = frame
+                if phase in ("open", "after") and char == "]":
+                    return state[:-1] if need == 0 else None
+                if phase == "after":
+                    if char == "," and left != 0:
+                        return state[:-1] + (("a", node_id, need, left, "comma"),)
+                    return None
+                if phase == "comma":
+                    return state[:-1] + (("a", node_id, need, left, "item"),) if char == " " else None
+
+                # First character of the next item
+                if left == 0:
+                    return None
+                started = self._start_value(self._nodes[node_id][1], char)
+                if started is None:
+                    return None
+                counted = ("a", node_id, max(need - 1, 0), None if left is None else left - 1, "after")
+                return state[:-1] + (counted,) + started
+
+        return None
+
+    def advance_text(self, state: Optional[tuple], text: str) -> Optional[tuple]:
+        """The state after writing text, or None if any of it isn't allowed"""
+        for char in text:
+            state = self.advance(state, char)
+            if state is None:
+                return None
+        return state
+
+    def _mask_key(self, state: tuple) -> tuple:
+        """
+        State with its counters clamped: beyond the longest token, a larger
+        remaining length or item count can't change which tokens fit.
+        """
+        clamped = []
+        for frame in state:
+            kind = frame[0]
+            if kind == "s":
+                frame = ("s", min(frame[1], self._length_clamp), frame[2])
+            elif kind == "a" and frame[3] is not None:
+                frame = frame[:2] + (min(frame[2], self._count_clamp), min(frame[3], self._count_clamp), frame[4])
+            elif kind == "a":
+                frame = frame[:2] + (min(frame[2], self._count_clamp),) + frame[3:]
+            clamped.append(frame)
+        return tuple(clamped)
+
+    def _walk(self, node: tuple, state: tuple, allowed: List[int]):
+        for char, child in node[0].items():
+            next_state = self.advance(state, char)
+            if next_state is None:
+                continue
+            allowed.extend(child[1])
+            for token_id, rest in child[2]:
+                if self.advance_text(next_state, rest) is not None:
+                    allowed.append(token_id)
+            self._walk(child, next_state, allowed)
+
+    def _compute_allowed(self, state: tuple) -> Tuple[bool, torch.Tensor]:
+        """(True, allowed ids) or, for dense sets, (False, disallowed ids)"""
+        vocabulary = self.vocabulary
+        if self.is_complete(state):
+            return True, torch.tensor([vocabulary.eos_token_id])
+
+        frame = state[-1]
+        if frame[0] == "s" and frame[2] == 0:
+            # Inside a string nearly every token fits; only look at those
+            # that need escaping or would end the string
+            fits = vocabulary.plain_lengths <= max(frame[1], 0)
+            for token_id, text in vocabulary.escaped:
+                fits[token_id] = self.advance_text(state, text) is not None
+            return False, (~fits).nonzero().flatten()
+
+        allowed: List[int] = []
+        self._walk(vocabulary.root, state, allowed)
+        return True, torch.tensor(sorted(allowed), dtype=torch.long)
+
+    def allowed_tokens(self, state: Optional[tuple]) -> Tuple[bool, torch.Tensor]:
+        """
+        Tokens that may follow state.
+
+        Returns:
+            Tuple[bool, torch.Tensor]: (True, allowed token ids) or
+            (False, disallowed token ids), whichever is shorter to store
+        """
+        if state is None:
+            return False, torch.empty(0, dtype=torch.long)
+
+        key = self._mask_key(state)
+        with self._lock:
+            cached = self._masks.get(key)
+            if cached is not None:
+                self._masks.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+
+        result = self._compute_allowed(key)
+        if result[1].numel() == (0 if result[0] else self.vocabulary.size):
+            # Dead end: stop here; the output fails validation downstream
+            result = (True, torch.tensor([self.vocabulary.eos_token_id]))
+
+        with self._lock:
+            self.cache_misses += 1
+            self._masks[key] = result
+            while len(self._masks) > self.cache_size:
+                self._masks.popitem(last=False)
+        return result
+
+class JSONConstraintProcessor:
+    """
+    Logits processor for ItineraryEncoderDecoder.generate that masks tokens
+    the grammar of each sequence doesn't allow.
+
+    States are tracked per generated prefix, so beam reordering needs no
+    extra bookkeeping. Rows that are already dead (a beam forced onto an
+    invalid token) are left unconstrained; their score is -inf anyway.
+    """
+
+    def __init__(self, grammars: Sequence[JSONSchemaGrammar], token_strings: Sequence[str], pad_token_id: int):
+        """
+        Args:
+            grammars (Sequence[JSONSchemaGrammar]): One grammar per source sequence
+            token_strings (Sequence[str]): Text of each token id
+            pad_token_id (int): Token written after a sequence has finished
+        """
+        self.grammars = list(grammars)
+        self.token_strings = token_strings
+        self.pad_token_id = pad_token_id
+        self._states: Dict[bytes, Optional[tuple]] = {}
+
+    def _next_state(self, grammar: JSONSchemaGrammar, state: Any, token_id: int) -> Any:
+        if state is None or state == "finished":
+            return state
+        if token_id == grammar.vocabulary.eos_token_id:
+            return "finished" if grammar.is_complete(state) else None
+        if token_id == self.pad_token_id:
+            return None
+        return grammar.advance_text(state, self.token_strings[token_id])
+
+    def __call__(self, input_ids: torch.Tensor, logits: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            input_ids (torch.Tensor): Start token and generated tokens, (rows, length)
+            logits (torch.Tensor): Next-token logits, (rows, vocab_size)
+
+        Returns:
+            torch.Tensor: logits with disallowed tokens set to -inf
+        """
+        num_beams = max(1, input_ids.size(0) // len(self.grammars))
+        generated = input_ids[:, 1:].cpu().contiguous().numpy()
+        bias = torch.zeros(logits.shape, dtype=logits.dtype)
+        states: Dict[bytes, Any] = {}
+
+        for row in range(generated.shape[0]):
+            grammar = self.grammars[row // num_beams]
+            key = generated[row].tobytes()
+            if key not in states:
+                if generated.shape[1] == 0:
+                    state = grammar.initial_state()
+                else:
+                    parent = self._states.get(generated[row, :-1].tobytes(), None)
+                    state = self._next_state(grammar, parent, int(generated[row, -1]))
+                states[key] = state
+            state = states[key]
+
+            if state == "finished":
+                bias[row] = float("-inf")
+                bias[row, [self.pad_token_id, grammar.vocabulary.eos_token_id]] = 0
+            elif state is not None:
+                is_allowlist, token_ids = grammar.allowed_tokens(state)
+                token_ids = token_ids[token_ids < logits.size(1)]
+                if is_allowlist:
+                    bias[row] = float("-inf")
+                    bias[row, token_ids] = 0
+                else:
+                    bias[row, token_ids] = float("-inf")
+
+        self._states = states
+        return logits + bias.to(logits.device)
@@ -0,0 +1,125 @@
+"""
+Export CPU inference variants of a trained checkpoint: dynamically
+quantized (int8 LSTM and Linear weights) and/or TorchScript-traced, checked
+for parity against the fp32 model on a held-out set before saving.
+
+    python -m API.ml.export --checkpoint checkpoints/best_model.pt \
+        --tokenizer checkpoints/tokenizer --heldout data/processed/test \
+        --output checkpoints/model_int8.pt --quantize --torchscript
+
+The output loads with ItineraryEncoderDecoder.from_pretrained like any
+other checkpoint. Compare variants with python -m API.benchmarks.inference.
+"""
+import itertools
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Union
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from .model import ItineraryEncoderDecoder, TracedItineraryEncoderDecoder
+from .model_interface import format_model_input
+from .prepare_data import iter_records
+from ..openAIAPI import TravelPreferences
+
+logger = logging.getLogger(__name__)
+
+def export_model(
+    model: ItineraryEncoderDecoder,
+    quantize: bool = True,
+    torchscript: bool = True
+) -> ItineraryEncoderDecoder:
+    """Build the requested inference variant of an fp32 model."""
+    variant = model.quantize_dynamic() if quantize else model.cpu().eval()
+    if torchscript:
+        variant = TracedItineraryEncoderDecoder.trace(variant)
+    return variant
+
+def load_heldout_inputs(path: Union[str, Path], tokenizer, limit: int = 200) -> List[torch.Tensor]:
+    """Tokenized model inputs from a held-out split written by prepare_data."""
+    inputs = []
+    for record in itertools.islice(iter_records(path), limit):
+        preferences = TravelPreferences(
+            destination=record['input'].get('destination'),
+            group_type=record['input']['group_type'],
+            num_days=record['input']['num_days'],
+            budget=record['input']['budget'],
+            num_people=record['input']['num_people']
+        )
+        inputs.append(torch.tensor(tokenizer.encode(format_model_input(preferences), padding=False)))
+    return inputs
+
+@torch.inference_mode()
+def parity_check(
+    reference: ItineraryEncoderDecoder,
+    candidate: ItineraryEncoderDecoder,
+    inputs: List[torch.Tensor],
+    pad_token_id: int,
+    max_length: int = 128,
+    batch_size: int = 8
+) -> Dict[str, float]:
+    """
+    Compare greedy generations of candidate against reference.
+
+    Returns:
+        Dict: exact_match (share of identical sequences) and token_agreement
+        (share of positions where both models chose the same token)
+    """
+    reference, candidate = reference.cpu().eval(), candidate.cpu().eval()
+    matches, agreeing, total = 0, 0, 0
+    for start in range(0, len(inputs), batch_size):
+        src_tokens = pad_sequence(inputs[start:start + batch_size], batch_first=True, padding_value=pad_token_id)
+        expected = reference.generate(src_tokens, max_length=max_length, pad_token_id=pad_token_id)
+        actual = candidate.generate(src_tokens, max_length=max_length, pad_token_id=pad_token_id)
+
+        # Sequences may stop at different steps; compare over the longer one
+        length = max(expected.size(1), actual.size(1))
+        expected = torch.nn.functional.pad(expected, (0, length - expected.size(1)), value=pad_token_id)
+        actual = torch.nn.functional.pad(actual, (0, length - actual.size(1)), value=pad_token_id)
+
+        same = expected.eq(actual)
+        matches += int(same.all(dim=1).sum())
+        agreeing += int(same.sum())
+        total += same.numel()
+
+    return {
+        'examples': len(inputs),
+        'exact_match': matches / max(1, len(inputs)),
+        'token_agreement': agreeing / max(1, total)
+    }
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    from .tokenizer import ItineraryTokenizer
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', type=str, required=True)
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--tokenizer', type=str, required=True)
+    parser.add_argument('--heldout', type=str, required=True)
+    parser.add_argument('--quantize', action='store_true')
+    parser.add_argument('--torchscript', action='store_true')
+    parser.add_argument('--max_examples', type=int, default=200)
+    parser.add_argument('--max_length', type=int, default=128)
+    parser.add_argument('--min_token_agreement', type=float, default=0.95)
+    args = parser.parse_args()
+
+    tokenizer = ItineraryTokenizer.from_pretrained(args.tokenizer)
+    reference = ItineraryEncoderDecoder.from_pretrained(args.checkpoint)
+    candidate = export_model(reference, quantize=args.quantize, torchscript=args.torchscript)
+
+    inputs = load_heldout_inputs(args.heldout, tokenizer, args.max_examples)
+    parity = parity_check(reference, candidate, inputs, tokenizer.pad_token_id, args.max_length)
+    logger.info(f"Parity on {parity['examples']} held-out examples: {json.dumps(parity)}")
+
+    if parity['token_agreement'] < args.min_token_agreement:
+        logger.error(f"Token agreement below {args.min_token_agreement}; not saving {args.output}")
+        sys.exit(1)
+
+    candidate.save_pretrained(args.output)
+    logger.info(f'Saved {args.output}')
@@ -1,8 +1,15 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from typing import Dict, Optional, Union
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+from typing import Callable, Dict, Optional, Union
+import copy
 import json
+import zipfile
+
+# Checkpoint weight formats
+FORMAT_FP32 = 'fp32'
+FORMAT_DYNAMIC_INT8 = 'dynamic_int8'
 
 class ItineraryEncoderDecoder(nn.Module):
     def __init__(
@@ -11,10 +18,18 @@ class ItineraryEncoderDecoder(nn.Module):
         embed_dim: int = 256,
         hidden_dim: int = 512,
         num_layers: int = 4,
-        dropout: float = 0.1
+        dropout: float = 0.1,
+        pad_token_id: Optional[int] = None,
+        bos_token_id: Optional[int] = None,
+        eos_token_id: Optional[int] = None
     ):
         super().__init__()
         
+        # Special token ids used by generate()
+        self.pad_token_id = pad_token_id
+        self.bos_token_id = bos_token_id
+        self.eos_token_id = eos_token_id
+        
         # Embeddings
         self.embedding = nn.Embedding(vocab_size, embed_dim)
         
@@ -44,36 +59,64 @@ class ItineraryEncoderDecoder(nn.Module):
         self.layer_norm = nn.LayerNorm(embed_dim)
         self.dropout = nn.Dropout(dropout)
 
-    def encode(self, src_tokens: torch.Tensor) -> tuple:
+    def encode(self, src_tokens: torch.Tensor, src_lengths: Optional[torch.Tensor] = None) -> tuple:
         # Embed source tokens
         embedded = self.dropout(self.layer_norm(self.embedding(src_tokens)))
         
-        # Pass through encoder
-        encoder_out, (hidden, cell) = self.encoder(embedded)
+        # Pass through encoder; with lengths, padding is packed away so the
+        # LSTM skips it and the backward direction starts at the last real token
+        if src_lengths is None:
+            encoder_out, (hidden, cell) = self.encoder(embedded)
+        else:
+            packed = pack_padded_sequence(embedded, src_lengths.cpu(), batch_first=True, enforce_sorted=False)
+            encoder_out, (hidden, cell) = self.encoder(packed)
+            encoder_out, _ = pad_packed_sequence(encoder_out, batch_first=True, total_length=src_tokens.size(1))
         
         return encoder_out, hidden, cell
 
+    def _bridge_state(self, hidden: torch.Tensor, cell: torch.Tensor) -> tuple:
+        """Merge bidirectional encoder states into the decoder's layout"""
+        # (num_layers * 2, batch, hidden) -> (num_layers, batch, hidden * 2)
+        num_layers = hidden.size(0) // 2
+        batch_size = hidden.size(1)
+        hidden = hidden.view(num_layers, 2, batch_size, -1).transpose(1, 2)
+        cell = cell.view(num_layers, 2, batch_size, -1).transpose(1, 2)
+        return (
+            hidden.reshape(num_layers, batch_size, -1).contiguous(),
+            cell.reshape(num_layers, batch_size, -1).contiguous()
+        )
+
     def decode(
         self, 
         prev_output: torch.Tensor,
         encoder_out: torch.Tensor,
         hidden: torch.Tensor,
-        cell: torch.Tensor
+        cell: torch.Tensor,
+        src_mask: Optional[torch.Tensor] = None,
+        tgt_lengths: Optional[torch.Tensor] = None
     ) -> tuple:
         # Embed previous output
         embedded = self.dropout(self.layer_norm(self.embedding(prev_output)))
         
         # Pass through decoder with attention
-        decoder_out, (hidden, cell) = self.decoder(
-            embedded,
-            (hidden, cell)
-        )
+        if tgt_lengths is None:
+            decoder_out, (hidden, cell) = self.decoder(
+                embedded,
+                (hidden, cell)
+            )
+        else:
+            packed = pack_padded_sequence(embedded, tgt_lengths.cpu(), batch_first=True, enforce_sorted=False)
+            decoder_out, (hidden, cell) = self.decoder(packed, (hidden, cell))
+            decoder_out, _ = pad_packed_sequence(decoder_out, batch_first=True, total_length=prev_output.size(1))
         
         # Apply attention over encoder outputs
         attention = torch.bmm(
             decoder_out,
             encoder_out.transpose(1, 2)
         )
+        if src_mask is not None:
+            # Never attend to source padding
+            attention = attention.masked_fill(~src_mask.unsqueeze(1), float('-inf'))
         attention_weights = F.softmax(attention, dim=2)
         context = torch.bmm(attention_weights, encoder_out)
         
@@ -86,58 +129,426 @@ class ItineraryEncoderDecoder(nn.Module):
         self, 
         src_tokens: torch.Tensor,
         tgt_tokens: Optional[torch.Tensor] = None,
-        max_len: int = 1000
+        max_len: int = 1000,
+        src_lengths: Optional[torch.Tensor] = None,
+        tgt_lengths: Optional[torch.Tensor] = None
     ) -> torch.Tensor:
+        """
+        Teacher-forced logits for tgt_tokens[:, 1:], or generated ids without targets.
+        
+        With src_lengths (unpadded length of each row) the encoder runs on
+        packed sequences, so its backward direction starts at the last real
+        token; tgt_lengths packs the decoder too on CUDA. Attention never
+        looks at source padding either way.
+        """
+        # If target tokens not provided (inference), generate greedily
+        if tgt_tokens is None:
+            return self.generate(src_tokens, max_length=max_len)
+            
         # Encoding
-        encoder_out, hidden, cell = self.encode(src_tokens)
+        if src_lengths is not None:
+            src_mask = torch.arange(src_tokens.size(1), device=src_tokens.device) < src_lengths.to(src_tokens.device).unsqueeze(1)
+        else:
+            src_mask = self._source_mask(src_tokens)
+        encoder_out, hidden, cell = self.encode(src_tokens, src_lengths)
+        hidden, cell = self._bridge_state(hidden, cell)
         
-        # If target tokens provided (training), use teacher forcing
-        if tgt_tokens is not None:
-            decoder_input = tgt_tokens[:, :-1]  # exclude last token
-            decoder_out, _, _ = self.decode(decoder_input, encoder_out, hidden, cell)
-            return decoder_out
+        # Training uses teacher forcing
+        decoder_input = tgt_tokens[:, :-1]  # exclude last token
+        if tgt_lengths is not None and decoder_input.is_cuda:
+            # Trailing padding can't change earlier decoder steps, so packing
+            # only saves compute. That pays off with cuDNN; packed LSTMs on CPU
+            # step one timestep at a time and run several times slower
+            tgt_lengths = (tgt_lengths - 1).clamp(min=1)
+        else:
+            tgt_lengths = None
+        decoder_out, _, _ = self.decode(decoder_input, encoder_out, hidden, cell, src_mask, tgt_lengths)
+        return decoder_out
+
+    def _source_mask(
+        self,
+        src_tokens: torch.Tensor,
+        pad_token_id: Optional[int] = None
+    ) -> Optional[torch.Tensor]:
+        """Boolean mask of non-padding source positions, or None if padding is unknown"""
+        pad_token_id = self.pad_token_id if pad_token_id is None else pad_token_id
+        if pad_token_id is None:
+            return None
+        return src_tokens.ne(pad_token_id)
+
+    @staticmethod
+    def _source_lengths(src_mask: torch.Tensor) -> torch.Tensor:
+        """Lengths of right-padded sources, up to the last real position"""
+        positions = torch.arange(1, src_mask.size(1) + 1, device=src_mask.device)
+        return (src_mask.long() * positions).amax(dim=1).clamp(min=1)
+
+    @torch.no_grad()
+    def generate(
+        self,
+        src_tokens: torch.Tensor,
+        src_mask: Optional[torch.Tensor] = None,
+        max_length: int = 512,
+        num_beams: int = 1,
+        bos_token_id: Optional[int] = None,
+        eos_token_id: Optional[int] = None,
+        pad_token_id: Optional[int] = None,
+        length_penalty: float = 1.0,
+        stop_check_interval: int = 8,
+        logits_processor: Optional[Callable[[torch.Tensor, torch.Tensor], torch.Tensor]] = None
+    ) -> torch.Tensor:
+        """
+        Generate output sequences for a whole padded batch of source sequences.
+        
+        The encoder runs once per batch and the decoder LSTM state is carried
+        forward, so each step only feeds the newest token. Finished sequences
+        are tracked with a mask and padded instead of breaking per sequence.
+        
+        Args:
+            src_tokens (torch.Tensor): Source token ids of shape (batch, src_len)
+            src_mask (Optional[torch.Tensor]): True for real (non-padding) source positions
+            max_length (int): Maximum number of tokens to generate
+            num_beams (int): 1 for greedy decoding, > 1 for beam search
+            bos_token_id (Optional[int]): Decoder start token, defaults to the first source token
+            eos_token_id (Optional[int]): Token that finishes a sequence
+            pad_token_id (Optional[int]): Token written after a sequence has finished
+            length_penalty (float): Exponent applied to hypothesis length when ranking beams
+            stop_check_interval (int): Steps between checks for the whole batch being finished
+            logits_processor (Optional[Callable]): Called as (input_ids, logits) before each
+                token is chosen and returns the logits to use. input_ids holds the start
+                token and the tokens chosen so far, one row per sequence (per beam)
             
-        # Otherwise generate sequence (inference)
+        Returns:
+            torch.Tensor: Generated token ids of shape (batch, out_len)
+        """
+        bos_token_id = self.bos_token_id if bos_token_id is None else bos_token_id
+        eos_token_id = self.eos_token_id if eos_token_id is None else eos_token_id
+        pad_token_id = self.pad_token_id if pad_token_id is None else pad_token_id
+        if pad_token_id is None:
+            pad_token_id = eos_token_id if eos_token_id is not None else 0
+        if src_mask is None:
+            src_mask = self._source_mask(src_tokens, pad_token_id)
+        
+        # Encode once for the whole batch, packing away padding so each row
+        # encodes as it would alone (and as in training)
+        encoder_out, hidden, cell = self.encode(src_tokens, self._source_lengths(src_mask))
+        hidden, cell = self._bridge_state(hidden, cell)
+        
+        if bos_token_id is None:
+            start_tokens = src_tokens[:, :1]
+        else:
+            start_tokens = torch.full_like(src_tokens[:, :1], bos_token_id)
+        
+        if num_beams > 1:
+            return self._beam_search(
+                encoder_out, hidden, cell, src_mask, start_tokens,
+                max_length, num_beams, eos_token_id, pad_token_id,
+                length_penalty, stop_check_interval, logits_processor
+            )
+        return self._greedy_search(
+            encoder_out, hidden, cell, src_mask, start_tokens,
+            max_length, eos_token_id, pad_token_id, stop_check_interval,
+            logits_processor
+        )
+
+    def _greedy_search(
+        self,
+        encoder_out: torch.Tensor,
+        hidden: torch.Tensor,
+        cell: torch.Tensor,
+        src_mask: Optional[torch.Tensor],
+        start_tokens: torch.Tensor,
+        max_length: int,
+        eos_token_id: Optional[int],
+        pad_token_id: int,
+        stop_check_interval: int,
+        logits_processor: Optional[Callable[[torch.Tensor, torch.Tensor], torch.Tensor]] = None
+    ) -> torch.Tensor:
+        """Batched greedy decoding with per-sequence EOS masking"""
         outputs = []
-        decoder_input = src_tokens[:, :1]  # start with first token
+        sequences = start_tokens
+        decoder_input = start_tokens
+        finished = torch.zeros(start_tokens.size(0), dtype=torch.bool, device=start_tokens.device)
         
-        for _ in range(max_len):
+        for step in range(max_length):
             decoder_out, hidden, cell = self.decode(
                 decoder_input,
                 encoder_out,
                 hidden,
-                cell
+                cell,
+                src_mask
             )
             
-            # Get next token prediction
-            next_token = decoder_out[:, -1:].argmax(dim=-1)
+            # Get next token prediction, padding sequences that already ended
+            logits = decoder_out[:, -1]
+            if logits_processor is not None:
+                logits = logits_processor(sequences, logits)
+            next_token = logits.argmax(dim=-1)
+            if eos_token_id is not None:
+                next_token = next_token.masked_fill(finished, pad_token_id)
+                finished = finished | next_token.eq(eos_token_id)
             outputs.append(next_token)
+            decoder_input = next_token.unsqueeze(1)
+            if logits_processor is not None:
+                sequences = torch.cat([sequences, decoder_input], dim=1)
             
-            # Break if end token generated
-            if next_token.item() == self.eos_token_id:
+            # Stop once every sequence in the batch has ended
+            if (
+                eos_token_id is not None
+                and (step + 1) % stop_check_interval == 0
+                and bool(finished.all())
+            ):
                 break
                 
-            decoder_input = next_token
+        return torch.stack(outputs, dim=1)
+
+    def _beam_search(
+        self,
+        encoder_out: torch.Tensor,
+        hidden: torch.Tensor,
+        cell: torch.Tensor,
+        src_mask: Optional[torch.Tensor],
+        start_tokens: torch.Tensor,
+        max_length: int,
+        num_beams: int,
+        eos_token_id: Optional[int],
+        pad_token_id: int,
+        length_penalty: float,
+        stop_check_interval: int,
+        logits_processor: Optional[Callable[[torch.Tensor, torch.Tensor], torch.Tensor]] = None
+    ) -> torch.Tensor:
+        """Batched beam search; all beams of all sequences advance in one decoder call"""
+        batch_size = encoder_out.size(0)
+        device = encoder_out.device
+        
+        # Expand encoder outputs and decoder state to (batch * num_beams)
+        encoder_out = encoder_out.repeat_interleave(num_beams, dim=0)
+        if src_mask is not None:
+            src_mask = src_mask.repeat_interleave(num_beams, dim=0)
+        hidden = hidden.repeat_interleave(num_beams, dim=1)
+        cell = cell.repeat_interleave(num_beams, dim=1)
+        
+        # Only the first beam is live at the start so beams don't duplicate
+        beam_scores = torch.zeros(batch_size, num_beams, device=device)
+        beam_scores[:, 1:] = float('-inf')
+        beam_scores = beam_scores.view(-1)
+        
+        sequences = start_tokens.repeat_interleave(num_beams, dim=0)
+        lengths = torch.zeros_like(beam_scores)
+        finished = torch.zeros_like(beam_scores, dtype=torch.bool)
+        beam_offset = (torch.arange(batch_size, device=device) * num_beams).unsqueeze(1)
+        
+        for step in range(max_length):
+            decoder_out, hidden, cell = self.decode(
+                sequences[:, -1:],
+                encoder_out,
+                hidden,
+                cell,
+                src_mask
+            )
+            logits = decoder_out[:, -1].float()
+            if logits_processor is not None:
+                logits = logits_processor(sequences, logits)
+            log_probs = F.log_softmax(logits, dim=-1)
+            vocab_size = log_probs.size(-1)
+            
+            # Finished beams can only be extended with padding, at no cost
+            if eos_token_id is not None:
+                log_probs = log_probs.masked_fill(finished.unsqueeze(1), float('-inf'))
+                log_probs[:, pad_token_id] = torch.where(
+                    finished,
+                    torch.zeros_like(beam_scores),
+                    log_probs[:, pad_token_id]
+                )
+            
+            scores = (beam_scores.unsqueeze(1) + log_probs).view(batch_size, -1)
+            top_scores, top_indices = scores.topk(num_beams, dim=1)
+            source_beams = (top_indices // vocab_size + beam_offset).view(-1)
+            next_tokens = (top_indices % vocab_size).view(-1)
             
-        return torch.cat(outputs, dim=1)
+            # Reorder the decoder state to follow the surviving beams
+            sequences = torch.cat([sequences[source_beams], next_tokens.unsqueeze(1)], dim=1)
+            hidden = hidden.index_select(1, source_beams)
+            cell = cell.index_select(1, source_beams)
+            finished = finished[source_beams]
+            lengths = lengths[source_beams] + (~finished).float()
+            beam_scores = top_scores.view(-1)
+            
+            if eos_token_id is not None:
+                finished = finished | next_tokens.eq(eos_token_id)
+                if (step + 1) % stop_check_interval == 0 and bool(finished.all()):
+                    break
+        
+        # Pick the best hypothesis per sequence, normalised by length
+        normalised = beam_scores / lengths.clamp(min=1.0) ** length_penalty
+        best = normalised.view(batch_size, num_beams).argmax(dim=1) + beam_offset.view(-1)
+        return sequences[best, 1:]
+
+    @property
+    def config(self) -> Dict:
+        """Constructor arguments, as stored in checkpoints"""
+        return {
+            'vocab_size': self.embedding.num_embeddings,
+            'embed_dim': self.embedding.embedding_dim,
+            'hidden_dim': self.encoder.hidden_size,
+            'num_layers': self.encoder.num_layers,
+            'dropout': self.dropout.p,
+            'pad_token_id': self.pad_token_id,
+            'bos_token_id': self.bos_token_id,
+            'eos_token_id': self.eos_token_id
+        }
+
+    @property
+    def is_quantized(self) -> bool:
+        """True after quantize_dynamic(), which swaps in quantized layers"""
+        return type(self.output_projection) is not nn.Linear
+
+    def quantize_dynamic(self) -> 'ItineraryEncoderDecoder':
+        """
+        Return a CPU-only copy with int8 LSTM and Linear weights.
+        Activations stay float and are quantized on the fly per batch.
+        """
+        return torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(self).cpu().eval(),
+            {nn.LSTM, nn.Linear},
+            dtype=torch.qint8,
+            inplace=True
+        )
 
     def save_pretrained(self, path: str):
         """Save model weights and configuration"""
         torch.save({
             'model_state_dict': self.state_dict(),
-            'config': {
-                'vocab_size': self.embedding.num_embeddings,
-                'embed_dim': self.embedding.embedding_dim,
-                'hidden_dim': self.encoder.hidden_size,
-                'num_layers': self.encoder.num_layers,
-                'dropout': self.dropout.p
-            }
+            'config': self.config,
+            'format': FORMAT_DYNAMIC_INT8 if self.is_quantized else FORMAT_FP32
         }, path)
 
     @classmethod
-    def from_pretrained(cls, path: str) -> 'ItineraryEncoderDecoder':
-        """Load model from saved weights and configuration"""
-        checkpoint = torch.load(path)
-        model = cls(**checkpoint['config'])
-        model.load_state_dict(checkpoint['model_state_dict'])
-        return model
\ No newline at end of file
+    def from_pretrained(cls, path: str, mmap: bool = False) -> 'ItineraryEncoderDecoder':
+        """
+        Load model from saved weights and configuration.
+        
+        Accepts fp32 and dynamically quantized checkpoints from
+        save_pretrained, and TorchScript exports (see ml.export).
+        
+        With mmap=True the weights stay backed by the checkpoint file instead
+        of being copied into each process, so every worker that loads the same
+        file shares one read-only copy through the page cache. Such a model is
+        for inference only; move it to another device or dtype to get a
+        private copy. Quantized checkpoints are always read into memory.
+        """
+        if _is_torchscript(path):
+            return TracedItineraryEncoderDecoder.load(path)
+        
+        # Quantized weights are packed TorchBind objects. Allowing only those
+        # keeps weights_only loading, so a checkpoint can't run arbitrary code
+        with torch.serialization.safe_globals([torch.ScriptObject]):
+            if mmap:
+                checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+            else:
+                checkpoint = torch.load(path, weights_only=True)
+        
+        if checkpoint.get('format', FORMAT_FP32) == FORMAT_DYNAMIC_INT8:
+            model = cls(**checkpoint['config']).quantize_dynamic()
+            model.load_state_dict(checkpoint['model_state_dict'])
+            return model
+        
+        # Build on the meta device so no throwaway random weights are allocated
+        with torch.device('meta'):
+            model = cls(**checkpoint['config'])
+        model.load_state_dict(checkpoint['model_state_dict'], assign=True)
+        return model
+
+def _is_torchscript(path: str) -> bool:
+    """TorchScript archives carry compiled code; torch.save checkpoints don't"""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return any('/code/' in name for name in archive.namelist())
+    except zipfile.BadZipFile:
+        return False
+
+class TracedItineraryEncoderDecoder(ItineraryEncoderDecoder):
+    """
+    Inference-only model whose encoder and single decoder step are a traced
+    TorchScript module, while generate() and its search loops are shared with
+    ItineraryEncoderDecoder. Created by ml.export and from_pretrained.
+    """
+
+    def __init__(
+        self,
+        traced: torch.jit.ScriptModule,
+        config: Dict,
+        quantized: bool = False
+    ):
+        nn.Module.__init__(self)
+        self.traced = traced
+        self._config = dict(config)
+        self._quantized = quantized
+        self.pad_token_id = config.get('pad_token_id')
+        self.bos_token_id = config.get('bos_token_id')
+        self.eos_token_id = config.get('eos_token_id')
+
+    @property
+    def config(self) -> Dict:
+        return dict(self._config)
+
+    @property
+    def is_quantized(self) -> bool:
+        return self._quantized
+
+    @classmethod
+    def trace(cls, model: ItineraryEncoderDecoder) -> 'TracedItineraryEncoderDecoder':
+        """Trace model.encode and one model.decode step into a TorchScript module"""
+        model = model.eval()
+        vocab_size = model.config['vocab_size']
+        src_tokens = torch.randint(3, vocab_size, (2, 16))
+        src_lengths = torch.tensor([16, 9])
+        src_mask = torch.ones_like(src_tokens, dtype=torch.bool)
+        with torch.no_grad():
+            encoder_out, hidden, cell = model.encode(src_tokens)
+            hidden, cell = model._bridge_state(hidden, cell)
+            traced = torch.jit.trace_module(model, {
+                'encode': (src_tokens, src_lengths),
+                'decode': (src_tokens[:, :1], encoder_out, hidden, cell, src_mask)
+            })
+        return cls(traced, model.config, quantized=model.is_quantized)
+
+    @classmethod
+    def load(cls, path: str) -> 'TracedItineraryEncoderDecoder':
+        extra_files = {'config.json': ''}
+        traced = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        metadata = json.loads(extra_files['config.json'])
+        return cls(
+            traced,
+            metadata['config'],
+            quantized=metadata['format'] == FORMAT_DYNAMIC_INT8
+        )
+
+    def save_pretrained(self, path: str):
+        """Save the TorchScript module with the configuration alongside"""
+        metadata = {
+            'config': self.config,
+            'format': FORMAT_DYNAMIC_INT8 if self.is_quantized else FORMAT_FP32
+        }
+        torch.jit.save(self.traced, path, _extra_files={'config.json': json.dumps(metadata)})
+
+    def encode(self, src_tokens: torch.Tensor, src_lengths: Optional[torch.Tensor] = None) -> tuple:
+        if src_lengths is None:
+            src_lengths = torch.full((src_tokens.size(0),), src_tokens.size(1), dtype=torch.long)
+        return tuple(self.traced.encode(src_tokens, src_lengths))
+
+    def decode(
+        self,
+        prev_output: torch.Tensor,
+        encoder_out: torch.Tensor,
+        hidden: torch.Tensor,
+        cell: torch.Tensor,
+        src_mask: Optional[torch.Tensor] = None
+    ) -> tuple:
+        if src_mask is None:
+            src_mask = torch.ones(encoder_out.shape[:2], dtype=torch.bool, device=encoder_out.device)
+        return tuple(self.traced.decode(prev_output, encoder_out, hidden, cell, src_mask))
+
+    def forward(self, src_tokens: torch.Tensor, tgt_tokens: Optional[torch.Tensor] = None, max_len: int = 1000) -> torch.Tensor:
+        if tgt_tokens is not None:
+            raise RuntimeError("Traced models are for inference only")
+        return self.generate(src_tokens, max_length=max_len)
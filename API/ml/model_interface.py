@@ -1,18 +1,54 @@
 import torch
-from typing import Dict, Optional, Union
+from torch.nn.utils.rnn import pad_sequence
+from typing import Dict, List, Optional, Sequence, Union
 import json
 import time
+import threading
 from pathlib import Path
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from .model import ItineraryEncoderDecoder
 from .tokenizer import ItineraryTokenizer
+from .batch_scheduler import MicroBatchScheduler
+from .constrained_decoding import JSONConstraintProcessor, JSONSchemaGrammar, TokenVocabulary, itinerary_schema
 from ..openAIAPI import TravelPreferences, generate_itinerary as api_generate_itinerary
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def format_model_input(preferences: TravelPreferences) -> str:
+    """Format travel preferences into the model's input string"""
+    return (
+        f"[DESTINATION]{preferences.destination or 'India'}"
+        f"[GROUP]{preferences.group_type}"
+        f"[DAYS]{preferences.num_days}"
+        f"[BUDGET]{preferences.budget}"
+        f"[PEOPLE]{preferences.num_people}"
+    )
+
+_shared_interfaces: Dict[tuple, 'ModelInterface'] = {}
+_shared_lock = threading.Lock()
+
+def get_shared_interface(
+    model_path: Union[str, Path],
+    tokenizer_path: Union[str, Path],
+    warmup: bool = True,
+    **kwargs
+) -> 'ModelInterface':
+    """
+    Get this process's interface for a checkpoint, loading (and warming it up)
+    only once. Call it at startup, e.g. from the app's lifespan hook.
+    """
+    key = (str(model_path), str(tokenizer_path))
+    with _shared_lock:
+        if key not in _shared_interfaces:
+            interface = ModelInterface(model_path, tokenizer_path, **kwargs)
+            if warmup:
+                interface.warmup()
+            _shared_interfaces[key] = interface
+        return _shared_interfaces[key]
+
 class ModelInterface:
     def __init__(
         self,
@@ -20,36 +56,62 @@ class ModelInterface:
         tokenizer_path: Union[str, Path],
         max_length: int = 512,
         device: Optional[str] = None,
-        num_workers: int = 4
+        num_workers: int = 4,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        num_beams: int = 4,
+        mmap_weights: bool = True,
+        constrained_decoding: bool = True
     ):
         self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
         self.max_length = max_length
+        self.num_beams = num_beams
+        self.max_batch_size = max_batch_size
+        self.warmup_seconds: Optional[float] = None
         
-        # Load model and tokenizer
+        # Load model and tokenizer. On CPU the weights are memory-mapped, so
+        # forked workers loading the same checkpoint share one copy
         logger.info(f'Loading model from {model_path}...')
-        self.model = ItineraryEncoderDecoder.from_pretrained(model_path).to(self.device)
+        self.model = ItineraryEncoderDecoder.from_pretrained(
+            model_path,
+            mmap=mmap_weights and self.device == 'cpu'
+        ).to(self.device)
         self.model.eval()
         
         logger.info(f'Loading tokenizer from {tokenizer_path}...')
         self.tokenizer = ItineraryTokenizer.from_pretrained(tokenizer_path)
         
-        # Initialize thread pool for concurrent requests
+        # With constrained decoding the model can only write tokens that keep
+        # its output a valid itinerary, so it rarely needs the API fallback
+        self.constrained_decoding = constrained_decoding
+        self._grammars: Dict[int, JSONSchemaGrammar] = {}
+        self._grammars_lock = threading.Lock()
+        if constrained_decoding:
+            self.token_strings = self.tokenizer.token_strings()
+            self.vocabulary = TokenVocabulary(
+                self.token_strings,
+                self.tokenizer.eos_token_id,
+                self.tokenizer.special_token_ids
+            )
+        
+        # Concurrent requests are merged into micro-batches for the model;
+        # the thread pool only serves API fallbacks
+        self.scheduler = MicroBatchScheduler(
+            self._generate_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms
+        )
         self.executor = ThreadPoolExecutor(max_workers=num_workers)
         
         # Performance monitoring
+        self._metrics_lock = threading.Lock()
         self.total_requests = 0
         self.total_latency = 0
         self.failed_requests = 0
         
     def _format_input(self, preferences: TravelPreferences) -> str:
         """Format travel preferences into model input string"""
-        return (
-            f"[DESTINATION]{preferences.destination or 'India'}"
-            f"[GROUP]{preferences.group_type}"
-            f"[DAYS]{preferences.num_days}"
-            f"[BUDGET]{preferences.budget}"
-            f"[PEOPLE]{preferences.num_people}"
-        )
+        return format_model_input(preferences)
         
     def _validate_output(self, output: Dict) -> bool:
         """Validate model output structure"""
@@ -65,77 +127,211 @@ class ModelInterface:
             
         return True
         
-    @torch.no_grad()
-    def generate_itinerary(
+    def _grammar(self, num_days: int) -> JSONSchemaGrammar:
+        """Grammar for an itinerary of num_days days, built once per day count"""
+        with self._grammars_lock:
+            if num_days not in self._grammars:
+                self._grammars[num_days] = JSONSchemaGrammar(itinerary_schema(num_days), self.vocabulary)
+            return self._grammars[num_days]
+        
+    @torch.inference_mode()
+    def _run_model(self, preferences_list: List[TravelPreferences], max_length: int) -> torch.Tensor:
+        """Tokenize a batch of requests and generate output token ids."""
+        # Format and tokenize inputs, padding to the longest in the batch
+        input_ids = pad_sequence(
+            [
+                torch.tensor(self.tokenizer.encode(self._format_input(preferences), padding=False))
+                for preferences in preferences_list
+            ],
+            batch_first=True,
+            padding_value=self.tokenizer.pad_token_id
+        ).to(self.device)
+        
+        logits_processor = None
+        if self.constrained_decoding:
+            logits_processor = JSONConstraintProcessor(
+                [self._grammar(preferences.num_days) for preferences in preferences_list],
+                self.token_strings,
+                self.tokenizer.pad_token_id
+            )
+        
+        return self.model.generate(
+            input_ids,
+            max_length=max_length,
+            num_beams=self.num_beams,
+            eos_token_id=self.tokenizer.eos_token_id,
+            pad_token_id=self.tokenizer.pad_token_id,
+            logits_processor=logits_processor
+        )
+        
+    def warmup(
         self,
-        preferences: TravelPreferences,
-        fallback_to_api: bool = True
-    ) -> Dict:
+        day_counts: Sequence[int] = (1, 3, 7),
+        batch_sizes: Optional[Sequence[int]] = None,
+        max_length: Optional[int] = None
+    ) -> float:
         """
-        Generate travel itinerary using the local model.
-        Falls back to API if model fails and fallback_to_api is True.
+        Run throwaway generations so the first real request doesn't pay for
+        lazy initialization (allocator growth, kernel selection, page faults
+        on memory-mapped weights).
+        
+        Args:
+            day_counts: Trip lengths to generate for, covering typical input lengths
+            batch_sizes: Batch sizes to exercise; defaults to 1 and max_batch_size
+            max_length: Output length cap; defaults to the interface's max_length
+            
+        Returns:
+            float: Seconds spent warming up
         """
         start_time = time.time()
-        self.total_requests += 1
+        batch_sizes = batch_sizes or sorted({1, self.max_batch_size})
+        for num_days in day_counts:
+            preferences = TravelPreferences(
+                destination="Jaipur",
+                group_type="family",
+                num_days=num_days,
+                budget="moderate",
+                num_people=4
+            )
+            for batch_size in batch_sizes:
+                self._run_model([preferences] * batch_size, max_length or self.max_length)
+        
+        self.warmup_seconds = time.time() - start_time
+        logger.info(f'Warm-up finished in {self.warmup_seconds:.2f}s')
+        return self.warmup_seconds
+        
+    def _generate_batch(self, preferences_list: List[TravelPreferences]) -> List[Union[Dict, Exception]]:
+        """
+        Run one batched forward pass for several requests.
+        Returns one result per request; failed requests get their Exception instead.
+        """
+        start_time = time.time()
+        results: List[Union[Dict, Exception]] = []
         
         try:
-            # Format input
-            input_text = self._format_input(preferences)
-            input_ids = torch.tensor(
-                self.tokenizer.encode(input_text)
-            ).unsqueeze(0).to(self.device)
-            
-            # Generate output
-            output_ids = self.model.generate(
-                input_ids,
-                max_length=self.max_length,
-                num_beams=4,
-                early_stopping=True
-            )
-            
-            # Decode output
-            output_text = self.tokenizer.decode(output_ids[0].tolist())
-            output_json = json.loads(output_text)
-            
-            # Validate output structure
-            if not self._validate_output(output_json):
-                raise ValueError("Model output validation failed")
-            
-            # Update metrics
-            latency = time.time() - start_time
-            self.total_latency += latency
-            
-            if latency > 0.5:  # Log warning if latency exceeds 500ms
-                logger.warning(f"High latency detected: {latency:.2f}s")
-            
-            return output_json
+            output_ids = self._run_model(preferences_list, self.max_length)
             
+            # Decode and validate each output independently
+            for ids in output_ids.tolist():
+                try:
+                    output_json = json.loads(self.tokenizer.decode(ids, skip_special_tokens=True))
+                    if not self._validate_output(output_json):
+                        raise ValueError("Model output validation failed")
+                    results.append(output_json)
+                except Exception as e:
+                    results.append(e)
+                    
         except Exception as e:
-            self.failed_requests += 1
-            logger.error(f"Model generation failed: {str(e)}")
+            results = [e] * len(preferences_list)
+        
+        # Update metrics
+        latency = time.time() - start_time
+        failures = sum(isinstance(result, Exception) for result in results)
+        with self._metrics_lock:
+            self.total_requests += len(preferences_list)
+            self.total_latency += latency * len(preferences_list)
+            self.failed_requests += failures
+        
+        if latency > 0.5:  # Log warning if latency exceeds 500ms
+            logger.warning(f"High latency detected: {latency:.2f}s for batch of {len(preferences_list)}")
+        if failures:
+            logger.error(f"Model generation failed for {failures}/{len(preferences_list)} requests")
             
-            if fallback_to_api:
+        return results
+        
+    def generate_batch(
+        self,
+        preferences_list: List[TravelPreferences],
+        fallback_to_api: bool = True
+    ) -> List[Dict]:
+        """
+        Generate itineraries for several requests, queued together so the
+        scheduler runs them in as few forward passes as max_batch_size allows.
+        Requests the model fails on fall back to the API if fallback_to_api is True.
+        """
+        # Every forward pass runs on the scheduler's thread, never concurrently
+        futures = [self.scheduler.submit(preferences) for preferences in preferences_list]
+        
+        outputs = []
+        for preferences, future in zip(preferences_list, futures):
+            try:
+                outputs.append(future.result())
+            except Exception:
+                if not fallback_to_api:
+                    raise
                 logger.info("Falling back to API...")
-                return api_generate_itinerary(preferences)
-            else:
-                raise
+                outputs.append(api_generate_itinerary(preferences))
+        return outputs
+        
+    def generate_itinerary(
+        self,
+        preferences: TravelPreferences,
+        fallback_to_api: bool = True
+    ) -> Dict:
+        """
+        Generate travel itinerary using the local model, batched with other
+        concurrent requests. Falls back to API if model fails and fallback_to_api is True.
+        """
+        return self.generate_batch([preferences], fallback_to_api)[0]
                 
-    def generate_itinerary_async(self, preferences: TravelPreferences):
-        """Generate itinerary asynchronously using thread pool"""
-        return self.executor.submit(self.generate_itinerary, preferences)
+    def generate_itinerary_async(
+        self,
+        preferences: TravelPreferences,
+        fallback_to_api: bool = True
+    ) -> Future:
+        """Generate itinerary asynchronously, batched with other concurrent requests"""
+        future: Future = Future()
+        
+        def _fallback_done(api_future: Future):
+            if api_future.exception() is not None:
+                future.set_exception(api_future.exception())
+            else:
+                future.set_result(api_future.result())
+        
+        def _model_done(model_future: Future):
+            error = model_future.exception()
+            if error is None:
+                future.set_result(model_future.result())
+            elif fallback_to_api:
+                logger.info("Falling back to API...")
+                self.executor.submit(api_generate_itinerary, preferences).add_done_callback(_fallback_done)
+            else:
+                future.set_exception(error)
+        
+        self.scheduler.submit(preferences).add_done_callback(_model_done)
+        return future
         
     def get_performance_metrics(self) -> Dict:
         """Get model performance metrics"""
-        avg_latency = self.total_latency / max(1, self.total_requests)
-        failure_rate = self.failed_requests / max(1, self.total_requests)
+        with self._metrics_lock:
+            total_requests = self.total_requests
+            total_latency = self.total_latency
+            failed_requests = self.failed_requests
+        with self._grammars_lock:
+            grammars = list(self._grammars.values())
         
         return {
-            'total_requests': self.total_requests,
-            'average_latency': avg_latency,
-            'failure_rate': failure_rate,
-            'failed_requests': self.failed_requests
+            'total_requests': total_requests,
+            'average_latency': total_latency / max(1, total_requests),
+            'failure_rate': failed_requests / max(1, total_requests),
+            'failed_requests': failed_requests,
+            'warmup_seconds': self.warmup_seconds,
+            'constrained_decoding': self.constrained_decoding,
+            'grammar_cache_hits': sum(grammar.cache_hits for grammar in grammars),
+            'grammar_cache_misses': sum(grammar.cache_misses for grammar in grammars),
+            'scheduler': self.scheduler.get_stats()
         }
         
+    def close(self):
+        """Stop the batch scheduler and the fallback thread pool"""
+        # Also called from __del__ when __init__ failed before creating them
+        scheduler = getattr(self, 'scheduler', None)
+        if scheduler is not None:
+            scheduler.close()
+        executor = getattr(self, 'executor', None)
+        if executor is not None:
+            executor.shutdown()
+        
     def __del__(self):
         """Clean up resources"""
-        self.executor.shutdown()
\ No newline at end of file
+        self.close()
\ No newline at end of file
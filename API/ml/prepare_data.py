@@ -1,30 +1,280 @@
+"""
+Streaming preparation of training data.
+
+    python -m API.ml.prepare_data --input_path data/raw/itineraries.jsonl \
+        --output_dir data/processed
+
+The raw file is JSON Lines, one {'input': ..., 'output': ...} record per
+line, and is never loaded whole. Two passes run in parallel over the cores:
+
+  1. The file is cut into byte ranges at line boundaries. Each worker parses
+     and validates its lines, hashes every record and appends it to a
+     temporary bucket file picked by the hash of its content.
+  2. Each worker takes whole buckets, drops duplicates (which share a
+     bucket, so a bucket's hashes are all that is held in memory) and
+     writes the bucket's records as one shard per split.
+
+Splits are assigned by hashing a stable key, the record's 'id' or else its
+input preferences, so a record keeps its split when data is appended and
+identical requests never straddle train and test.
+
+Layout of output_dir:
+    train/part-00000.jsonl ...   one shard per bucket and split
+    val/, test/                  the same for the held-out splits
+    manifest.json                record counts, rejects and duplicates
+"""
+import hashlib
 import json
-import pandas as pd
-from sklearn.model_selection import train_test_split
+import logging
+import os
+import shutil
+from collections import Counter
+from itertools import chain
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Same proportions as the previous train_test_split(0.2) then (0.1)
+SPLIT_FRACTIONS = {'train': 0.72, 'val': 0.08, 'test': 0.2}
+
+INPUT_FIELDS = {
+    'destination': str,
+    'group_type': str,
+    'num_days': int,
+    'budget': str,
+    'num_people': int
+}
+
+def validate_record(record) -> Optional[str]:
+    """Reason a raw record can't be trained on, or None if it is usable"""
+    if not isinstance(record, dict):
+        return 'not_an_object'
+    preferences, itinerary = record.get('input'), record.get('output')
+    if not isinstance(preferences, dict) or not isinstance(itinerary, dict):
+        return 'missing_input_or_output'
+    for field, field_type in INPUT_FIELDS.items():
+        value = preferences.get(field)
+        if not isinstance(value, field_type) or isinstance(value, bool):
+            return f'bad_input_{field}'
+    if preferences['num_days'] < 1 or preferences['num_people'] < 1:
+        return 'bad_input_count'
+    days = itinerary.get('days')
+    if not isinstance(days, list) or len(days) != preferences['num_days']:
+        return 'days_mismatch'
+    if not isinstance(itinerary.get('hotels', []), list):
+        return 'bad_output_hotels'
+    return None
+
+def _canonical(value) -> bytes:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def assign_split(record: Dict, fractions: Dict[str, float] = SPLIT_FRACTIONS) -> str:
+    """
+    Deterministic split of a record from the hash of its stable key: the
+    record's 'id' if it has one, else its input preferences.
+    """
+    key = str(record['id']).encode('utf-8') if 'id' in record else _canonical(record['input'])
+    point = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') / 2 ** 64
+    cumulative = 0.0
+    for split, fraction in fractions.items():
+        cumulative += fraction
+        if point < cumulative:
+            return split
+    return split
+
+def _line_ranges(path: Path, chunk_size: int) -> List[Tuple[int, int]]:
+    """Byte ranges of about chunk_size; a line belongs to the range its first byte is in"""
+    size = path.stat().st_size
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+def _partition_range(task: Tuple) -> Counter:
+    """Pass 1: validate one byte range and spread its records over bucket files"""
+    input_path, (start, end), range_index, tmp_dir, num_shards, fractions = task
+    stats = Counter()
+    buckets = {}
+    try:
+        with open(input_path, 'rb') as f:
+            if start:
+                # Skip the tail of a line that started in the previous range
+                f.seek(start - 1)
+                f.readline()
+            while f.tell() < end:
+                line = f.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                stats['read'] += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    stats['rejected_invalid_json'] += 1
+                    continue
+                reason = validate_record(record)
+                if reason:
+                    stats[f'rejected_{reason}'] += 1
+                    continue
+
+                content = _canonical(record)
+                digest = hashlib.blake2b(content, digest_size=16).digest()
+                bucket = int.from_bytes(digest[:8], 'big') % num_shards
+                if bucket not in buckets:
+                    buckets[bucket] = open(Path(tmp_dir) / f'b{bucket:05d}-r{range_index:06d}.tsv', 'wb')
+                buckets[bucket].write(b'\t'.join((
+                    digest.hex().encode('ascii'),
+                    assign_split(record, fractions).encode('ascii'),
+                    content
+                )) + b'\n')
+    finally:
+        for f in buckets.values():
+            f.close()
+    return stats
 
-def prepare_training_data(input_path, output_dir):
-    """Prepare and split the training data."""
-    with open(input_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # Convert to DataFrame for easier manipulation
-    df = pd.DataFrame(data)
-    
-    # Split into train/val/test
-    train_data, test_data = train_test_split(df, test_size=0.2, random_state=42)
-    train_data, val_data = train_test_split(train_data, test_size=0.1, random_state=42)
-    
-    # Save splits
-    output_dir = Path(output_dir)
-    output_dir.mkdir(exist_ok=True)
-    
-    train_data.to_json(output_dir / 'train.json', orient='records', force_ascii=False)
-    val_data.to_json(output_dir / 'val.json', orient='records', force_ascii=False)
-    test_data.to_json(output_dir / 'test.json', orient='records', force_ascii=False)
+def _write_bucket(task: Tuple) -> Counter:
+    """Pass 2: drop duplicates within one bucket and write its split shards"""
+    bucket, tmp_dir, output_dir = task
+    stats = Counter()
+    seen = set()
+    shards = {}
+    try:
+        # Range order is input order, so the first occurrence of a duplicate wins
+        for path in sorted(Path(tmp_dir).glob(f'b{bucket:05d}-r*.tsv')):
+            with open(path, 'rb') as f:
+                for line in f:
+                    digest, split, content = line.rstrip(b'\n').split(b'\t', 2)
+                    if digest in seen:
+                        stats['duplicates'] += 1
+                        continue
+                    seen.add(digest)
+                    split = split.decode('ascii')
+                    if split not in shards:
+                        shards[split] = open(Path(output_dir) / split / f'part-{bucket:05d}.jsonl', 'wb')
+                    shards[split].write(content + b'\n')
+                    stats[split] += 1
+    finally:
+        for f in shards.values():
+            f.close()
+    return stats
+
+def prepare_training_data(
+    input_path: Union[str, Path],
+    output_dir: Union[str, Path],
+    num_shards: int = 16,
+    num_workers: Optional[int] = None,
+    chunk_size: int = 64 * 1024 * 1024,
+    fractions: Dict[str, float] = SPLIT_FRACTIONS
+) -> Dict:
+    """
+    Validate, deduplicate and split a JSON Lines file into sharded splits.
+
+    Args:
+        input_path: Raw records, one JSON object per line
+        output_dir: Directory for the split shards; previous shards are replaced
+        num_shards: Shards per split, which is also the unit of parallelism
+            (and of deduplication memory) in the second pass
+        num_workers: Processes to use (default: all cores)
+        chunk_size: Bytes of input per first-pass task
+        fractions: Share of records per split, summing to 1
+
+    Returns:
+        Dict: The manifest written to output_dir/manifest.json
+    """
+    input_path, output_dir = Path(input_path), Path(output_dir)
+    num_workers = num_workers or os.cpu_count() or 1
+    with open(input_path, 'rb') as f:
+        if f.read(1024).lstrip().startswith(b'['):
+            raise ValueError(
+                f"{input_path} is a JSON array; convert it to JSON Lines first, e.g. jq -c '.[]'"
+            )
+
+    for split in fractions:
+        (output_dir / split).mkdir(parents=True, exist_ok=True)
+        for shard in (output_dir / split).glob('part-*.jsonl'):
+            shard.unlink()
+    tmp_dir = output_dir / '.buckets'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    ranges = _line_ranges(input_path, chunk_size)
+    partition_tasks = [
+        (str(input_path), byte_range, index, str(tmp_dir), num_shards, fractions)
+        for index, byte_range in enumerate(ranges)
+    ]
+    bucket_tasks = [(bucket, str(tmp_dir), str(output_dir)) for bucket in range(num_shards)]
+
+    stats = Counter()
+    try:
+        if num_workers > 1:
+            with Pool(num_workers) as pool:
+                for result in pool.imap_unordered(_partition_range, partition_tasks):
+                    stats.update(result)
+                for result in pool.imap_unordered(_write_bucket, bucket_tasks):
+                    stats.update(result)
+        else:
+            for result in chain(map(_partition_range, partition_tasks), map(_write_bucket, bucket_tasks)):
+                stats.update(result)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    manifest = {
+        'input_path': str(input_path),
+        'num_shards': num_shards,
+        'fractions': fractions,
+        'records_read': stats['read'],
+        'duplicates': stats['duplicates'],
+        'rejected': {key[len('rejected_'):]: count for key, count in sorted(stats.items()) if key.startswith('rejected_')},
+        'splits': {split: stats[split] for split in fractions}
+    }
+    with open(output_dir / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    logger.info(
+        f"Read {manifest['records_read']} records: {manifest['splits']}, "
+        f"{manifest['duplicates']} duplicates, {sum(manifest['rejected'].values())} rejected"
+    )
+    return manifest
+
+def iter_records(path: Union[str, Path]) -> Iterator[Dict]:
+    """
+    Records of a split directory written by prepare_training_data, a JSON
+    Lines file or a JSON array file, one at a time (arrays are loaded whole).
+    """
+    path = Path(path)
+    if path.is_dir():
+        files = sorted(path.glob('part-*.jsonl'))
+    else:
+        with open(path, 'rb') as f:
+            if f.read(1024).lstrip().startswith(b'['):
+                f.seek(0)
+                yield from json.load(f)
+                return
+        files = [path]
+
+    for file in files:
+        with open(file, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
 
 if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_path', type=str, default='data/raw/itineraries.jsonl')
+    parser.add_argument('--output_dir', type=str, default='data/processed')
+    parser.add_argument('--num_shards', type=int, default=16)
+    parser.add_argument('--num_workers', type=int, default=None)
+    parser.add_argument('--chunk_size_mb', type=int, default=64)
+    args = parser.parse_args()
+
     prepare_training_data(
-        input_path='data/raw/itineraries.json',
-        output_dir='data/processed'
-    )
\ No newline at end of file
+        args.input_path,
+        args.output_dir,
+        num_shards=args.num_shards,
+        num_workers=args.num_workers,
+        chunk_size=args.chunk_size_mb * 1024 * 1024
+    )
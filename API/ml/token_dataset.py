@@ -0,0 +1,274 @@
+"""
+Pre-tokenized training data. Examples are tokenized once into flat token
+files with offset indexes, which TokenizedItineraryDataset memory-maps, so
+training neither re-runs the tokenizer every epoch nor holds the corpus in
+RAM.
+
+    python -m API.ml.token_dataset --data_path data/processed/train \
+        --tokenizer checkpoints/tokenizer --output_dir data/tokenized/train
+
+Layout of output_dir:
+    input_tokens.bin, output_tokens.bin     token ids of all examples, back to back
+    input_offsets.npy, output_offsets.npy   example i is tokens[offsets[i]:offsets[i + 1]]
+    meta.json                               dtype, counts and special token ids
+"""
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+from tqdm import tqdm
+
+from .prepare_data import iter_records
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('input', 'output')
+
+def format_training_example(item: Dict) -> Tuple[str, str]:
+    """Model input and target text for one raw training record"""
+    input_text = (
+        f"destination: {item['input']['destination']}, "
+        f"group_type: {item['input']['group_type']}, "
+        f"days: {item['input']['num_days']}, "
+        f"budget: {item['input']['budget']}, "
+        f"people: {item['input']['num_people']}"
+    )
+    return input_text, json.dumps(item['output'])
+
+def token_dtype(vocab_size: int) -> np.dtype:
+    """Smallest unsigned dtype that holds every token id"""
+    return np.dtype(np.uint16) if vocab_size <= np.iinfo(np.uint16).max + 1 else np.dtype(np.uint32)
+
+def collate_padded(batch: List[Dict[str, Sequence[int]]], pad_token_id: int) -> Dict[str, torch.Tensor]:
+    """
+    Pad a list of examples to the longest input and output in the batch.
+    Each '<field>_ids' also gets a '<field>_lengths' entry for packing.
+    """
+    collated = {}
+    for key in batch[0]:
+        sequences = [example[key] for example in batch]
+        lengths = [len(ids) for ids in sequences]
+        padded = np.full((len(sequences), max(lengths)), pad_token_id, dtype=np.int64)
+        for row, ids in enumerate(sequences):
+            padded[row, :len(ids)] = ids
+        collated[key] = torch.from_numpy(padded)
+        collated[key.replace('_ids', '_lengths')] = torch.tensor(lengths)
+    return collated
+
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler that groups examples of similar length.
+
+    Each epoch, indices are shuffled and cut into pools of
+    batch_size * bucket_multiplier; every pool is sorted by length and split
+    into batches, and the batches are shuffled. Batches then need little
+    padding while their order stays random.
+
+    For distributed training every rank builds the same batches (same seed
+    and epoch) and takes every num_replicas-th one. With drop_last, the
+    batches are first cut to a multiple of num_replicas so all ranks run
+    the same number of steps.
+
+    set_start_batch() skips batches already trained on when resuming from a
+    mid-epoch checkpoint.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        batch_size: int,
+        bucket_multiplier: int = 50,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        seed: int = 0,
+        num_replicas: int = 1,
+        rank: int = 0
+    ):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_multiplier = bucket_multiplier
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start_batch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def set_start_batch(self, start_batch: int):
+        """Start the next epoch at this rank's start_batch-th batch; later epochs start at 0"""
+        self.start_batch = start_batch
+
+    def __iter__(self) -> Iterator[List[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        pool_size = self.batch_size * self.bucket_multiplier
+
+        batches = []
+        for start in range(0, len(indices), pool_size):
+            pool = indices[start:start + pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            for batch_start in range(0, len(pool), self.batch_size):
+                batch = pool[batch_start:batch_start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch.tolist())
+
+        if self.shuffle:
+            rng.shuffle(batches)
+        if self.drop_last:
+            batches = batches[:len(batches) - len(batches) % self.num_replicas]
+        self.epoch += 1
+        start_batch, self.start_batch = self.start_batch, 0
+        return iter(batches[self.rank::self.num_replicas][start_batch:])
+
+    def __len__(self) -> int:
+        pool_size = self.batch_size * self.bucket_multiplier
+        full_pools, rest = divmod(len(self.lengths), pool_size)
+        if self.drop_last:
+            num_batches = (full_pools * self.bucket_multiplier + rest // self.batch_size) // self.num_replicas
+        else:
+            total_batches = full_pools * self.bucket_multiplier + -(-rest // self.batch_size)
+            num_batches = len(range(self.rank, total_batches, self.num_replicas))
+        return max(0, num_batches - self.start_batch)
+
+def pretokenize(
+    data_path: Union[str, Path],
+    tokenizer,
+    output_dir: Union[str, Path],
+    max_length: int = 512
+) -> Dict:
+    """
+    Tokenize {'input': ..., 'output': ...} records into output_dir, streaming.
+
+    Args:
+        data_path: Split directory written by prepare_data, or a JSON
+            Lines / JSON array file
+        tokenizer: ItineraryTokenizer used for training
+        output_dir: Directory for the token files, created if missing
+        max_length: Sequences are truncated to this many tokens (not padded)
+
+    Returns:
+        Dict: The metadata written to meta.json
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    dtype = token_dtype(tokenizer.vocab_size)
+
+    offsets = {field: [0] for field in FIELDS}
+    files = {field: open(output_dir / f'{field}_tokens.bin', 'wb') for field in FIELDS}
+    try:
+        for item in tqdm(iter_records(data_path), desc=f'Tokenizing {data_path}'):
+            for field, text in zip(FIELDS, format_training_example(item)):
+                token_ids = np.asarray(
+                    tokenizer.encode(text, max_length=max_length, padding=False, truncation=True),
+                    dtype=dtype
+                )
+                token_ids.tofile(files[field])
+                offsets[field].append(offsets[field][-1] + len(token_ids))
+    finally:
+        for f in files.values():
+            f.close()
+
+    for field in FIELDS:
+        np.save(output_dir / f'{field}_offsets.npy', np.asarray(offsets[field], dtype=np.int64))
+
+    meta = {
+        'num_examples': len(offsets['input']) - 1,
+        'dtype': dtype.name,
+        'max_length': max_length,
+        'vocab_size': tokenizer.vocab_size,
+        'pad_token_id': tokenizer.pad_token_id,
+        'eos_token_id': tokenizer.eos_token_id,
+        'num_tokens': {field: offsets[field][-1] for field in FIELDS}
+    }
+    with open(output_dir / 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    logger.info(f"Wrote {meta['num_examples']} examples ({meta['num_tokens']}) to {output_dir}")
+    return meta
+
+class TokenizedItineraryDataset(Dataset):
+    """
+    Dataset over a pretokenize() output directory.
+
+    Token files are memory-mapped on first access in each process, so the
+    dataset pickles cheaply into DataLoader workers and examples are views
+    into the page cache. Use collate() to pad a batch.
+    """
+
+    def __init__(self, data_dir: Union[str, Path], max_length: Optional[int] = None):
+        """
+        Args:
+            data_dir: Directory written by pretokenize()
+            max_length: Truncate sequences further than at tokenization time
+        """
+        self.data_dir = Path(data_dir)
+        with open(self.data_dir / 'meta.json') as f:
+            self.meta = json.load(f)
+        self.max_length = max_length or self.meta['max_length']
+        self.pad_token_id = self.meta['pad_token_id']
+        self._arrays: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def _load(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        if self._arrays is None:
+            self._arrays = {
+                field: (
+                    np.memmap(self.data_dir / f'{field}_tokens.bin', dtype=self.meta['dtype'], mode='r'),
+                    np.load(self.data_dir / f'{field}_offsets.npy', mmap_mode='r')
+                )
+                for field in FIELDS
+            }
+        return self._arrays
+
+    def __len__(self) -> int:
+        return self.meta['num_examples']
+
+    def __getitem__(self, idx: int) -> Dict[str, np.ndarray]:
+        if idx < 0:
+            idx += len(self)
+        item = {}
+        for field, (tokens, offsets) in self._load().items():
+            start, end = int(offsets[idx]), int(offsets[idx + 1])
+            item[f'{field}_ids'] = tokens[start:min(end, start + self.max_length)]
+        return item
+
+    def lengths(self, field: str = 'output') -> np.ndarray:
+        """Token count of every example, without reading any tokens"""
+        offsets = self._load()[field][1]
+        return np.minimum(np.diff(offsets), self.max_length)
+
+    def collate(self, batch: List[Dict[str, np.ndarray]]) -> Dict[str, torch.Tensor]:
+        """Pad a list of examples to the longest input and output in the batch"""
+        return collate_padded(batch, self.pad_token_id)
+
+if __name__ == '__main__':
+    import argparse
+    from .tokenizer import ItineraryTokenizer
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', type=str, required=True)
+    parser.add_argument('--tokenizer', type=str, required=True)
+    parser.add_argument('--output_dir', type=str, required=True)
+    parser.add_argument('--max_length', type=int, default=512)
+    args = parser.parse_args()
+
+    pretokenize(
+        args.data_path,
+        ItineraryTokenizer.from_pretrained(args.tokenizer),
+        args.output_dir,
+        max_length=args.max_length
+    )
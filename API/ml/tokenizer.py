@@ -48,6 +48,15 @@ class ItineraryTokenizer:
     def eos_token_id(self) -> int:
         return self.base_tokenizer.eos_token_id
         
+    @property
+    def special_token_ids(self) -> List[int]:
+        return self.base_tokenizer.all_special_ids
+        
+    def token_strings(self) -> List[str]:
+        """Text of each token id on its own, without clean-up of spaces"""
+        tokens = self.base_tokenizer.convert_ids_to_tokens(list(range(self.vocab_size)))
+        return [self.base_tokenizer.convert_tokens_to_string([token]) for token in tokens]
+        
     def encode(
         self,
         text: str,
@@ -63,9 +72,12 @@ class ItineraryTokenizer:
             truncation=truncation
         )
         
-    def decode(self, token_ids: List[int]) -> str:
+    def decode(self, token_ids: List[int], skip_special_tokens: bool = False) -> str:
         """Decode token ids back to text"""
-        return self.base_tokenizer.decode(token_ids)
+        return self.base_tokenizer.decode(
+            token_ids,
+            skip_special_tokens=skip_special_tokens
+        )
         
     def save_pretrained(self, save_dir: str):
         """Save tokenizer configuration and vocabulary"""
@@ -1,17 +1,21 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
-from typing import List, Dict, Union, Optional
-import json
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Dataset, DataLoader, Subset
+from typing import List, Dict, Tuple, Union, Optional
+import contextlib
+import itertools
 import numpy as np
 from pathlib import Path
 import logging
+import time
 from tqdm import tqdm
 from sklearn.model_selection import train_test_split
-import wandb  # for experiment tracking
 
 import os
+import subprocess
 import sys
 
 # Add the API directory to Python path
@@ -19,8 +23,11 @@ api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if api_dir not in sys.path:
     sys.path.append(api_dir)
 
+from ml.checkpointing import CheckpointManager, restore_rng_state
 from ml.model import ItineraryEncoderDecoder
+from ml.prepare_data import iter_records
 from ml.tokenizer import ItineraryTokenizer
+from ml.token_dataset import LengthBucketSampler, TokenizedItineraryDataset, collate_padded, format_training_example
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,8 +43,7 @@ class ItineraryDataset(Dataset):
         self.max_length = max_length
         
         # Load and preprocess data
-        with open(data_path) as f:
-            self.data = json.load(f)
+        self.data = list(iter_records(data_path))
             
         # Convert data to input/output pairs
         self.examples = self._prepare_examples()
@@ -45,18 +51,7 @@ class ItineraryDataset(Dataset):
     def _prepare_examples(self) -> List[Dict]:
         examples = []
         for item in self.data:
-            # Convert input preferences to string
-            input_text = (
-                f"destination: {item['input']['destination']}, "
-                f"group_type: {item['input']['group_type']}, "
-                f"days: {item['input']['num_days']}, "
-                f"budget: {item['input']['budget']}, "
-                f"people: {item['input']['num_people']}"
-            )
-            
-            # Convert output itinerary to string
-            output_text = json.dumps(item['output'])
-            
+            input_text, output_text = format_training_example(item)
             examples.append({
                 'input': input_text,
                 'output': output_text
@@ -67,28 +62,107 @@ class ItineraryDataset(Dataset):
     def __len__(self) -> int:
         return len(self.examples)
         
-    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+    def __getitem__(self, idx: int) -> Dict[str, List[int]]:
         example = self.examples[idx]
         
-        # Tokenize input and output
+        # Tokenize input and output; collate pads each batch to its longest
         input_ids = self.tokenizer.encode(
             example['input'],
             max_length=self.max_length,
-            padding='max_length',
+            padding=False,
             truncation=True
         )
         
         output_ids = self.tokenizer.encode(
             example['output'],
             max_length=self.max_length,
-            padding='max_length',
+            padding=False,
             truncation=True
         )
         
         return {
-            'input_ids': torch.tensor(input_ids),
-            'output_ids': torch.tensor(output_ids)
+            'input_ids': input_ids,
+            'output_ids': output_ids
         }
+        
+    def lengths(self) -> np.ndarray:
+        """Output length of each example in characters, a cheap stand-in for tokens when bucketing"""
+        return np.array([len(example['output']) for example in self.examples])
+        
+    def collate(self, batch: List[Dict[str, List[int]]]) -> Dict[str, torch.Tensor]:
+        return collate_padded(batch, self.tokenizer.pad_token_id)
+
+def loader_options(num_workers: int, device: torch.device) -> Dict:
+    """
+    DataLoader arguments for background loading: workers collate upcoming
+    batches while the model trains, and on CUDA batches land in pinned memory
+    so copies to the GPU can overlap with compute.
+    """
+    options = {'num_workers': num_workers, 'pin_memory': device.type == 'cuda'}
+    if num_workers > 0:
+        options.update(persistent_workers=True, prefetch_factor=4)
+    return options
+
+def launch_with_torchrun(nproc_per_node: int) -> int:
+    """
+    Re-run this script under torchrun with nproc_per_node processes on this
+    machine, splitting the CPU cores between them. Returns the exit code.
+    """
+    env = dict(os.environ)
+    env.setdefault('OMP_NUM_THREADS', str(max(1, (os.cpu_count() or 1) // nproc_per_node)))
+    command = [
+        sys.executable, '-m', 'torch.distributed.run',
+        '--standalone', f'--nproc_per_node={nproc_per_node}',
+        os.path.abspath(__file__), *sys.argv[1:]
+    ]
+    return subprocess.call(command, env=env)
+
+def setup_distributed(backend: str = 'gloo') -> Tuple[int, int, int]:
+    """
+    Join the process group torchrun set up the environment for.
+    
+    Returns:
+        Tuple[int, int, int]: (rank, local_rank, world_size); (0, 0, 1) when
+        not launched by torchrun
+    """
+    if int(os.environ.get('WORLD_SIZE', 1)) < 2:
+        return 0, 0, 1
+    dist.init_process_group(backend=backend)
+    return dist.get_rank(), int(os.environ.get('LOCAL_RANK', 0)), dist.get_world_size()
+
+def _all_reduce_sum(values: List[float], device: torch.device) -> List[float]:
+    """Sum values over all ranks (no-op without a process group)"""
+    if not (dist.is_available() and dist.is_initialized()):
+        return values
+    tensor = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+PRECISIONS = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+def _batch_loss(
+    model: ItineraryEncoderDecoder,
+    batch: Dict[str, torch.Tensor],
+    criterion: nn.Module,
+    device: torch.device,
+    dtype: Optional[torch.dtype]
+) -> torch.Tensor:
+    """Teacher-forced loss of one collated batch, under autocast if dtype is set"""
+    input_ids = batch['input_ids'].to(device, non_blocking=True)
+    output_ids = batch['output_ids'].to(device, non_blocking=True)
+    
+    with torch.autocast(device_type=device.type, dtype=dtype, enabled=dtype is not None):
+        # The LSTMs skip padding via the lengths. Position t predicts output token t + 1
+        outputs = model(
+            input_ids,
+            output_ids,
+            src_lengths=batch['input_lengths'],
+            tgt_lengths=batch['output_lengths']
+        )
+    return criterion(
+        outputs.float().reshape(-1, outputs.size(-1)),
+        output_ids[:, 1:].reshape(-1)
+    )
 
 def train(
     model: ItineraryEncoderDecoder,
@@ -98,144 +172,353 @@ def train(
     learning_rate: float,
     device: torch.device,
     checkpoint_dir: Union[str, Path],
-    wandb_config: Optional[Dict] = None
+    wandb_config: Optional[Dict] = None,
+    precision: str = 'fp32',
+    grad_accum_steps: int = 1,
+    log_every: int = 50,
+    max_grad_norm: float = 1.0,
+    checkpoint_every: int = 500,
+    keep_last: int = 3,
+    resume: Union[bool, str, Path] = False
 ):
-    """Train the model with validation and checkpointing"""
+    """
+    Train the model with validation and checkpointing.
+    
+    model may be wrapped in DistributedDataParallel (see setup_distributed).
+    Then each rank trains on its own loader shard, losses and throughput are
+    summed over all ranks, and only rank 0 logs, reports to wandb and saves
+    checkpoints.
+    
+    Args:
+        precision: 'fp32', 'bf16' (autocast, CPU or GPU) or 'fp16' (autocast
+            with loss scaling, CUDA only)
+        grad_accum_steps: Micro-batches per optimizer step; the effective
+            batch size is the loader's batch size times this
+        log_every: Optimizer steps between reading the loss back from the
+            device, which forces a sync, and logging it
+        max_grad_norm: Gradient clipping threshold
+        checkpoint_every: Optimizer steps between resumable checkpoints in
+            checkpoint_dir/checkpoints (0 for end of epoch only). They hold
+            the optimizer, scheduler, scaler, RNG and loader position and are
+            written in the background (see CheckpointManager)
+        keep_last: Number of resumable checkpoints to keep
+        resume: True to continue from the latest checkpoint if there is one,
+            or the path of a checkpoint directory
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {list(PRECISIONS)}")
+    if precision == 'fp16' and device.type != 'cuda':
+        raise ValueError("fp16 training needs CUDA; use bf16 on CPU")
+    dtype = PRECISIONS[precision]
     
-    # Initialize wandb if config provided
+    distributed = isinstance(model, DistributedDataParallel)
+    module = model.module if distributed else model
+    is_main = not distributed or dist.get_rank() == 0
+    wandb_config = wandb_config if is_main else None
+    
+    # Initialize wandb if config provided; only needed for tracked runs
     if wandb_config:
+        import wandb  # for experiment tracking
         wandb.init(
             project=wandb_config['project'],
             config={
                 'learning_rate': learning_rate,
                 'num_epochs': num_epochs,
-                'model_config': model.config,
+                'precision': precision,
+                'grad_accum_steps': grad_accum_steps,
+                'model_config': module.config,
                 **wandb_config
             }
         )
     
     # Setup training
     optimizer = optim.AdamW(model.parameters(), lr=learning_rate)
-    criterion = nn.CrossEntropyLoss(ignore_index=model.tokenizer.pad_token_id)
+    criterion = nn.CrossEntropyLoss(ignore_index=module.pad_token_id)
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(
         optimizer,
         mode='min',
         factor=0.5,
         patience=2
     )
+    scaler = torch.amp.GradScaler('cuda', enabled=precision == 'fp16')
+    
+    world_size = dist.get_world_size() if distributed else 1
+    checkpoints = CheckpointManager(
+        Path(checkpoint_dir) / 'checkpoints',
+        keep_last=keep_last,
+        rank=dist.get_rank() if distributed else 0,
+        world_size=world_size
+    )
+    
+    def save_checkpoint(epoch: int, batches_done: int):
+        checkpoints.save(global_step, {
+            'model': module.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'scheduler': scheduler.state_dict(),
+            'scaler': scaler.state_dict(),
+            'epoch': epoch,
+            'batches_done': batches_done,
+            'global_step': global_step,
+            'best_val_loss': best_val_loss,
+            'world_size': world_size
+        })
     
-    # Training loop
     best_val_loss = float('inf')
-    for epoch in range(num_epochs):
+    start_epoch, start_batch, global_step = 0, 0, 0
+    rng_state = None
+    resume_path = checkpoints.latest() if resume is True else (Path(resume) if resume else None)
+    if resume_path is not None:
+        state, rng_state = checkpoints.load(resume_path)
+        module.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        scheduler.load_state_dict(state['scheduler'])
+        scaler.load_state_dict(state['scaler'])
+        start_epoch, start_batch = state['epoch'], state['batches_done']
+        global_step, best_val_loss = state['global_step'], state['best_val_loss']
+        if rng_state is None:
+            logger.warning(f'{resume_path} has no RNG state for this rank')
+        if state['world_size'] != world_size:
+            logger.warning(
+                f"Checkpoint was written by {state['world_size']} ranks, resuming on {world_size}; "
+                "the data order of the current epoch will differ"
+            )
+        if is_main:
+            logger.info(f'Resuming from {resume_path}: epoch {start_epoch+1}, batch {start_batch}, step {global_step}')
+    elif resume and is_main:
+        logger.info(f'No checkpoint to resume from in {checkpoints.directory}, starting from scratch')
+    
+    for epoch in range(start_epoch, num_epochs):
         model.train()
-        train_loss = 0.0
+        optimizer.zero_grad(set_to_none=True)
+        
+        # Same batch order on every run of this epoch; skip batches a
+        # resumed checkpoint already trained on
+        skip = start_batch if epoch == start_epoch else 0
+        
+        # Starting a loader iterator draws a seed. A mid-epoch checkpoint
+        # captured RNG after that draw, an end-of-epoch one before it
+        if rng_state is not None and skip == 0:
+            restore_rng_state(rng_state)
+            rng_state = None
+        batch_sampler = getattr(train_loader, 'batch_sampler', None)
+        if hasattr(batch_sampler, 'set_epoch'):
+            batch_sampler.set_epoch(epoch)
+        if hasattr(batch_sampler, 'set_start_batch'):
+            batch_sampler.set_start_batch(skip)
+            total_batches = skip + len(train_loader)
+            batches = iter(train_loader)
+        else:
+            total_batches = len(train_loader)
+            batches = itertools.islice(train_loader, skip, None)
+        if rng_state is not None:
+            restore_rng_state(rng_state)
+            rng_state = None
+        
+        # Losses stay on the device and are summed there; reading them is a sync
+        logged_loss = torch.zeros((), device=device)
+        logged_batches = 0
+        epoch_loss = torch.zeros((), device=device)
+        num_batches, num_samples, num_tokens, optimizer_steps = 0, 0, 0, 0
+        epoch_start = time.time()
         
         # Training
-        with tqdm(train_loader, desc=f'Epoch {epoch+1}/{num_epochs}') as pbar:
-            for batch in pbar:
-                # Move batch to device
-                input_ids = batch['input_ids'].to(device)
-                output_ids = batch['output_ids'].to(device)
+        with tqdm(
+            batches,
+            desc=f'Epoch {epoch+1}/{num_epochs}',
+            initial=skip,
+            total=total_batches,
+            disable=not is_main
+        ) as pbar:
+            for step, batch in enumerate(pbar, start=skip + 1):
+                # Gradients add up over grad_accum_steps micro-batches; DDP
+                # only all-reduces them on the micro-batch that steps
+                sync = step % grad_accum_steps == 0 or step == total_batches
+                # The last group of an epoch may be short; average over its real size
+                group_start = (step - 1) // grad_accum_steps * grad_accum_steps
+                group_size = min(grad_accum_steps, total_batches - group_start)
+                with model.no_sync() if distributed and not sync else contextlib.nullcontext():
+                    loss = _batch_loss(model, batch, criterion, device, dtype)
+                    scaler.scale(loss / group_size).backward()
                 
-                # Forward pass
-                outputs = model(input_ids, output_ids)
-                loss = criterion(
-                    outputs.view(-1, outputs.size(-1)),
-                    output_ids.view(-1)
-                )
+                # Update metrics
+                logged_loss += loss.detach()
+                logged_batches += 1
+                epoch_loss += loss.detach()
+                num_batches += 1
+                num_samples += len(batch['output_lengths'])
+                num_tokens += int(batch['output_lengths'].sum())
                 
-                # Backward pass
-                optimizer.zero_grad()
-                loss.backward()
-                torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-                optimizer.step()
+                if not sync:
+                    continue
+                    
+                scaler.unscale_(optimizer)
+                torch.nn.utils.clip_grad_norm_(model.parameters(), max_grad_norm)
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
+                optimizer_steps += 1
+                global_step += 1
                 
-                # Update metrics
-                train_loss += loss.item()
-                pbar.set_postfix({'loss': loss.item()})
+                if optimizer_steps % log_every == 0:
+                    train_loss = logged_loss.item() / logged_batches
+                    logged_loss.zero_()
+                    logged_batches = 0
+                    pbar.set_postfix({'loss': train_loss})
+                    if wandb_config:
+                        wandb.log({'train_loss': train_loss})
                 
-                if wandb_config:
-                    wandb.log({'train_loss': loss.item()})
+                # The end of the epoch is checkpointed after validation
+                if checkpoint_every and global_step % checkpoint_every == 0 and step < total_batches:
+                    save_checkpoint(epoch, step)
+        
+        elapsed = time.time() - epoch_start
+        epoch_loss, num_batches, num_samples, num_tokens = _all_reduce_sum(
+            [epoch_loss.item(), num_batches, num_samples, num_tokens], device
+        )
+        throughput = {
+            'train_loss': epoch_loss / max(1, num_batches),
+            'samples_per_second': num_samples / elapsed,
+            'tokens_per_second': num_tokens / elapsed
+        }
+        if is_main:
+            logger.info(
+                f"Epoch {epoch+1}: loss {throughput['train_loss']:.4f}, "
+                f"{throughput['samples_per_second']:.1f} samples/s, "
+                f"{throughput['tokens_per_second']:.0f} target tokens/s"
+            )
         
-        # Validation
+        # Validation; each rank scores its shard and the mean is over all batches
         model.eval()
-        val_loss = 0.0
+        val_loss = torch.zeros((), device=device)
         with torch.no_grad():
             for batch in val_loader:
-                input_ids = batch['input_ids'].to(device)
-                output_ids = batch['output_ids'].to(device)
+                val_loss += _batch_loss(module, batch, criterion, device, dtype)
                 
-                outputs = model(input_ids, output_ids)
-                loss = criterion(
-                    outputs.view(-1, outputs.size(-1)),
-                    output_ids.view(-1)
-                )
-                val_loss += loss.item()
-                
-        val_loss /= len(val_loader)
-        logger.info(f'Validation loss: {val_loss:.4f}')
+        val_loss, val_batches = _all_reduce_sum([val_loss.item(), len(val_loader)], device)
+        val_loss /= max(1, val_batches)
+        if is_main:
+            logger.info(f'Validation loss: {val_loss:.4f}')
         
         if wandb_config:
-            wandb.log({'val_loss': val_loss})
+            wandb.log({'val_loss': val_loss, **throughput})
         
         # Save checkpoint if best model
         if val_loss < best_val_loss:
             best_val_loss = val_loss
-            checkpoint_path = Path(checkpoint_dir) / 'best_model.pt'
-            model.save_pretrained(checkpoint_path)
-            logger.info(f'Saved best model to {checkpoint_path}')
+            if is_main:
+                checkpoint_path = Path(checkpoint_dir) / 'best_model.pt'
+                module.save_pretrained(checkpoint_path)
+                logger.info(f'Saved best model to {checkpoint_path}')
         
         # Update learning rate
         scheduler.step(val_loss)
+        save_checkpoint(epoch + 1, 0)
+    
+    # Let the last background write finish
+    checkpoints.close()
 
 if __name__ == '__main__':
     import argparse
     
     parser = argparse.ArgumentParser()
-    parser.add_argument('--data_path', type=str, required=True)
+    parser.add_argument('--data_path', type=str, required=True,
+                        help='Split directory written by ml.prepare_data, JSON records, or a directory written by ml.token_dataset')
     parser.add_argument('--checkpoint_dir', type=str, required=True)
     parser.add_argument('--num_epochs', type=int, default=10)
     parser.add_argument('--batch_size', type=int, default=32)
     parser.add_argument('--learning_rate', type=float, default=5e-5)
     parser.add_argument('--max_length', type=int, default=512)
+    parser.add_argument('--bucket_multiplier', type=int, default=50,
+                        help='Batches are formed from pools this many batches big, sorted by length')
+    parser.add_argument('--precision', type=str, default='fp32', choices=list(PRECISIONS))
+    parser.add_argument('--grad_accum_steps', type=int, default=1)
+    parser.add_argument('--log_every', type=int, default=50,
+                        help='Optimizer steps between loss readouts')
+    parser.add_argument('--checkpoint_every', type=int, default=500,
+                        help='Optimizer steps between resumable checkpoints (0: end of epoch only)')
+    parser.add_argument('--keep_last', type=int, default=3,
+                        help='Number of resumable checkpoints to keep')
+    parser.add_argument('--resume', nargs='?', const=True, default=False,
+                        help='Continue from the latest checkpoint in checkpoint_dir, or from the given checkpoint')
+    parser.add_argument('--num_workers', type=int, default=min(4, max(0, (os.cpu_count() or 1) - 1)))
+    parser.add_argument('--nproc_per_node', type=int, default=1,
+                        help='Train with DistributedDataParallel on this many local processes, launched via torchrun')
+    parser.add_argument('--backend', type=str, default='gloo', choices=['gloo', 'nccl'])
+    parser.add_argument('--seed', type=int, default=42)
     parser.add_argument('--wandb_project', type=str)
     args = parser.parse_args()
     
+    if args.nproc_per_node > 1 and 'LOCAL_RANK' not in os.environ:
+        sys.exit(launch_with_torchrun(args.nproc_per_node))
+    rank, local_rank, world_size = setup_distributed(args.backend)
+    
     # Setup device
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    logger.info(f'Using device: {device}')
+    if torch.cuda.is_available():
+        device = torch.device('cuda', local_rank)
+        torch.cuda.set_device(device)
+    else:
+        device = torch.device('cpu')
+    logger.info(f'Using device: {device} (rank {rank} of {world_size})')
     
     # Load tokenizer and create datasets
     tokenizer = ItineraryTokenizer.from_pretrained('gpt2')  # Using GPT2 tokenizer as base
     
-    dataset = ItineraryDataset(
-        args.data_path,
-        tokenizer,
-        max_length=args.max_length
-    )
+    if (Path(args.data_path) / 'meta.json').exists():
+        # Pre-tokenized and memory-mapped
+        dataset = TokenizedItineraryDataset(args.data_path, max_length=args.max_length)
+    else:
+        dataset = ItineraryDataset(
+            args.data_path,
+            tokenizer,
+            max_length=args.max_length
+        )
     
-    # Split dataset
-    train_data, val_data = train_test_split(dataset, test_size=0.1)
+    # Split dataset; the seed keeps the split identical on every rank
+    train_indices, val_indices = train_test_split(np.arange(len(dataset)), test_size=0.1, random_state=args.seed)
+    lengths = dataset.lengths()
     
+    # Batches of similar lengths, padded to their longest example
     train_loader = DataLoader(
-        train_data,
-        batch_size=args.batch_size,
-        shuffle=True
+        Subset(dataset, train_indices),
+        batch_sampler=LengthBucketSampler(
+            lengths[train_indices],
+            args.batch_size,
+            bucket_multiplier=args.bucket_multiplier,
+            drop_last=world_size > 1,
+            seed=args.seed,
+            num_replicas=world_size,
+            rank=rank
+        ),
+        collate_fn=dataset.collate,
+        **loader_options(args.num_workers, device)
     )
     
     val_loader = DataLoader(
-        val_data,
-        batch_size=args.batch_size
+        Subset(dataset, val_indices),
+        batch_sampler=LengthBucketSampler(
+            lengths[val_indices],
+            args.batch_size,
+            shuffle=False,
+            num_replicas=world_size,
+            rank=rank
+        ),
+        collate_fn=dataset.collate,
+        **loader_options(args.num_workers, device)
     )
     
-    # Initialize model
+    # Initialize model; DDP broadcasts rank 0's weights to the other ranks
+    torch.manual_seed(args.seed)
     model = ItineraryEncoderDecoder(
-        vocab_size=len(tokenizer),
+        vocab_size=tokenizer.vocab_size,
         embed_dim=256,
         hidden_dim=512,
         num_layers=4,
-        dropout=0.1
+        dropout=0.1,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id
     ).to(device)
+    if world_size > 1:
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
     
     # Train model
     wandb_config = {'project': args.wandb_project} if args.wandb_project else None
@@ -248,5 +531,14 @@ if __name__ == '__main__':
         args.learning_rate,
         device,
         args.checkpoint_dir,
-        wandb_config
-    )
\ No newline at end of file
+        wandb_config,
+        precision=args.precision,
+        grad_accum_steps=args.grad_accum_steps,
+        log_every=args.log_every,
+        checkpoint_every=args.checkpoint_every,
+        keep_last=args.keep_last,
+        resume=args.resume
+    )
+    
+    if world_size > 1:
+        dist.destroy_process_group()
\ No newline at end of file
@@ -1,4 +1,3 @@
-import torch
 from pathlib import Path
 import json
 import logging
@@ -47,107 +46,148 @@ class TransportOption:
     booking_url: str = ""
 
 class ItineraryPlanner:
-    def __init__(self, api_key: str, cache_service=None):
+    def __init__(self, api_key: str, cache_service=None, single_flight=None):
+        # Imported here so build_cache_params and the routes don't load torch
+        import torch
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.api_key = api_key
         self.logger = logging.getLogger(__name__)
         self.cache_service = cache_service
+        self.single_flight = single_flight
         
         # Initialize location cache
         self.location_cache = {}
         
+    @staticmethod
+    def build_cache_params(destination: str,
+                           start_date: datetime,
+                           end_date: datetime,
+                           budget: float,
+                           preferences: Dict[str, Any],
+                           group_size: int) -> Dict[str, Any]:
+        """Build the parameters that identify an itinerary in the cache."""
+        return {
+            "destination": destination,
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "budget": budget,
+            "preferences": preferences,
+            "group_size": group_size
+        }
+        
     def generate_itinerary(self, 
                           destination: str,
                           start_date: datetime,
                           end_date: datetime,
                           budget: float,
                           preferences: Dict[str, Any],
-                          group_size: int) -> Dict[str, Any]:
+                          group_size: int,
+                          check_cache: bool = True) -> Dict[str, Any]:
         """
         Generate a complete travel itinerary.
+        Set check_cache to False when the caller has already looked up the cache.
         """
         try:
+            cache_params = self.build_cache_params(
+                destination, start_date, end_date, budget, preferences, group_size
+            )
+            
             # Check cache first
-            if self.cache_service:
-                cache_params = {
-                    "destination": destination,
-                    "start_date": start_date.isoformat(),
-                    "end_date": end_date.isoformat(),
-                    "budget": budget,
-                    "preferences": preferences,
-                    "group_size": group_size
-                }
+            if self.cache_service and check_cache:
                 cached_itinerary = self.cache_service.get_cached_itinerary(cache_params)
                 if cached_itinerary:
                     self.logger.info(f"Returning cached itinerary for {destination}")
                     return cached_itinerary
             
-            # Calculate trip duration
-            trip_days = (end_date - start_date).days + 1
-            
-            # Get destination details and nearby points of interest
-            destination_info = self._get_location_details(destination)
-            attractions = self._get_nearby_attractions(destination_info)
-            restaurants = self._get_nearby_restaurants(destination_info)
-            hotels = self._get_accommodation_options(destination_info, budget/trip_days)
-            
-            # Initialize daily budget
-            daily_budget = budget / trip_days
-            
-            # Generate day-by-day itinerary
-            itinerary = []
-            current_location = hotels[0]  # Start from hotel
-            
-            for day in range(trip_days):
-                current_date = start_date + timedelta(days=day)
-                
-                # Plan activities for the day
-                day_plan = self._plan_day(
-                    current_date,
-                    current_location,
-                    attractions,
-                    restaurants,
-                    daily_budget,
-                    preferences
+            # Only one identical generation runs at a time, across workers
+            if self.single_flight:
+                return self.single_flight.do(
+                    self._single_flight_key(cache_params),
+                    lambda: self._generate_and_cache(
+                        destination, start_date, end_date, budget, preferences, cache_params
+                    ),
+                    lookup=(
+                        (lambda: self.cache_service.get_cached_itinerary(cache_params))
+                        if self.cache_service else None
+                    )
                 )
-                
-                itinerary.append(day_plan)
-                current_location = day_plan.activities[-1].location
-            
-            # Calculate total costs and statistics
-            total_cost = sum(day.total_cost for day in itinerary)
-            total_distance = self._calculate_total_distance(itinerary)
-            
-            result = {
-                "itinerary": [self._day_plan_to_dict(day) for day in itinerary],
-                "summary": {
-                    "total_cost": total_cost,
-                    "total_distance": total_distance,
-                    "start_date": start_date.isoformat(),
-                    "end_date": end_date.isoformat(),
-                    "destination": destination,
-                    "hotel": self._location_to_dict(hotels[0])
-                }
-            }
-            
-            # Cache the result
-            if self.cache_service:
-                cache_params = {
-                    "destination": destination,
-                    "start_date": start_date.isoformat(),
-                    "end_date": end_date.isoformat(),
-                    "budget": budget,
-                    "preferences": preferences,
-                    "group_size": group_size
-                }
-                self.cache_service.cache_itinerary(cache_params, result)
             
-            return result
+            return self._generate_and_cache(
+                destination, start_date, end_date, budget, preferences, cache_params
+            )
             
         except Exception as e:
             self.logger.error(f"Error generating itinerary: {str(e)}")
             raise
 
+    def _single_flight_key(self, cache_params: Dict[str, Any]) -> str:
+        """Deduplication key; the same hash the cache uses."""
+        if self.cache_service:
+            return self.cache_service._generate_cache_key(cache_params)
+        return json.dumps(cache_params, sort_keys=True)
+
+    def _generate_and_cache(self,
+                            destination: str,
+                            start_date: datetime,
+                            end_date: datetime,
+                            budget: float,
+                            preferences: Dict[str, Any],
+                            cache_params: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the full generation and cache its result."""
+        # Calculate trip duration
+        trip_days = (end_date - start_date).days + 1
+        
+        # Get destination details and nearby points of interest
+        destination_info = self._get_location_details(destination)
+        attractions = self._get_nearby_attractions(destination_info)
+        restaurants = self._get_nearby_restaurants(destination_info)
+        hotels = self._get_accommodation_options(destination_info, budget/trip_days)
+        
+        # Initialize daily budget
+        daily_budget = budget / trip_days
+        
+        # Generate day-by-day itinerary
+        itinerary = []
+        current_location = hotels[0]  # Start from hotel
+        
+        for day in range(trip_days):
+            current_date = start_date + timedelta(days=day)
+            
+            # Plan activities for the day
+            day_plan = self._plan_day(
+                current_date,
+                current_location,
+                attractions,
+                restaurants,
+                daily_budget,
+                preferences
+            )
+            
+            itinerary.append(day_plan)
+            current_location = day_plan.activities[-1].location
+        
+        # Calculate total costs and statistics
+        total_cost = sum(day.total_cost for day in itinerary)
+        total_distance = self._calculate_total_distance(itinerary)
+        
+        result = {
+            "itinerary": [self._day_plan_to_dict(day) for day in itinerary],
+            "summary": {
+                "total_cost": total_cost,
+                "total_distance": total_distance,
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(),
+                "destination": destination,
+                "hotel": self._location_to_dict(hotels[0])
+            }
+        }
+        
+        # Cache the result
+        if self.cache_service:
+            self.cache_service.cache_itinerary(cache_params, result)
+        
+        return result
+
     def _get_location_details(self, place_name: str) -> Location:
         """Get detailed information about a location using Google Places API."""
         if place_name in self.location_cache:
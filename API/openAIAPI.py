@@ -1,6 +1,8 @@
 import os
-from typing import Dict, List, Optional, Union
+from typing import AsyncIterator, Dict, List, Optional, Union
 import json
+import asyncio
+from datetime import timedelta
 try:
     import requests
     from dotenv import load_dotenv
@@ -8,24 +10,66 @@ except ImportError:
     print("Please install required packages: pip install requests python-dotenv")
     raise
 
-# Load environment variables from .env file if it exists
-load_dotenv()
+from .llm_client import get_llm_client, get_async_llm_client
+from .json_stream import JSONStreamParser
+from .services.prompt_cache import SemanticPromptCache
+from .services.circuit_breaker import CircuitBreaker
 
-# Set your Together.ai API key from environment variable
-API_KEY = os.getenv("TOGETHER_API_KEY")
-if not API_KEY:
-    print("TOGETHER_API_KEY not found, checking OPENAI_API_KEY...")
-    API_KEY = os.getenv("OPENAI_API_KEY")
+MODEL_NAME = "mistralai/Mixtral-8x7B-Instruct-v0.1"  # A powerful model available on Together.ai
 
-if not API_KEY:
-    raise ValueError(
-        "API key not found. Please set either TOGETHER_API_KEY or OPENAI_API_KEY environment variable. "
-        "You can get an API key from https://api.together.xyz/settings/api-keys"
-    )
-else:
-    print(f"Using API key: {API_KEY[:10]}...")
+# Resolved on first use, so importing this module has no side effects
+API_KEY: Optional[str] = None
+_prompt_cache = None  # False once found to be disabled
 
-MODEL_NAME = "mistralai/Mixtral-8x7B-Instruct-v0.1"  # A powerful model available on Together.ai
+def get_api_key() -> str:
+    """
+    Get the Together.ai API key, loading a .env file if it exists.
+    
+    Raises:
+        ValueError: If neither TOGETHER_API_KEY nor OPENAI_API_KEY is set
+    """
+    global API_KEY
+    if API_KEY:
+        return API_KEY
+    
+    load_dotenv()
+    api_key = os.getenv("TOGETHER_API_KEY")
+    if not api_key:
+        print("TOGETHER_API_KEY not found, checking OPENAI_API_KEY...")
+        api_key = os.getenv("OPENAI_API_KEY")
+    
+    if not api_key:
+        raise ValueError(
+            "API key not found. Please set either TOGETHER_API_KEY or OPENAI_API_KEY environment variable. "
+            "You can get an API key from https://api.together.xyz/settings/api-keys"
+        )
+    print(f"Using API key: {api_key[:10]}...")
+    API_KEY = api_key
+    return API_KEY
+
+def get_prompt_cache() -> Optional[SemanticPromptCache]:
+    """
+    Get the shared near-duplicate response cache, creating it on first use.
+    It is shared through Redis when REDIS_URL is set; None if disabled.
+    """
+    global _prompt_cache
+    if _prompt_cache is None:
+        load_dotenv()
+        if os.getenv("PROMPT_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            _prompt_cache = False
+            return None
+        redis_client = None
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            from redis import Redis
+            redis_client = Redis.from_url(redis_url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        _prompt_cache = SemanticPromptCache(
+            redis=redis_client,
+            ttl=timedelta(days=float(os.getenv("PROMPT_CACHE_TTL_DAYS", "7"))),
+            min_similarity=float(os.getenv("PROMPT_CACHE_MIN_SIMILARITY", "0.7")),
+            circuit_breaker=CircuitBreaker("prompt_cache")
+        )
+    return _prompt_cache or None
 
 class TravelPreferences:
     def __init__(
@@ -51,21 +95,8 @@ class TravelPreferences:
             "num_people": self.num_people
         }
 
-def generate_itinerary(preferences: TravelPreferences) -> Dict:
-    """
-    Generate a detailed travel itinerary using OpenAI's GPT-4.
-    
-    Args:
-        preferences (TravelPreferences): Travel preferences including destination, group type, etc.
-        
-    Returns:
-        Dict: Generated itinerary in JSON format
-        
-    Raises:
-        requests.RequestException: If the API call fails
-        json.JSONDecodeError: If the response is not valid JSON
-    """
-
+def _build_payload(preferences: TravelPreferences) -> Dict:
+    """Build the chat completion request for the given preferences."""
     prompt_template = """Create a detailed travel itinerary for:
     Destination: {destination}
     Group Type: {group_type} ({num_people} people)
@@ -116,13 +147,7 @@ def generate_itinerary(preferences: TravelPreferences) -> Dict:
         budget=preferences.budget
     )
 
-    # Set up the API request
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",  # Together.ai requires "Bearer" prefix
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
+    return {
         "model": MODEL_NAME,
         "messages": [
             {"role": "system", "content": "You are a travel planning assistant that generates detailed itineraries in JSON format. Always ensure your responses are valid JSON objects."},
@@ -135,25 +160,43 @@ def generate_itinerary(preferences: TravelPreferences) -> Dict:
         "presence_penalty": 0
     }
 
-    try:
-        # Make the API request to Together.ai API endpoint
-        response = requests.post(
-            "https://api.together.xyz/v1/chat/completions",
-            headers=headers,
-            json=payload
-        )
+def _parse_response(result: Dict) -> Dict:
+    """Extract and parse the itinerary JSON from a chat completion response."""
+    if "choices" in result and len(result["choices"]) > 0:
+        # Extract and parse the JSON content from the message
+        content = result["choices"][0]["message"]["content"]
+        return json.loads(content)
+    else:
+        raise ValueError("Unexpected API response format")
+
+def generate_itinerary(preferences: TravelPreferences, use_prompt_cache: bool = True) -> Dict:
+    """
+    Generate a detailed travel itinerary using OpenAI's GPT-4.
+    
+    Args:
+        preferences (TravelPreferences): Travel preferences including destination, group type, etc.
+        use_prompt_cache (bool): Reuse a stored itinerary for a near-identical request
         
-        # Raise an exception for any HTTP error
-        response.raise_for_status()
+    Returns:
+        Dict: Generated itinerary in JSON format
+        
+    Raises:
+        requests.RequestException: If the API call fails
+        json.JSONDecodeError: If the response is not valid JSON
+    """
+    try:
+        prompt_cache = get_prompt_cache() if use_prompt_cache else None
+        if prompt_cache:
+            cached = prompt_cache.get(preferences)
+            if cached:
+                return cached
         
-        # Parse the response
-        result = response.json()
-        if "choices" in result and len(result["choices"]) > 0:
-            # Extract and parse the JSON content from the message
-            content = result["choices"][0]["message"]["content"]
-            return json.loads(content)
-        else:
-            raise ValueError("Unexpected API response format")
+        # Pooled, retrying client shared by all callers using this key
+        result = get_llm_client(get_api_key()).chat_completion(_build_payload(preferences))
+        itinerary = _parse_response(result)
+        if prompt_cache:
+            prompt_cache.set(preferences, itinerary)
+        return itinerary
             
     except requests.RequestException as e:
         print(f"API Request Error: {str(e)}")
@@ -165,6 +208,74 @@ def generate_itinerary(preferences: TravelPreferences) -> Dict:
         print(f"Unexpected Error: {str(e)}")
         raise
 
+async def generate_itinerary_async(preferences: TravelPreferences, use_prompt_cache: bool = True) -> Dict:
+    """
+    Async variant of generate_itinerary that does not block the event loop.
+    
+    Raises:
+        httpx.HTTPError: If the API call fails
+        json.JSONDecodeError: If the response is not valid JSON
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        prompt_cache = get_prompt_cache() if use_prompt_cache else None
+        if prompt_cache:
+            cached = await loop.run_in_executor(None, prompt_cache.get, preferences)
+            if cached:
+                return cached
+        
+        result = await get_async_llm_client(get_api_key()).chat_completion(_build_payload(preferences))
+        itinerary = _parse_response(result)
+        if prompt_cache:
+            await loop.run_in_executor(None, prompt_cache.set, preferences, itinerary)
+        return itinerary
+    except json.JSONDecodeError as e:
+        print(f"JSON Parsing Error: {str(e)}")
+        raise
+    except Exception as e:
+        print(f"API Request Error: {str(e)}")
+        raise
+
+async def generate_itinerary_stream(preferences: TravelPreferences, use_prompt_cache: bool = True) -> AsyncIterator[Dict]:
+    """
+    Stream an itinerary from the provider, yielding each day once complete.
+    A prompt cache hit is replayed straight away.
+    
+    Yields:
+        Dict: {"type": "day", "day": {...}} for every day as soon as it has
+        been generated, then {"type": "itinerary", "itinerary": {...}} with
+        the whole parsed itinerary
+        
+    Raises:
+        httpx.HTTPError: If the API call fails
+        json.JSONDecodeError: If the response is not valid JSON
+    """
+    parser = JSONStreamParser(array_key="days")
+    try:
+        loop = asyncio.get_running_loop()
+        prompt_cache = get_prompt_cache() if use_prompt_cache else None
+        if prompt_cache:
+            cached = await loop.run_in_executor(None, prompt_cache.get, preferences)
+            if cached:
+                for day in cached.get("days", []):
+                    yield {"type": "day", "day": day}
+                yield {"type": "itinerary", "itinerary": cached}
+                return
+        
+        async for chunk in get_async_llm_client(get_api_key()).stream_chat_completion(_build_payload(preferences)):
+            for day in parser.feed(chunk):
+                yield {"type": "day", "day": day}
+        itinerary = parser.result()
+        if prompt_cache:
+            await loop.run_in_executor(None, prompt_cache.set, preferences, itinerary)
+        yield {"type": "itinerary", "itinerary": itinerary}
+    except json.JSONDecodeError as e:
+        print(f"JSON Parsing Error: {str(e)}")
+        raise
+    except Exception as e:
+        print(f"API Request Error: {str(e)}")
+        raise
+
 if __name__ == "__main__":
     # Example usage
     preferences = TravelPreferences(
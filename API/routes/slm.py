@@ -1,31 +1,137 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from functools import partial
 import asyncio
 import logging
+import threading
 import json
 from fastapi.security import APIKeyHeader
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from starlette.config import Config
 from API.ml.trip_planner import ItineraryPlanner
 from API.services.cache_service import CacheService
+from API.services.codecs import best_available
+from API.services.concurrency import ConcurrencyLimiter, ConcurrencyLimitExceeded
+from API.services.single_flight import SingleFlight
+from API.llm_client import RetryPolicy
 
 # Load configuration
 config = Config(".env")
 API_KEY = config("API_KEY", default="")
 MAPS_API_KEY = config("GOOGLE_MAPS_API_KEY", default="")
 REDIS_URL = config("REDIS_URL", default="redis://localhost:6379")
+GENERATION_CONCURRENCY = config("GENERATION_CONCURRENCY", cast=int, default=4)
+GENERATION_QUEUE_TIMEOUT = config("GENERATION_QUEUE_TIMEOUT", cast=float, default=10.0)
+GENERATION_MAX_QUEUE = config("GENERATION_MAX_QUEUE", cast=int, default=64)
+CACHE_WORKERS = config("CACHE_WORKERS", cast=int, default=8)
+LOCAL_CACHE_MAX_BYTES = config("LOCAL_CACHE_MAX_BYTES", cast=int, default=64 * 1024 * 1024)
+LOCAL_CACHE_TTL_SECONDS = config("LOCAL_CACHE_TTL_SECONDS", cast=int, default=300)
+CACHE_SERIALIZER = config("CACHE_SERIALIZER", default=None)
+CACHE_COMPRESSION = config("CACHE_COMPRESSION", default=None)
+REDIS_MAX_CONNECTIONS = config("REDIS_MAX_CONNECTIONS", cast=int, default=50)
+REDIS_SOCKET_TIMEOUT = config("REDIS_SOCKET_TIMEOUT", cast=float, default=0.25)
+REDIS_CONNECT_TIMEOUT = config("REDIS_CONNECT_TIMEOUT", cast=float, default=0.25)
+CACHE_BREAKER_FAILURES = config("CACHE_BREAKER_FAILURES", cast=int, default=5)
+CACHE_BREAKER_RESET_SECONDS = config("CACHE_BREAKER_RESET_SECONDS", cast=float, default=30.0)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Initialize services
-try:
-    cache_service = CacheService(redis_url=REDIS_URL)
-    planner = ItineraryPlanner(api_key=MAPS_API_KEY, cache_service=cache_service)
-except Exception as e:
-    logger.error(f"Failed to initialize services: {str(e)}")
-    raise
+# Services are created on first use and injected with Depends, so importing
+# this module neither opens sockets nor loads torch, and tests can override them
+_services_lock = threading.RLock()
+_cache_service: Optional[CacheService] = None
+_single_flight: Optional[SingleFlight] = None
+_planner: Optional[ItineraryPlanner] = None
+_itinerary_generator = None
+
+def get_cache_service() -> CacheService:
+    """Get the shared cache service, creating it on first use."""
+    global _cache_service
+    with _services_lock:
+        if _cache_service is None:
+            _cache_service = CacheService(
+                redis_url=REDIS_URL,
+                local_cache_max_bytes=LOCAL_CACHE_MAX_BYTES,
+                local_cache_ttl=timedelta(seconds=LOCAL_CACHE_TTL_SECONDS),
+                codec=best_available(CACHE_SERIALIZER, CACHE_COMPRESSION),
+                max_connections=REDIS_MAX_CONNECTIONS,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                failure_threshold=CACHE_BREAKER_FAILURES,
+                reset_timeout=CACHE_BREAKER_RESET_SECONDS
+            )
+        return _cache_service
+
+def get_single_flight() -> SingleFlight:
+    """Get the shared single-flight deduplicator, creating it on first use."""
+    global _single_flight
+    with _services_lock:
+        if _single_flight is None:
+            cache_service = get_cache_service()
+            _single_flight = SingleFlight(
+                redis=cache_service.redis,
+                circuit_breaker=cache_service.circuit_breaker
+            )
+        return _single_flight
+
+def get_planner() -> ItineraryPlanner:
+    """Get the shared planner, creating it (and loading torch) on first use."""
+    global _planner
+    with _services_lock:
+        if _planner is None:
+            try:
+                _planner = ItineraryPlanner(
+                    api_key=MAPS_API_KEY,
+                    cache_service=get_cache_service(),
+                    single_flight=get_single_flight()
+                )
+            except Exception as e:
+                logger.error(f"Failed to initialize services: {str(e)}")
+                raise
+        return _planner
+
+def get_itinerary_generator():
+    """Get the shared LLM-backed generator, creating it on first use."""
+    global _itinerary_generator
+    with _services_lock:
+        if _itinerary_generator is None:
+            from API.itinerary_generator import ItineraryGenerator
+            _itinerary_generator = ItineraryGenerator()
+        return _itinerary_generator
+
+# Blocking planner and Redis calls run on separate, sized executors so they
+# never stall the event loop, and cache hits never queue behind generations
+generation_executor = ThreadPoolExecutor(
+    max_workers=GENERATION_CONCURRENCY,
+    thread_name_prefix="generation"
+)
+cache_executor = ThreadPoolExecutor(max_workers=CACHE_WORKERS, thread_name_prefix="cache")
+generation_limiter = ConcurrencyLimiter(
+    max_concurrency=GENERATION_CONCURRENCY,
+    queue_timeout=GENERATION_QUEUE_TIMEOUT,
+    max_queue=GENERATION_MAX_QUEUE
+)
+
+async def run_in_cache_executor(func, *args, **kwargs):
+    """Run a blocking cache call without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cache_executor, partial(func, *args, **kwargs))
+
+async def run_in_generation_executor(func, *args, **kwargs):
+    """Run a blocking generation call without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(generation_executor, partial(func, *args, **kwargs))
+
+def format_sse(event: str, data: Any) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 # Security
 api_key_header = APIKeyHeader(name="X-API-Key")
@@ -61,62 +167,22 @@ class ItineraryRequest(BaseModel):
     group_size: int
     preferences: TripPreferences
 
+class StreamItineraryRequest(BaseModel):
+    destination: Optional[str] = None
+    group_type: str
+    num_days: int
+    budget: str
+    num_people: int
+
 @router.post("/generate", response_model=Dict[str, Any])
 async def generate_itinerary(
     request: ItineraryRequest,
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    cache_service: CacheService = Depends(get_cache_service)
 ):
     """Generate a complete travel itinerary based on user preferences."""
     logger.info(f"Generating itinerary for destination: {request.destination}")
     
-    try:
-        # Validate dates
-        if request.end_date <= request.start_date:
-            raise HTTPException(
-                status_code=400,
-                detail="End date must be after start date"
-            )
-            
-        # Initialize planner with retry mechanism
-        max_retries = 3
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                itinerary = planner.generate_itinerary(
-                    destination=request.destination,
-                    start_date=request.start_date,
-                    end_date=request.end_date,
-                    budget=request.budget,
-                    preferences=request.preferences.dict(),
-                    group_size=request.group_size
-                )
-                
-                # Cache successful result
-                if cache_service:
-                    cache_service.cache_itinerary(request.dict(), itinerary)
-                
-                return {
-                    "status": "success",
-                    "data": itinerary,
-                    "metadata": {
-                        "generated_at": datetime.now().isoformat(),
-                        "cache_hit": False
-                    }
-                }
-                
-            except Exception as e:
-                retry_count += 1
-                logger.warning(f"Attempt {retry_count} failed: {str(e)}")
-                if retry_count == max_retries:
-                    raise
-                await asyncio.sleep(1)  # Wait before retry
-                
-    except Exception as e:
-        logger.error(f"Failed to generate itinerary: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to generate itinerary: {str(e)}"
-        )
     try:
         # Validate dates
         if request.end_date <= request.start_date:
@@ -131,8 +197,7 @@ async def generate_itinerary(
                 detail="Budget must be greater than 0"
             )
         
-        # Generate itinerary
-        itinerary = planner.generate_itinerary(
+        cache_params = ItineraryPlanner.build_cache_params(
             destination=request.destination,
             start_date=request.start_date,
             end_date=request.end_date,
@@ -141,14 +206,151 @@ async def generate_itinerary(
             group_size=request.group_size
         )
         
-        return itinerary
+        # Serve cache hits without waiting for a generation slot
+        cached_itinerary = await cache_service.get_cached_itinerary_async(cache_params)
+        if cached_itinerary:
+            return {
+                "status": "success",
+                "data": cached_itinerary,
+                "metadata": {
+                    "generated_at": datetime.now().isoformat(),
+                    "cache_hit": True
+                }
+            }
         
+        async with generation_limiter.slot():
+            # The first generation creates the planner, off the event loop
+            planner = await run_in_generation_executor(get_planner)
+            
+            # Initialize planner with retry mechanism
+            max_retries = 3
+            retry_count = 0
+            retry_policy = RetryPolicy(max_retries=max_retries)
+            while retry_count < max_retries:
+                try:
+                    itinerary = await run_in_generation_executor(
+                        planner.generate_itinerary,
+                        destination=request.destination,
+                        start_date=request.start_date,
+                        end_date=request.end_date,
+                        budget=request.budget,
+                        preferences=request.preferences.dict(),
+                        group_size=request.group_size,
+                        check_cache=False
+                    )
+                    
+                    # The planner caches the result itself
+                    return {
+                        "status": "success",
+                        "data": itinerary,
+                        "metadata": {
+                            "generated_at": datetime.now().isoformat(),
+                            "cache_hit": False
+                        }
+                    }
+                    
+                except Exception as e:
+                    retry_count += 1
+                    logger.warning(f"Attempt {retry_count} failed: {str(e)}")
+                    if retry_count == max_retries:
+                        raise
+                    # Back off with jitter so failed requests don't retry in lockstep
+                    await asyncio.sleep(retry_policy.delay(retry_count - 1))
+                
+    except ConcurrencyLimitExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error generating itinerary: {str(e)}")
+        logger.error(f"Failed to generate itinerary: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
-            detail=str(e)
+            detail=f"Failed to generate itinerary: {str(e)}"
+        )
+
+@router.post("/generate/stream")
+async def generate_itinerary_stream(
+    request: StreamItineraryRequest,
+    api_key: str = Depends(verify_api_key),
+    cache_service: CacheService = Depends(get_cache_service),
+    itinerary_generator = Depends(get_itinerary_generator)
+):
+    """
+    Stream an itinerary as server-sent events.
+    
+    Emits a "day" event for each day as soon as it has been generated and
+    enriched, a "hotels" event after the first day, and a final "itinerary"
+    event with the complete itinerary ("error" if generation fails midway).
+    """
+    logger.info(f"Streaming itinerary for destination: {request.destination}")
+    
+    if request.num_days <= 0 or request.num_people <= 0:
+        raise HTTPException(
+            status_code=400,
+            detail="num_days and num_people must be greater than 0"
+        )
+    
+    cache_params = {"mode": "stream", **request.dict()}
+    cached_itinerary = await cache_service.get_cached_itinerary_async(cache_params)
+    if cached_itinerary:
+        async def replay():
+            # Same order as a live stream: hotels follow the first day
+            for index, day in enumerate(cached_itinerary.get("days", [])):
+                yield format_sse("day", day)
+                if index == 0:
+                    yield format_sse("hotels", cached_itinerary.get("hotels", []))
+            yield format_sse("itinerary", cached_itinerary)
+        
+        return StreamingResponse(replay(), media_type="text/event-stream")
+    
+    # Take the generation slot before the response starts, so overload
+    # can still be reported as a 429 instead of an error event. The body
+    # may never be iterated (client gone, error before sending), so the
+    # slot is released by whichever runs first of the generator's finally,
+    # the response's background task or the except below; aclose() is
+    # idempotent
+    slot = AsyncExitStack()
+    try:
+        await slot.enter_async_context(generation_limiter.slot())
+    except ConcurrencyLimitExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+    
+    async def events():
+        try:
+            async for event in itinerary_generator.stream_complete_itinerary(
+                destination=request.destination,
+                group_type=request.group_type,
+                num_days=request.num_days,
+                budget=request.budget,
+                num_people=request.num_people
+            ):
+                if event["type"] == "itinerary":
+                    await run_in_cache_executor(cache_service.cache_itinerary, cache_params, event["itinerary"])
+                yield format_sse(event["type"], event[event["type"]])
+        except Exception as e:
+            logger.error(f"Failed to stream itinerary: {str(e)}", exc_info=True)
+            yield format_sse("error", {"detail": f"Failed to generate itinerary: {str(e)}"})
+        finally:
+            await slot.aclose()
+    
+    try:
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(slot.aclose)
         )
+    except BaseException:
+        await slot.aclose()
+        raise
 
 @router.post("/update-location")
 async def update_location(
@@ -218,40 +420,82 @@ async def invite_collaborator(
         )
 
 @router.get("/info")
-async def get_model_info(api_key: str = Depends(verify_api_key)):
+async def get_model_info(
+    request: Request,
+    api_key: str = Depends(verify_api_key),
+    planner: ItineraryPlanner = Depends(get_planner),
+    cache_service: CacheService = Depends(get_cache_service),
+    single_flight: SingleFlight = Depends(get_single_flight)
+):
     """Get information about the current planner."""
+    model_interface = getattr(request.app.state, "model_interface", None)
     return {
         "status": "active",
         "version": "1.0.0",
         "backend": "PyTorch with Google Maps Integration",
         "device": str(planner.device),
-        "cache_stats": cache_service.get_cache_stats()
+        "cache_stats": await run_in_cache_executor(cache_service.get_cache_stats),
+        "generation_limiter": generation_limiter.get_stats(),
+        "single_flight": single_flight.get_stats(),
+        "model": model_interface.get_performance_metrics() if model_interface else None
+    }
+
+@router.get("/health")
+async def health(cache_service: CacheService = Depends(get_cache_service)):
+    """Report cache health, connection pool usage and circuit breaker state."""
+    cache_health = await run_in_cache_executor(cache_service.health_check)
+    return {
+        "status": "ok" if cache_health["healthy"] else "degraded",
+        "cache": cache_health,
+        "generation_limiter": generation_limiter.get_stats()
     }
 
+@router.get("/hotels/{place_id}")
+async def get_hotel_details(
+    place_id: str,
+    api_key: str = Depends(verify_api_key)
+):
+    """Load details for one hotel on demand (see find_nearby_hotels include_details=False)."""
+    from API.maps_interface import get_hotel_details as fetch_hotel_details
+    
+    try:
+        return await run_in_threadpool(fetch_hotel_details, place_id)
+    except Exception as e:
+        logger.error(f"Error fetching hotel details: {str(e)}")
+        raise HTTPException(
+            status_code=502,
+            detail=str(e)
+        )
+
 @router.get("/popular-destinations")
 async def get_popular_destinations(
     limit: int = 10,
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    cache_service: CacheService = Depends(get_cache_service)
 ):
     """Get the most popular destinations based on cache hits."""
     return {
-        "popular_destinations": cache_service.get_popular_destinations(limit)
+        "popular_destinations": await run_in_cache_executor(
+            cache_service.get_popular_destinations,
+            limit
+        )
     }
 
 @router.post("/cache/invalidate")
 async def invalidate_cache(
     request: ItineraryRequest,
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    cache_service: CacheService = Depends(get_cache_service)
 ):
     """Invalidate cache for specific parameters."""
-    cache_params = {
-        "destination": request.destination,
-        "start_date": request.start_date.isoformat(),
-        "end_date": request.end_date.isoformat(),
-        "budget": request.budget,
-        "preferences": request.preferences.dict(),
-        "group_size": request.group_size
-    }
+    cache_params = ItineraryPlanner.build_cache_params(
+        destination=request.destination,
+        start_date=request.start_date,
+        end_date=request.end_date,
+        budget=request.budget,
+        preferences=request.preferences.dict(),
+        group_size=request.group_size
+    )
     
-    success = cache_service.invalidate_cache(cache_params)
+    success = await run_in_cache_executor(cache_service.invalidate_cache, cache_params)
     return {"success": success}
\ No newline at end of file
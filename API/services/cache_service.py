@@ -1,17 +1,63 @@
-from redis import Redis
-from typing import Dict, Any, Optional
+from redis import Redis, ConnectionPool
+import redis.asyncio as aioredis
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import json
 import logging
+import time
 from datetime import timedelta
 import hashlib
 
+from .local_cache import LocalCache
+from .codecs import ItineraryCodec, best_available
+from .circuit_breaker import CircuitBreaker
+
 logger = logging.getLogger(__name__)
 
 class CacheService:
-    def __init__(self, redis_url: str = "redis://localhost:6379"):
-        self.redis = Redis.from_url(redis_url, decode_responses=True)
+    def __init__(
+        self,
+        redis_url: str = "redis://localhost:6379",
+        local_cache_max_bytes: Optional[int] = None,
+        local_cache_ttl: timedelta = timedelta(minutes=5),
+        codec: Optional[ItineraryCodec] = None,
+        max_connections: int = 50,
+        socket_timeout: float = 0.25,
+        socket_connect_timeout: float = 0.25,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0
+    ):
+        # One shared, bounded pool with short timeouts. Responses are bytes
+        # because encoded itineraries are binary.
+        pool_options = {
+            "max_connections": max_connections,
+            "socket_timeout": socket_timeout,
+            "socket_connect_timeout": socket_connect_timeout,
+            "health_check_interval": 30
+        }
+        self.redis_url = redis_url
+        self._pool_options = pool_options
+        self.pool = ConnectionPool.from_url(redis_url, **pool_options)
+        self.redis = Redis(connection_pool=self.pool)
+        self._async_redis: Optional[aioredis.Redis] = None
+        
+        # Skip Redis entirely while it is failing
+        self.circuit_breaker = CircuitBreaker(
+            "redis",
+            failure_threshold=failure_threshold,
+            reset_timeout=reset_timeout
+        )
+        
+        self.codec = codec or best_available()
         self.default_ttl = timedelta(hours=24)  # Cache for 24 hours by default
         
+        # Optional in-process tier in front of Redis
+        self.local_cache = (
+            LocalCache(local_cache_max_bytes, local_cache_ttl)
+            if local_cache_max_bytes else None
+        )
+        self.redis_hits = 0
+        self.redis_misses = 0
+        
     def _generate_cache_key(self, params: Dict[str, Any]) -> str:
         """Generate a unique cache key based on request parameters."""
         # Sort parameters to ensure consistent key generation
@@ -20,83 +66,220 @@ class CacheService:
         param_str = json.dumps(sorted_params, sort_keys=True)
         return f"itinerary:{hashlib.sha256(param_str.encode()).hexdigest()}"
         
+    def _call(self, description: str, operation: Callable[[], Any], default: Any = None) -> Any:
+        """Run a Redis operation through the circuit breaker; return default on failure."""
+        if not self.circuit_breaker.allow_request():
+            return default
+        try:
+            result = operation()
+        except Exception as e:
+            self.circuit_breaker.record_failure()
+            logger.error(f"Error {description}: {str(e)}")
+            return default
+        else:
+            self.circuit_breaker.record_success()
+            return result
+        finally:
+            self.circuit_breaker.release_trial()
+        
+    def _get_async_redis(self) -> aioredis.Redis:
+        """Async client on its own pool, created on first use inside the event loop."""
+        if self._async_redis is None:
+            self._async_redis = aioredis.Redis.from_url(self.redis_url, **self._pool_options)
+        return self._async_redis
+        
+    def _get_local(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        if self.local_cache:
+            itinerary = self.local_cache.get(cache_key)
+            if itinerary is not None:
+                logger.info(f"Local cache hit for key: {cache_key}")
+                return itinerary
+        return None
+        
+    def _decode_cached(self, cache_key: str, cached_data: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        if cached_data:
+            self.redis_hits += 1
+            logger.info(f"Cache hit for key: {cache_key}")
+            itinerary, size = self.codec.decode_with_size(cached_data)
+            if self.local_cache:
+                self.local_cache.set(cache_key, itinerary, size)
+            return itinerary
+        
+        self.redis_misses += 1
+        logger.info(f"Cache miss for key: {cache_key}")
+        return None
+        
     def get_cached_itinerary(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Retrieve cached itinerary if available."""
         try:
             cache_key = self._generate_cache_key(params)
-            cached_data = self.redis.get(cache_key)
+            itinerary = self._get_local(cache_key)
+            if itinerary is not None:
+                return itinerary
             
-            if cached_data:
-                logger.info(f"Cache hit for key: {cache_key}")
-                return json.loads(cached_data)
-            
-            logger.info(f"Cache miss for key: {cache_key}")
-            return None
+            cached_data = self._call("retrieving from cache", lambda: self.redis.get(cache_key))
+            return self._decode_cached(cache_key, cached_data)
             
         except Exception as e:
             logger.error(f"Error retrieving from cache: {str(e)}")
             return None
             
-    def cache_itinerary(self, params: Dict[str, Any], itinerary: Dict[str, Any], ttl: Optional[timedelta] = None) -> bool:
-        """Cache an itinerary with the given parameters."""
+    async def get_cached_itinerary_async(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Retrieve cached itinerary if available, without blocking the event loop."""
         try:
             cache_key = self._generate_cache_key(params)
-            ttl = ttl or self.default_ttl
+            itinerary = self._get_local(cache_key)
+            if itinerary is not None:
+                return itinerary
             
-            # Cache the itinerary
-            self.redis.setex(
-                cache_key,
-                ttl,
-                json.dumps(itinerary)
-            )
+            if not self.circuit_breaker.allow_request():
+                return None
+            try:
+                cached_data = await self._get_async_redis().get(cache_key)
+            except Exception as e:
+                self.circuit_breaker.record_failure()
+                logger.error(f"Error retrieving from cache: {str(e)}")
+                return None
+            else:
+                self.circuit_breaker.record_success()
+            finally:
+                # A cancelled request must not hold the half-open trial forever
+                self.circuit_breaker.release_trial()
+            return self._decode_cached(cache_key, cached_data)
             
-            # Update popularity score for destination
-            destination = params.get("destination", "")
-            if destination:
-                self.increment_destination_popularity(destination)
+        except Exception as e:
+            logger.error(f"Error retrieving from cache: {str(e)}")
+            return None
             
-            logger.info(f"Successfully cached itinerary with key: {cache_key}")
-            return True
+    def cache_itinerary(self, params: Dict[str, Any], itinerary: Dict[str, Any], ttl: Optional[timedelta] = None) -> bool:
+        """Cache an itinerary with the given parameters."""
+        return self.cache_itineraries([(params, itinerary)], ttl) == 1
             
+    def cache_itineraries(
+        self,
+        entries: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+        ttl: Optional[timedelta] = None
+    ) -> int:
+        """
+        Cache many itineraries in a single Redis round-trip, e.g. to warm the cache.
+        Each itinerary write and its destination popularity update share one pipeline.
+        Returns the number of itineraries cached.
+        """
+        ttl = ttl or self.default_ttl
+        
+        # Encode up front so a bad itinerary isn't counted as a Redis failure
+        try:
+            encoded = []
+            for params, itinerary in entries:
+                serialized, size = self.codec.encode_with_size(itinerary)
+                encoded.append((self._generate_cache_key(params), params, itinerary, serialized, size))
         except Exception as e:
+            logger.error(f"Error encoding itinerary: {str(e)}")
+            return 0
+        
+        if not self.circuit_breaker.allow_request():
+            return 0
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for cache_key, params, _, serialized, _ in encoded:
+                pipe.setex(cache_key, ttl, serialized)
+                
+                # Update popularity score for destination
+                destination = params.get("destination", "")
+                if destination:
+                    pipe.zincrby("popular_destinations", 1, destination)
+            
+            pipe.execute()
+        except Exception as e:
+            self.circuit_breaker.record_failure()
             logger.error(f"Error caching itinerary: {str(e)}")
-            return False
+            return 0
+        else:
+            self.circuit_breaker.record_success()
+        finally:
+            self.circuit_breaker.release_trial()
+        
+        if self.local_cache:
+            for cache_key, _, itinerary, _, size in encoded:
+                self.local_cache.set(cache_key, itinerary, size, ttl)
+        
+        logger.info(f"Successfully cached {len(encoded)} itineraries")
+        return len(encoded)
             
     def increment_destination_popularity(self, destination: str) -> None:
         """Increment the popularity score for a destination."""
-        try:
-            self.redis.zincrby("popular_destinations", 1, destination)
-        except Exception as e:
-            logger.error(f"Error updating destination popularity: {str(e)}")
+        self._call(
+            "updating destination popularity",
+            lambda: self.redis.zincrby("popular_destinations", 1, destination)
+        )
             
     def get_popular_destinations(self, limit: int = 10) -> list:
         """Get the most popular destinations."""
-        try:
-            return self.redis.zrevrange("popular_destinations", 0, limit-1, withscores=True)
-        except Exception as e:
-            logger.error(f"Error retrieving popular destinations: {str(e)}")
-            return []
+        destinations = self._call(
+            "retrieving popular destinations",
+            lambda: self.redis.zrevrange("popular_destinations", 0, limit-1, withscores=True),
+            default=[]
+        )
+        return [(name.decode(), score) for name, score in destinations]
             
     def invalidate_cache(self, params: Dict[str, Any]) -> bool:
         """Invalidate a specific cached itinerary."""
-        try:
-            cache_key = self._generate_cache_key(params)
-            return bool(self.redis.delete(cache_key))
-        except Exception as e:
-            logger.error(f"Error invalidating cache: {str(e)}")
-            return False
+        cache_key = self._generate_cache_key(params)
+        if self.local_cache:
+            self.local_cache.delete(cache_key)
+        return bool(self._call("invalidating cache", lambda: self.redis.delete(cache_key), default=False))
             
+    def get_tier_stats(self) -> Dict[str, Any]:
+        """Get hit/miss/eviction counters for each cache tier."""
+        return {
+            "local": self.local_cache.get_stats() if self.local_cache else None,
+            "redis": {
+                "hits": self.redis_hits,
+                "misses": self.redis_misses
+            }
+        }
+        
     def get_cache_stats(self) -> Dict[str, Any]:
         """Get cache statistics."""
-        try:
-            info = self.redis.info()
-            return {
-                "total_keys": info.get("db0", {}).get("keys", 0),
-                "used_memory": info.get("used_memory_human", "0"),
-                "hits": info.get("keyspace_hits", 0),
-                "misses": info.get("keyspace_misses", 0),
-                "popular_destinations": self.get_popular_destinations(5)
-            }
-        except Exception as e:
-            logger.error(f"Error getting cache stats: {str(e)}")
-            return {}
\ No newline at end of file
+        info = self._call("getting cache stats", self.redis.info)
+        if info is None:
+            return {"tiers": self.get_tier_stats()}
+        return {
+            "total_keys": info.get("db0", {}).get("keys", 0),
+            "used_memory": info.get("used_memory_human", "0"),
+            "hits": info.get("keyspace_hits", 0),
+            "misses": info.get("keyspace_misses", 0),
+            "popular_destinations": self.get_popular_destinations(5),
+            "tiers": self.get_tier_stats()
+        }
+        
+    @staticmethod
+    def _describe_pool(pool) -> Dict[str, Any]:
+        in_use = len(getattr(pool, "_in_use_connections", ()))
+        available = len(getattr(pool, "_available_connections", ()))
+        return {
+            "max_connections": pool.max_connections,
+            "created_connections": getattr(pool, "_created_connections", in_use + available),
+            "in_use_connections": in_use,
+            "available_connections": available
+        }
+        
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Get connection pool usage of the sync client and, once created, the async one."""
+        stats = self._describe_pool(self.pool)
+        stats["async"] = (
+            self._describe_pool(self._async_redis.connection_pool)
+            if self._async_redis is not None else None
+        )
+        return stats
+        
+    def health_check(self) -> Dict[str, Any]:
+        """Ping Redis (unless the breaker is open) and report pool and breaker state."""
+        start_time = time.time()
+        healthy = self._call("pinging Redis", self.redis.ping, default=False)
+        return {
+            "healthy": bool(healthy),
+            "latency_ms": round((time.time() - start_time) * 1000, 2),
+            "circuit_breaker": self.circuit_breaker.get_stats(),
+            "pool": self.get_pool_stats()
+        }
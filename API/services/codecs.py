@@ -0,0 +1,145 @@
+import json
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+# Optional faster serializers and compressors
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Encoded payloads start with MAGIC, the format version, then one byte each
+# for the serializer and compressor. Legacy entries are plain JSON text.
+MAGIC = b"TBC"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+
+SERIALIZERS = {"json": 0, "orjson": 1, "msgpack": 2}
+COMPRESSORS = {"none": 0, "zlib": 1, "zstd": 2, "lz4": 3}
+
+def _serializer_available(name: str) -> bool:
+    return {"json": True, "orjson": orjson is not None, "msgpack": msgpack is not None}[name]
+
+def _compressor_available(name: str) -> bool:
+    return {
+        "none": True,
+        "zlib": True,
+        "zstd": zstandard is not None,
+        "lz4": lz4_frame is not None
+    }[name]
+
+def best_available(serializer: Optional[str] = None, compression: Optional[str] = None) -> "ItineraryCodec":
+    """Build a codec from the fastest installed libraries, unless told otherwise."""
+    if serializer is None:
+        serializer = "orjson" if orjson is not None else "json"
+    if compression is None:
+        compression = "zstd" if zstandard is not None else "zlib"
+    return ItineraryCodec(serializer, compression)
+
+class ItineraryCodec:
+    """
+    Encodes cached itineraries to compact bytes behind a versioned header.
+
+    decode() reads the serializer and compressor from each payload's own
+    header, so entries written with any codec (or as legacy JSON text)
+    stay readable after the configured codec changes.
+    """
+
+    def __init__(self, serializer: str = "json", compression: str = "zlib", level: Optional[int] = None):
+        if serializer not in SERIALIZERS:
+            raise ValueError(f"Unknown serializer: {serializer}")
+        if compression not in COMPRESSORS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if not _serializer_available(serializer):
+            raise ImportError(f"Serializer '{serializer}' is not installed")
+        if not _compressor_available(compression):
+            raise ImportError(f"Compression '{compression}' is not installed")
+
+        self.serializer = serializer
+        self.compression = compression
+        self.level = level
+        self._header = MAGIC + bytes([FORMAT_VERSION, SERIALIZERS[serializer], COMPRESSORS[compression]])
+
+    @property
+    def name(self) -> str:
+        return f"{self.serializer}+{self.compression}"
+
+    def encode(self, obj: Any) -> bytes:
+        """Serialize and compress an object."""
+        return self.encode_with_size(obj)[0]
+
+    def encode_with_size(self, obj: Any) -> Tuple[bytes, int]:
+        """Encode an object; also return its uncompressed serialized size."""
+        raw = _serialize(self.serializer, obj)
+        return self._header + _compress(self.compression, raw, self.level), len(raw)
+
+    def decode(self, data: Any) -> Any:
+        """Decode a payload written by any codec, or a legacy JSON entry."""
+        return self.decode_with_size(data)[0]
+
+    def decode_with_size(self, data: Any) -> Tuple[Any, int]:
+        """Decode a payload; also return its uncompressed serialized size."""
+        if isinstance(data, str) or not data.startswith(MAGIC):
+            return json.loads(data), len(data)
+
+        version, serializer_id, compressor_id = data[len(MAGIC):HEADER_SIZE]
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported cache format version: {version}")
+
+        serializer = _name_for(SERIALIZERS, serializer_id)
+        compression = _name_for(COMPRESSORS, compressor_id)
+        raw = _decompress(compression, data[HEADER_SIZE:])
+        return _deserialize(serializer, raw), len(raw)
+
+def _name_for(ids: Dict[str, int], value: int) -> str:
+    for name, known in ids.items():
+        if known == value:
+            return name
+    raise ValueError(f"Unknown codec id: {value}")
+
+def _serialize(serializer: str, obj: Any) -> bytes:
+    if serializer == "orjson":
+        return orjson.dumps(obj)
+    if serializer == "msgpack":
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+def _deserialize(serializer: str, data: bytes) -> Any:
+    if serializer == "orjson":
+        return orjson.loads(data)
+    if serializer == "msgpack":
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+def _compress(compression: str, data: bytes, level: Optional[int]) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    if compression == "lz4":
+        return lz4_frame.compress(data, compression_level=0 if level is None else level)
+    return data
+
+def _decompress(compression: str, data: bytes) -> bytes:
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == "lz4":
+        return lz4_frame.decompress(data)
+    return data
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class ConcurrencyLimitExceeded(Exception):
+    """Raised when a request could not get a slot within the queue timeout."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ConcurrencyLimiter:
+    """
+    Per-process limit on concurrent expensive operations.
+
+    Callers wait for a free slot for at most queue_timeout seconds, and at
+    most max_queue callers may wait at once; everyone else is rejected
+    straight away so the service sheds load instead of piling it up.
+    """
+
+    def __init__(self, max_concurrency: int, queue_timeout: float = 5.0, max_queue: Optional[int] = None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.completed = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one concurrency slot for the duration of the block."""
+        if self.max_queue is not None and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise ConcurrencyLimitExceeded("Too many queued requests", self.queue_timeout)
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"Request timed out after {self.queue_timeout}s waiting for a slot")
+            raise ConcurrencyLimitExceeded("Timed out waiting for a free slot", self.queue_timeout)
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get limiter statistics."""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "completed": self.completed
+        }
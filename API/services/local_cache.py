@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+
+class LocalCache:
+    """
+    In-process LRU cache bounded by total size in bytes, with a per-entry TTL.
+
+    Values are stored already decoded, so a hit costs neither a network
+    round-trip nor a JSON parse. Cached values are shared between callers
+    and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int, ttl: timedelta = timedelta(minutes=5)):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[timedelta] = None) -> bool:
+        """
+        Store a value, evicting least recently used entries to make room.
+
+        Args:
+            key (str): Cache key
+            value (Any): Decoded value to store
+            size (int): Approximate size of the value in bytes, e.g. its encoded length
+            ttl (Optional[timedelta]): Time to live, capped at the cache's own TTL
+
+        Returns:
+            bool: False if the value is larger than the whole cache
+        """
+        if size > self.max_bytes:
+            return False
+
+        ttl_seconds = self.ttl.total_seconds()
+        if ttl is not None:
+            ttl_seconds = min(ttl_seconds, ttl.total_seconds())
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+            self._entries[key] = (value, size, time.monotonic() + ttl_seconds)
+            self.current_bytes += size
+            return True
+
+    def delete(self, key: str) -> bool:
+        """Remove a key; returns True if it was present."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -0,0 +1,137 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+# Seconds between purges of expired coordinates while the store is in use
+PURGE_INTERVAL = 3600.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    place_id TEXT PRIMARY KEY,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS places_fetched_at ON places (fetched_at);
+
+CREATE TABLE IF NOT EXISTS place_names (
+    name_key TEXT PRIMARY KEY,
+    place_id TEXT NOT NULL
+);
+"""
+
+def normalize_place_name(name: str) -> str:
+    """Normalize a place name so 'Hawa Mahal', ' hawa  mahal ' and 'Hawa-Mahal' match."""
+    name = unicodedata.normalize("NFKC", name).casefold()
+    name = re.sub(r"[^\w\s]", " ", name)
+    return " ".join(name.split())
+
+class PlaceStore:
+    """
+    Persistent SQLite store of Google place IDs and their coordinates.
+
+    Google's terms allow caching place IDs indefinitely and coordinates for
+    up to 30 days, but not names, addresses, ratings, contact details or
+    photo references, so only IDs and coordinates are kept and everything
+    else is fetched live. Names the app searched for map to the place ID
+    they resolved to. Expired coordinates are deleted on open and then at
+    most every PURGE_INTERVAL seconds as places are stored.
+    """
+
+    def __init__(self, path: str, coordinates_ttl: timedelta = timedelta(days=30)):
+        self.path = path
+        self.coordinates_ttl = coordinates_ttl.total_seconds()
+        self._local = threading.local()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+        self._next_purge = 0.0
+        self._purge_if_due()
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets readers run alongside a writer."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _fresh_after(self) -> float:
+        return time.time() - self.coordinates_ttl
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    @staticmethod
+    def _location(row: sqlite3.Row) -> Dict[str, Any]:
+        return {"place_id": row["place_id"], "coordinates": {"lat": row["lat"], "lng": row["lng"]}}
+
+    def get_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Get the place ID and coordinates a (normalized) name resolved to."""
+        row = self._connection().execute(
+            "SELECT p.place_id, p.lat, p.lng FROM place_names n JOIN places p ON p.place_id = n.place_id "
+            "WHERE n.name_key = ? AND p.fetched_at > ?",
+            (normalize_place_name(name), self._fresh_after())
+        ).fetchone()
+        self._count(row is not None)
+        return self._location(row) if row else None
+
+    def put_place(self, place: Dict[str, Any], query_name: Optional[str] = None):
+        """
+        Store a place's ID and coordinates; other fields are ignored.
+
+        Args:
+            place (Dict): Place as returned by maps_interface, with 'place_id' and 'coordinates'
+            query_name (Optional[str]): Name the place was searched by
+        """
+        self.put_places([place], query_name)
+
+    def put_places(self, places: List[Dict[str, Any]], query_name: Optional[str] = None):
+        """Store several places' IDs and coordinates in one transaction."""
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            for place in places:
+                connection.execute(
+                    "INSERT OR REPLACE INTO places (place_id, lat, lng, fetched_at) VALUES (?, ?, ?, ?)",
+                    (place["place_id"], place["coordinates"]["lat"], place["coordinates"]["lng"], now)
+                )
+                if query_name is not None:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO place_names (name_key, place_id) VALUES (?, ?)",
+                        (normalize_place_name(query_name), place["place_id"])
+                    )
+        self._purge_if_due()
+
+    def purge_expired(self) -> int:
+        """Delete expired coordinates; returns the number of places removed. Name mappings (place IDs) are kept."""
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+        connection = self._connection()
+        with connection:
+            return connection.execute("DELETE FROM places WHERE fetched_at <= ?", (self._fresh_after(),)).rowcount
+
+    def _purge_if_due(self):
+        if time.monotonic() >= self._next_purge:
+            self.purge_expired()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store statistics."""
+        count = self._connection().execute("SELECT COUNT(*) FROM places").fetchone()[0]
+        return {"places": count, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,267 @@
+import copy
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis import Redis
+
+from .circuit_breaker import CircuitBreaker
+from .codecs import ItineraryCodec, best_available
+from .local_cache import LocalCache
+from .place_store import normalize_place_name
+
+logger = logging.getLogger(__name__)
+
+# Alternate and historical names, keyed by normalized name
+DESTINATION_ALIASES = {
+    "bombay": "mumbai",
+    "bengaluru": "bangalore",
+    "calcutta": "kolkata",
+    "madras": "chennai",
+    "pink city": "jaipur",
+    "benares": "varanasi",
+    "banaras": "varanasi",
+    "kashi": "varanasi",
+    "cochin": "kochi",
+    "mysuru": "mysore",
+    "trivandrum": "thiruvananthapuram",
+    "pondicherry": "puducherry",
+    "pondy": "puducherry",
+    "gurgaon": "gurugram",
+    "new delhi": "delhi",
+    "ooty": "udhagamandalam",
+}
+
+BUDGET_TIERS = {
+    "budget": "budget", "cheap": "budget", "low": "budget", "economy": "budget", "backpacker": "budget",
+    "moderate": "moderate", "medium": "moderate", "mid": "moderate", "mid range": "moderate", "standard": "moderate",
+    "luxury": "luxury", "premium": "luxury", "high": "luxury", "high end": "luxury",
+}
+
+GROUP_CLASSES = {
+    "solo": "solo", "single": "solo", "alone": "solo",
+    "couple": "couple", "honeymoon": "couple",
+    "family": "family", "kids": "family",
+    "friends": "friends", "group": "friends",
+}
+
+def normalize_destination(destination: Optional[str]) -> Optional[str]:
+    """Canonical destination name, e.g. 'Bombay, India' -> 'mumbai'; None if there is none."""
+    if not destination:
+        return None
+    name = normalize_place_name(destination)
+    for suffix in (" india", " city"):
+        if name.endswith(suffix) and name not in DESTINATION_ALIASES:
+            name = name[:-len(suffix)]
+    return DESTINATION_ALIASES.get(name, name) or None
+
+def canonical_bucket(preferences: Any) -> Optional[str]:
+    """
+    The bucket requests can share results within: destination, budget tier
+    and group class. Day count and group size are compared by similarity.
+
+    None for requests without a destination: the model picks one, so they
+    must not all get whichever destination was stored first.
+    """
+    destination = normalize_destination(preferences.destination)
+    if destination is None:
+        return None
+    budget = normalize_place_name(str(preferences.budget))
+    group = normalize_place_name(str(preferences.group_type))
+    return ":".join([
+        destination,
+        BUDGET_TIERS.get(budget, budget),
+        GROUP_CLASSES.get(group, group)
+    ])
+
+def similarity(requested: Tuple[int, int], stored: Tuple[int, int]) -> float:
+    """
+    Similarity of a stored (num_days, num_people) to the requested one.
+
+    Group sizes must match exactly, since costs and hotel rooms depend on
+    them. A stored itinerary can only serve a trip of at most as many days,
+    since adapting it means dropping the surplus days; the score is the
+    share of its days that are kept.
+    """
+    requested_days, requested_people = requested
+    stored_days, stored_people = stored
+    if stored_people != requested_people or stored_days < requested_days or requested_days <= 0:
+        return 0.0
+    return requested_days / stored_days
+
+def adapt_itinerary(itinerary: Dict[str, Any], num_days: int) -> Dict[str, Any]:
+    """Cut a stored itinerary down to num_days, renumbering the days."""
+    adapted = copy.deepcopy(itinerary)
+    adapted["days"] = adapted.get("days", [])[:num_days]
+    for number, day in enumerate(adapted["days"], start=1):
+        if isinstance(day, dict) and "day" in day:
+            day["day"] = number
+    return adapted
+
+class SemanticPromptCache:
+    """
+    Near-duplicate cache for LLM-generated itineraries.
+
+    Requests are normalized into a canonical bucket (destination alias,
+    budget tier, group class). Within a bucket, the stored itinerary for
+    the same group size whose day count is closest is reused if its
+    similarity is at least min_similarity, trimmed to the requested number
+    of days. Requests without a destination are never cached.
+
+    Entries live in one Redis hash per bucket, with a field per
+    (days, people), so a lookup reads only the field names and then the one
+    best entry. Without Redis, or while its breaker is open, a process-local
+    LRU of local_max_bytes is used instead.
+    """
+
+    def __init__(
+        self,
+        redis: Optional[Redis] = None,
+        ttl: timedelta = timedelta(days=7),
+        min_similarity: float = 0.7,
+        local_max_bytes: int = 16 * 1024 * 1024,
+        codec: Optional[ItineraryCodec] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        key_prefix: str = "prompt_cache"
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.codec = codec or best_available()
+        self.circuit_breaker = circuit_breaker
+        self.key_prefix = key_prefix
+
+        # bucket -> {field: (itinerary, encoded size)}; values are replaced, never mutated
+        self._local = LocalCache(max_bytes=local_max_bytes, ttl=ttl)
+
+        # Statistics
+        self.exact_hits = 0
+        self.adapted_hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def _key(self, bucket: str) -> str:
+        return f"{self.key_prefix}:{bucket}"
+
+    @staticmethod
+    def _field(num_days: int, num_people: int) -> str:
+        return f"{num_days}:{num_people}"
+
+    def _use_redis(self) -> bool:
+        if self.redis is None:
+            return False
+        return self.circuit_breaker is None or self.circuit_breaker.allow_request()
+
+    def _record(self, success: bool):
+        if self.circuit_breaker:
+            if success:
+                self.circuit_breaker.record_success()
+            else:
+                self.circuit_breaker.record_failure()
+
+    def _fields(self, bucket: str, use_redis: bool) -> List[str]:
+        if not use_redis:
+            return list(self._local.get(bucket) or {})
+        try:
+            fields = self.redis.hkeys(self._key(bucket))
+            self._record(True)
+            return [field.decode() if isinstance(field, bytes) else field for field in fields]
+        except Exception as e:
+            self._record(False)
+            logger.warning(f"Prompt cache lookup failed: {str(e)}")
+            return []
+
+    def _load(self, bucket: str, field: str, use_redis: bool) -> Optional[Dict[str, Any]]:
+        if not use_redis:
+            entry = (self._local.get(bucket) or {}).get(field)
+            return entry[0] if entry else None
+        try:
+            data = self.redis.hget(self._key(bucket), field)
+            self._record(True)
+            return self.codec.decode(data) if data else None
+        except Exception as e:
+            self._record(False)
+            logger.warning(f"Prompt cache read failed: {str(e)}")
+            return None
+
+    def get(self, preferences: Any) -> Optional[Dict[str, Any]]:
+        """
+        Get a stored itinerary for preferences, adapted to them.
+
+        Args:
+            preferences: TravelPreferences (or anything with the same attributes)
+
+        Returns:
+            Optional[Dict]: The itinerary, or None if nothing is similar enough
+        """
+        bucket = canonical_bucket(preferences)
+        if bucket is None:
+            self.skipped += 1
+            return None
+        requested = (preferences.num_days, preferences.num_people)
+        use_redis = self._use_redis()
+
+        best_field, best_score = None, 0.0
+        for field in self._fields(bucket, use_redis):
+            try:
+                stored = tuple(int(part) for part in field.split(":"))
+            except ValueError:
+                continue
+            score = similarity(requested, stored)
+            if score > best_score:
+                best_field, best_score = field, score
+
+        if best_field is None or best_score < self.min_similarity:
+            self.misses += 1
+            return None
+
+        itinerary = self._load(bucket, best_field, use_redis)
+        if itinerary is None:
+            self.misses += 1
+            return None
+
+        if best_score == 1.0:
+            self.exact_hits += 1
+        else:
+            self.adapted_hits += 1
+            logger.info(f"Prompt cache hit for {bucket} {requested} from {best_field} (similarity {best_score:.2f})")
+        return adapt_itinerary(itinerary, preferences.num_days)
+
+    def set(self, preferences: Any, itinerary: Dict[str, Any]):
+        """Store a generated itinerary under its canonical bucket, if it has one."""
+        bucket = canonical_bucket(preferences)
+        if bucket is None:
+            return
+        field = self._field(preferences.num_days, preferences.num_people)
+
+        serialized, size = self.codec.encode_with_size(itinerary)
+
+        if not self._use_redis():
+            entries = dict(self._local.get(bucket) or {})
+            entries[field] = (copy.deepcopy(itinerary), size)
+            self._local.set(bucket, entries, sum(entry_size for _, entry_size in entries.values()))
+            return
+
+        try:
+            # Refreshing the TTL on every write keeps busy buckets alive
+            key = self._key(bucket)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(key, field, serialized)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+            self._record(True)
+        except Exception as e:
+            self._record(False)
+            logger.warning(f"Prompt cache write failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get prompt cache statistics."""
+        lookups = self.exact_hits + self.adapted_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "adapted_hits": self.adapted_hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": (self.exact_hits + self.adapted_hits) / lookups if lookups else 0.0,
+            "min_similarity": self.min_similarity
+        }
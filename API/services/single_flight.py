@@ -0,0 +1,232 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from redis import Redis
+
+from .circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only if we still own it
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+class LeaderFailed(Exception):
+    """Raised to a caller in another worker whose single-flight leader failed."""
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls that share a key so only one of them runs.
+
+    Inside a process, callers with the same key wait on the first caller's
+    future. Across workers, a Redis lock elects one leader; the others
+    subscribe to a channel and receive the leader's result when it is
+    published. Waiters share the leader's outcome, failures included, so a
+    failing call is not retried by every waiter at once. A waiter that gets
+    no answer within wait_timeout tries once to take over the lock (the
+    leader may have died) and otherwise raises TimeoutError. Only when
+    Redis itself is unavailable do callers run the call on their own.
+    """
+
+    def __init__(
+        self,
+        redis: Optional[Redis] = None,
+        lock_ttl: timedelta = timedelta(minutes=2),
+        wait_timeout: float = 120.0,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ):
+        self.redis = redis
+        self.circuit_breaker = circuit_breaker
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+
+        # Statistics
+        self.leaders = 0
+        self.local_waiters = 0
+        self.remote_waiters = 0
+        self.fallbacks = 0
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        lookup: Optional[Callable[[], Optional[Any]]] = None
+    ) -> Any:
+        """
+        Run fn once per key across all concurrent callers and return its result.
+
+        Args:
+            key (str): Deduplication key, e.g. the itinerary cache key
+            fn (Callable): The expensive call; its result must be JSON serializable
+            lookup (Optional[Callable]): Cheap check for a finished result
+                (e.g. a cache read), used when the leader may already be done
+
+        Returns:
+            Any: The result of fn, possibly computed by another caller
+
+        Raises:
+            Exception: Whatever fn raised, shared with the local waiters
+            LeaderFailed: If the leader in another worker failed
+            TimeoutError: If no leader answered within wait_timeout
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.local_waiters += 1
+
+        if not is_leader:
+            logger.info(f"Waiting for in-flight generation: {key}")
+            return future.result(timeout=self.wait_timeout)
+
+        try:
+            result = self._run_distributed(key, fn, lookup)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _run_distributed(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        lookup: Optional[Callable[[], Optional[Any]]]
+    ) -> Any:
+        """Elect one leader across workers through a Redis lock."""
+        # Without a healthy Redis, deduplicate within this process only
+        if self.redis is None or (self.circuit_breaker and self.circuit_breaker.state != CircuitBreaker.CLOSED):
+            self._count("leaders")
+            return fn()
+
+        lock_key = f"singleflight:lock:{key}"
+        channel = f"singleflight:done:{key}"
+
+        # A second election only happens after a wait without any answer
+        for attempt in range(2):
+            token = uuid.uuid4().hex
+            try:
+                acquired = self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl.total_seconds() * 1000))
+            except Exception as e:
+                logger.error(f"Error acquiring single-flight lock: {str(e)}")
+                self._count("leaders")
+                return fn()
+
+            if acquired:
+                self._count("leaders")
+                return self._lead(lock_key, channel, token, fn)
+
+            if attempt == 0:
+                self._count("remote_waiters")
+            status, result = self._wait_for_leader(channel, lookup)
+            if status == "ok":
+                return result
+            if status == "error":
+                raise LeaderFailed(f"Single-flight leader failed: {result}")
+            if status == "unavailable":
+                logger.warning(f"Lost Redis while waiting for single-flight leader, generating locally: {key}")
+                self._count("fallbacks")
+                return fn()
+            logger.warning(f"No result from single-flight leader after {self.wait_timeout}s: {key}")
+
+        raise TimeoutError(f"No result from single-flight leader for {key}")
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _lead(self, lock_key: str, channel: str, token: str, fn: Callable[[], Any]) -> Any:
+        """Run fn as the leader and publish its result to the waiters."""
+        message = json.dumps({"status": "error", "error": "interrupted"})
+        try:
+            result = fn()
+            message = json.dumps({"status": "ok", "result": result}, default=str)
+            return result
+        except Exception as e:
+            message = json.dumps({"status": "error", "error": f"{type(e).__name__}: {str(e)}"})
+            raise
+        finally:
+            try:
+                self.redis.publish(channel, message)
+            except Exception as e:
+                logger.error(f"Error publishing single-flight result: {str(e)}")
+            try:
+                self.redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                logger.error(f"Error releasing single-flight lock: {str(e)}")
+
+    def _wait_for_leader(
+        self,
+        channel: str,
+        lookup: Optional[Callable[[], Optional[Any]]]
+    ) -> Tuple[str, Any]:
+        """
+        Wait for the leader's published outcome.
+
+        Returns:
+            Tuple[str, Any]: ("ok", result), ("error", the leader's error),
+            ("timeout", None) or ("unavailable", None) if Redis failed
+        """
+        try:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+        except Exception as e:
+            logger.error(f"Error subscribing to single-flight channel: {str(e)}")
+            return "unavailable", None
+
+        try:
+            # The leader may have finished before we subscribed
+            if lookup:
+                result = lookup()
+                if result is not None:
+                    return "ok", result
+
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=min(1.0, deadline - time.monotonic()))
+                if not message:
+                    continue
+                payload = json.loads(message["data"])
+                if payload["status"] == "ok":
+                    return "ok", payload["result"]
+                return "error", payload.get("error")
+            return "timeout", None
+
+        except Exception as e:
+            logger.error(f"Error waiting for single-flight leader: {str(e)}")
+            return "unavailable", None
+        finally:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get single-flight statistics."""
+        with self._lock:
+            return {
+                "in_flight": len(self._inflight),
+                "leaders": self.leaders,
+                "local_waiters": self.local_waiters,
+                "remote_waiters": self.remote_waiters,
+                "fallbacks": self.fallbacks
+            }
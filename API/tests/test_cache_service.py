@@ -0,0 +1,213 @@
+import unittest
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from ..services.local_cache import LocalCache
+from ..services.codecs import ItineraryCodec
+from ..services.circuit_breaker import CircuitBreaker
+from ..services.cache_service import CacheService
+from ..services.prompt_cache import SemanticPromptCache, canonical_bucket
+from ..benchmarks.cache_codecs import sample_itinerary
+
+class TestLocalCache(unittest.TestCase):
+    def test_lru_eviction_by_size(self):
+        """Test that least recently used entries are evicted to fit new ones"""
+        cache = LocalCache(max_bytes=100)
+        cache.set("a", {"name": "a"}, 40)
+        cache.set("b", {"name": "b"}, 40)
+        cache.get("a")
+        cache.set("c", {"name": "c"}, 40)
+        
+        self.assertEqual(cache.get("a"), {"name": "a"})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertEqual(cache.get_stats()["bytes"], 80)
+        
+    def test_oversized_value_is_rejected(self):
+        """Test that a value larger than the cache is not stored"""
+        cache = LocalCache(max_bytes=10)
+        self.assertFalse(cache.set("a", "value", 11))
+        self.assertIsNone(cache.get("a"))
+        
+    def test_entries_expire(self):
+        """Test that entries expire after their TTL"""
+        cache = LocalCache(max_bytes=100, ttl=timedelta(seconds=60))
+        cache.set("a", 1, 1, ttl=timedelta(milliseconds=10))
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get_stats()["expirations"], 1)
+        
+    def test_delete(self):
+        """Test that deleted entries are gone"""
+        cache = LocalCache(max_bytes=100)
+        cache.set("a", 1, 1)
+        self.assertTrue(cache.delete("a"))
+        self.assertFalse(cache.delete("a"))
+        self.assertIsNone(cache.get("a"))
+        
+class TestItineraryCodec(unittest.TestCase):
+    def test_round_trip(self):
+        """Test that encoded itineraries decode unchanged and smaller"""
+        itinerary = sample_itinerary(num_days=3)
+        codec = ItineraryCodec("json", "zlib")
+        encoded = codec.encode(itinerary)
+        
+        self.assertEqual(codec.decode(encoded), itinerary)
+        self.assertLess(len(encoded), len(json.dumps(itinerary)))
+        
+    def test_reads_legacy_json(self):
+        """Test that entries written as plain JSON text are still readable"""
+        itinerary = sample_itinerary(num_days=1)
+        codec = ItineraryCodec("json", "zlib")
+        
+        self.assertEqual(codec.decode(json.dumps(itinerary)), itinerary)
+        self.assertEqual(codec.decode(json.dumps(itinerary).encode()), itinerary)
+        
+    def test_reads_other_codecs(self):
+        """Test that payloads are decoded by their own header, not the configured codec"""
+        itinerary = sample_itinerary(num_days=1)
+        encoded = ItineraryCodec("json", "none").encode(itinerary)
+        self.assertEqual(ItineraryCodec("json", "zlib").decode(encoded), itinerary)
+        
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold_and_recovers(self):
+        """Test that the breaker skips calls while open and lets one trial through later"""
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+        
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        
+    def test_failed_trial_reopens(self):
+        """Test that a failure while half-open opens the breaker again"""
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+        
+class HangingRedis:
+    async def get(self, key):
+        await asyncio.sleep(3600)
+
+class FailingPipeline:
+    def setex(self, *args):
+        pass
+
+    def zincrby(self, *args):
+        pass
+
+    def execute(self):
+        raise ConnectionError("Redis is down")
+
+class FailingRedis:
+    def pipeline(self, transaction=True):
+        return FailingPipeline()
+
+class TestCacheService(unittest.TestCase):
+    def setUp(self):
+        self.service = CacheService(failure_threshold=1, reset_timeout=0.05)
+
+    def test_cancelled_trial_is_released(self):
+        """Test that cancelling the half-open trial lets the next request try Redis"""
+        self.service.circuit_breaker.record_failure()
+        time.sleep(0.06)
+        self.service._async_redis = HangingRedis()
+
+        async def cancel_lookup():
+            task = asyncio.create_task(self.service.get_cached_itinerary_async({"destination": "Goa"}))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_lookup())
+        self.assertTrue(self.service.circuit_breaker.allow_request())
+
+    def test_only_redis_errors_count_as_failures(self):
+        """Test that an itinerary the codec can't encode doesn't open the breaker"""
+        self.service.redis = FailingRedis()
+        self.assertEqual(self.service.cache_itineraries([({"destination": "Goa"}, {"bad": object()})]), 0)
+        self.assertEqual(self.service.circuit_breaker.get_stats()["total_failures"], 0)
+
+        self.assertEqual(self.service.cache_itineraries([({"destination": "Goa"}, {"days": []})]), 0)
+        self.assertEqual(self.service.circuit_breaker.get_stats()["total_failures"], 1)
+
+    def test_pool_stats_include_async_client(self):
+        """Test that pool stats cover the async client once it exists"""
+        self.assertIsNone(self.service.get_pool_stats()["async"])
+        self.service._get_async_redis()
+        self.assertEqual(self.service.get_pool_stats()["async"]["max_connections"], 50)
+        
+class Preferences:
+    def __init__(self, destination, group_type, num_days, budget, num_people):
+        self.destination = destination
+        self.group_type = group_type
+        self.num_days = num_days
+        self.budget = budget
+        self.num_people = num_people
+
+class TestSemanticPromptCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = SemanticPromptCache(min_similarity=0.7)
+        self.itinerary = sample_itinerary(num_days=5)
+        self.cache.set(Preferences("Jaipur", "family", 5, "moderate", 4), self.itinerary)
+
+    def test_canonical_buckets(self):
+        """Test that aliases and synonyms normalize to the same bucket"""
+        self.assertEqual(
+            canonical_bucket(Preferences("Bombay, India", "Family", 3, "Mid-Range", 4)),
+            canonical_bucket(Preferences("mumbai", "family", 5, "moderate", 2))
+        )
+
+    def test_near_duplicate_is_adapted(self):
+        """Test that a shorter trip for the same group reuses the stored one"""
+        cached = self.cache.get(Preferences("jaipur city", "family", 4, "medium", 4))
+
+        self.assertEqual(len(cached["days"]), 4)
+        self.assertEqual(cached["days"], self.itinerary["days"][:4])
+        self.assertEqual(self.cache.adapted_hits, 1)
+
+    def test_dissimilar_requests_miss(self):
+        """Test that longer trips, other buckets and distant group sizes miss"""
+        self.assertIsNone(self.cache.get(Preferences("Jaipur", "family", 6, "moderate", 4)))
+        self.assertIsNone(self.cache.get(Preferences("Jaipur", "family", 5, "luxury", 4)))
+        self.assertIsNone(self.cache.get(Preferences("Jaipur", "family", 1, "moderate", 12)))
+        self.assertIsNone(self.cache.get(Preferences("Jaipur", "family", 3, "moderate", 4)))
+        self.assertEqual(self.cache.misses, 4)
+
+    def test_group_size_must_match(self):
+        """Test that a larger group never gets costs and hotels planned for a smaller one"""
+        self.cache.set(Preferences("Jaipur", "family", 5, "moderate", 8), sample_itinerary(num_days=5))
+        self.assertIsNone(self.cache.get(Preferences("Jaipur", "family", 5, "moderate", 5)))
+        self.assertIsNotNone(self.cache.get(Preferences("Jaipur", "family", 5, "moderate", 8)))
+
+    def test_requests_without_destination_are_not_cached(self):
+        """Test that open-destination requests neither read nor fill the cache"""
+        for destination in (None, "", " , "):
+            preferences = Preferences(destination, "family", 5, "moderate", 4)
+            self.assertIsNone(canonical_bucket(preferences))
+            self.cache.set(preferences, self.itinerary)
+            self.assertIsNone(self.cache.get(preferences))
+        self.assertEqual(self.cache.skipped, 3)
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_exact_hit_is_a_copy(self):
+        """Test that callers cannot modify the stored itinerary"""
+        cached = self.cache.get(Preferences("Jaipur", "family", 5, "moderate", 4))
+        cached["days"].clear()
+
+        self.assertEqual(self.cache.get(Preferences("Jaipur", "family", 5, "moderate", 4)), self.itinerary)
+        self.assertEqual(self.cache.exact_hits, 2)
+
+if __name__ == '__main__':
+    unittest.main()
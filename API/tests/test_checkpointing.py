@@ -0,0 +1,76 @@
+import unittest
+import pickle
+import random
+import tempfile
+
+import numpy as np
+import torch
+
+from ..ml.checkpointing import CheckpointManager, capture_rng_state, restore_rng_state
+
+class TestCheckpointManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_saves_snapshot_and_keeps_last(self):
+        """Test that later in-place updates don't leak into a save and old checkpoints are pruned"""
+        manager = CheckpointManager(self.directory.name, keep_last=2)
+        weights = torch.zeros(3)
+        for step in range(1, 5):
+            weights.fill_(step)
+            manager.save(step, {'weights': weights, 'step': step})
+            weights.fill_(-1)
+        manager.close()
+
+        self.assertEqual([path.name for path in manager.checkpoints()], ['step_00000003', 'step_00000004'])
+        state, rng_state = manager.load(manager.latest())
+        self.assertEqual(state['weights'].tolist(), [4.0, 4.0, 4.0])
+        self.assertIsNotNone(rng_state)
+
+    def test_waits_for_every_rank(self):
+        """Test that a checkpoint only counts once all ranks have written their part"""
+        ranks = [CheckpointManager(self.directory.name, rank=rank, world_size=2) for rank in range(2)]
+        ranks[0].save(10, {'step': 10})
+        ranks[0].wait()
+        self.assertIsNone(ranks[0].latest())
+
+        ranks[1].save(10, {'step': 10})
+        ranks[1].wait()
+        self.assertEqual(ranks[0].latest().name, 'step_00000010')
+        _, rng_state = ranks[1].load(ranks[0].latest())
+        self.assertIsNotNone(rng_state)
+        for manager in ranks:
+            manager.close()
+
+    def test_loaded_rng_state_restores(self):
+        """Test that the RNG state read back with weights_only repeats the same random numbers"""
+        manager = CheckpointManager(self.directory.name)
+        manager.save(1, {'step': 1})
+        manager.close()
+        expected = (random.random(), np.random.rand(), torch.rand(1).item())
+
+        _, rng_state = manager.load(manager.latest())
+        restore_rng_state(rng_state)
+        self.assertEqual((random.random(), np.random.rand(), torch.rand(1).item()), expected)
+
+    def test_rejects_arbitrary_objects(self):
+        """Test that loading refuses pickled objects outside the allowlist"""
+        manager = CheckpointManager(self.directory.name)
+        manager.save(1, {'step': 1, 'callback': print})
+        manager.close()
+
+        with self.assertRaises(pickle.UnpicklingError):
+            manager.load(manager.latest())
+
+    def test_rng_round_trip(self):
+        """Test that restoring the RNG state repeats the same random numbers"""
+        state = capture_rng_state()
+        expected = (random.random(), np.random.rand(), torch.rand(1).item())
+        restore_rng_state(state)
+        self.assertEqual((random.random(), np.random.rand(), torch.rand(1).item()), expected)
+
+if __name__ == '__main__':
+    unittest.main()
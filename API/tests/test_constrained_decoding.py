@@ -0,0 +1,89 @@
+import unittest
+import json
+
+import torch
+
+from ..ml.constrained_decoding import JSONConstraintProcessor, JSONSchemaGrammar, TokenVocabulary, itinerary_schema
+from ..ml.model import ItineraryEncoderDecoder
+
+# Single characters plus a few multi-character tokens that cross grammar boundaries
+TOKENS = ['[PAD]', '[BOS]', '[EOS]'] + [chr(i) for i in range(32, 127)] + [
+    '\n', '"destination": ', '", "', '": "', '{"', '"}', '"}]', '}, {"', ', ', '0.', '12', 'Jaipur', '\\u00e9'
+]
+
+ITINERARY = {
+    "destination": "Jaipur \"Pink City\"",
+    "hotels": [{"name": "Rambagh Palace", "location": {"lat": 26.898, "lng": 75.808}}],
+    "days": [
+        {"day": 1, "activities": [{"time": "09:00", "location": "Amber Fort", "description": "Climb up", "cost": "INR 500"}]},
+        {"day": 2, "activities": []}
+    ]
+}
+
+class TestJSONSchemaGrammar(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.vocabulary = TokenVocabulary(TOKENS, eos_token_id=2, special_token_ids=[0, 1, 2])
+        cls.grammar = JSONSchemaGrammar(itinerary_schema(num_days=2), cls.vocabulary)
+
+    def test_accepts_matching_itinerary(self):
+        """Test that json.dumps output of a matching itinerary is accepted"""
+        for ensure_ascii in (True, False):
+            state = self.grammar.advance_text(self.grammar.initial_state(), json.dumps(ITINERARY, ensure_ascii=ensure_ascii))
+            self.assertTrue(self.grammar.is_complete(state))
+
+    def test_rejects_wrong_structure(self):
+        """Test that missing keys, wrong types and the wrong number of days are rejected"""
+        for itinerary in (
+            {key: value for key, value in ITINERARY.items() if key != "hotels"},
+            {**ITINERARY, "hotels": "none"},
+            {**ITINERARY, "days": ITINERARY["days"][:1]},
+            {**ITINERARY, "days": [{**ITINERARY["days"][0], "day": 1.5}, ITINERARY["days"][1]]}
+        ):
+            state = self.grammar.advance_text(self.grammar.initial_state(), json.dumps(itinerary))
+            self.assertFalse(self.grammar.is_complete(state))
+
+    def test_allowed_tokens(self):
+        """Test that masks allow exactly the tokens that keep the output valid"""
+        def allowed(text):
+            is_allowlist, token_ids = self.grammar.allowed_tokens(self.grammar.advance_text(self.grammar.initial_state(), text))
+            if not is_allowlist:
+                token_ids = torch.tensor(sorted(set(range(len(TOKENS))) - set(token_ids.tolist())))
+            return {TOKENS[token_id] for token_id in token_ids.tolist()}
+
+        self.assertEqual(allowed(''), {'{', '{"'})
+        self.assertEqual(allowed('{"dest'), {'i'})
+        self.assertEqual(allowed('{'), {'"', '"destination": '})
+        self.assertIn('Jaipur', allowed('{"destination": "'))
+        self.assertNotIn('\n', allowed('{"destination": "'))
+        self.assertEqual(allowed(json.dumps(ITINERARY)), {'[EOS]'})
+
+class TestConstrainedGeneration(unittest.TestCase):
+    def test_generated_outputs_follow_grammar(self):
+        """Test that an untrained model only ever writes valid itinerary prefixes"""
+        torch.manual_seed(0)
+        vocabulary = TokenVocabulary(TOKENS, eos_token_id=2, special_token_ids=[0, 1, 2])
+        grammars = [JSONSchemaGrammar(itinerary_schema(num_days), vocabulary) for num_days in (1, 2)]
+        model = ItineraryEncoderDecoder(len(TOKENS), 16, 16, 1, 0.0, 0, 1, 2).eval()
+        src_tokens = torch.randint(3, len(TOKENS), (2, 6))
+
+        for num_beams in (1, 3):
+            output = model.generate(
+                src_tokens,
+                max_length=200,
+                num_beams=num_beams,
+                logits_processor=JSONConstraintProcessor(grammars, TOKENS, pad_token_id=0)
+            )
+            for grammar, token_ids in zip(grammars, output.tolist()):
+                finished = 2 in token_ids
+                if finished:
+                    token_ids = token_ids[:token_ids.index(2)]
+                text = ''.join(TOKENS[token_id] for token_id in token_ids if token_id != 0)
+                state = grammar.advance_text(grammar.initial_state(), text)
+                self.assertIsNotNone(state)
+                if finished:
+                    self.assertTrue(grammar.is_complete(state))
+                    self.assertIn("days", json.loads(text))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import json
+
+from ..json_stream import JSONStreamParser
+from ..benchmarks.cache_codecs import sample_itinerary
+
+class TestJSONStreamParser(unittest.TestCase):
+    def test_days_are_emitted_as_soon_as_complete(self):
+        """Test that each day is returned by the chunk that completes it"""
+        itinerary = sample_itinerary(num_days=3)
+        text = json.dumps(itinerary)
+        first_day_end = text.index(json.dumps(itinerary["days"][0])) + len(json.dumps(itinerary["days"][0]))
+
+        parser = JSONStreamParser()
+        self.assertEqual(parser.feed(text[:first_day_end - 1]), [])
+        self.assertEqual(parser.feed(text[first_day_end - 1:first_day_end]), [itinerary["days"][0]])
+        self.assertEqual(parser.feed(text[first_day_end:]), itinerary["days"][1:])
+        self.assertTrue(parser.complete)
+        self.assertEqual(parser.result(), itinerary)
+
+    def test_small_chunks_with_tricky_strings(self):
+        """Test that brackets, quotes and escapes inside strings are ignored"""
+        itinerary = {
+            "destination": "days",
+            "notes": ["days", {"days": [1]}],
+            "days": [
+                {"day": 1, "activities": [{"description": "a \"quoted\" {brace} [and] \\ slash"}]},
+                {"day": 2, "activities": []}
+            ]
+        }
+        text = "```json\n" + json.dumps(itinerary, indent=2) + "\n```"
+
+        parser = JSONStreamParser()
+        days = []
+        for i in range(0, len(text), 3):
+            days.extend(parser.feed(text[i:i + 3]))
+
+        self.assertEqual(days, itinerary["days"])
+        self.assertEqual(parser.result(), itinerary)
+
+    def test_incomplete_result_raises(self):
+        """Test that parsing a truncated object fails"""
+        parser = JSONStreamParser()
+        parser.feed('{"days": [{"day": 1}')
+
+        self.assertFalse(parser.complete)
+        with self.assertRaises(json.JSONDecodeError):
+            parser.result()
+
+if __name__ == '__main__':
+    unittest.main()
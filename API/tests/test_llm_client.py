@@ -0,0 +1,261 @@
+import unittest
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest import mock
+
+import httpx
+import requests
+
+from .. import llm_client
+from ..llm_client import (
+    AsyncLLMClient,
+    ConcurrencyBudget,
+    LLMClient,
+    RetryPolicy,
+    get_async_llm_client,
+    get_llm_client,
+    parse_retry_after
+)
+
+COMPLETION = {"choices": [{"message": {"content": "{}"}}]}
+
+def make_response(status: int, body=None, headers=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body or {}).encode()
+    response.headers.update(headers or {})
+    response.url = f"{llm_client.TOGETHER_BASE_URL}/chat/completions"
+    return response
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_retry_after_wins_and_is_clamped(self):
+        """Test that a server's Retry-After is used, within 0 and max_delay"""
+        policy = RetryPolicy(max_delay=10.0)
+        self.assertEqual(policy.delay(0, retry_after=3.0), 3.0)
+        self.assertEqual(policy.delay(0, retry_after=60.0), 10.0)
+        self.assertEqual(policy.delay(0, retry_after=-5.0), 0.0)
+
+    def test_backoff_is_bounded(self):
+        """Test that jittered delays stay under base_delay * 2 ** attempt and max_delay"""
+        policy = RetryPolicy(base_delay=0.5, max_delay=3.0)
+        for attempt, bound in ((0, 0.5), (1, 1.0), (2, 2.0), (5, 3.0)):
+            delays = [policy.delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= bound for delay in delays))
+            self.assertGreater(max(delays), bound / 2)
+
+    def test_parse_retry_after(self):
+        """Test that Retry-After is read as seconds or as an HTTP date"""
+        self.assertEqual(parse_retry_after("7"), 7.0)
+        self.assertEqual(parse_retry_after("1.5"), 1.5)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after(""))
+        self.assertIsNone(parse_retry_after("soon"))
+
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        self.assertAlmostEqual(parse_retry_after(format_datetime(retry_at, usegmt=True)), 30, delta=2)
+        self.assertLess(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+
+class TestLLMClient(unittest.TestCase):
+    def setUp(self):
+        self.client = LLMClient("test-key", retry_policy=RetryPolicy(max_retries=2))
+        self.addCleanup(self.client.close)
+        patcher = mock.patch("API.llm_client.time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def respond_with(self, *outcomes):
+        self.client.session.post = mock.Mock(side_effect=list(outcomes))
+
+    def test_retries_retryable_status(self):
+        """Test that a 429 is retried after the server's Retry-After"""
+        self.respond_with(make_response(429, headers={"Retry-After": "2"}), make_response(200, COMPLETION))
+        self.assertEqual(self.client.chat_completion({}), COMPLETION)
+        self.assertEqual(self.client.session.post.call_count, 2)
+        self.sleep.assert_called_once_with(2.0)
+
+    def test_other_errors_are_not_retried(self):
+        """Test that a 400 fails straight away"""
+        self.respond_with(make_response(400))
+        with self.assertRaises(requests.HTTPError):
+            self.client.chat_completion({})
+        self.assertEqual(self.client.session.post.call_count, 1)
+
+    def test_gives_up_after_max_retries(self):
+        """Test that the last retryable response is raised"""
+        self.respond_with(*[make_response(503)] * 3)
+        with self.assertRaises(requests.HTTPError):
+            self.client.chat_completion({})
+        self.assertEqual(self.client.session.post.call_count, 3)
+
+    def test_connection_errors_are_retried(self):
+        """Test that connection errors and timeouts are retried, then re-raised"""
+        self.respond_with(requests.ConnectionError(), requests.Timeout(), make_response(200, COMPLETION))
+        self.assertEqual(self.client.chat_completion({}), COMPLETION)
+
+        self.respond_with(*[requests.ConnectionError()] * 3)
+        with self.assertRaises(requests.ConnectionError):
+            self.client.chat_completion({})
+
+class TestAsyncLLMClient(unittest.TestCase):
+    def run_client(self, handler, call):
+        async def main():
+            client = AsyncLLMClient("test-key", retry_policy=RetryPolicy(max_retries=2, base_delay=0))
+            client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            try:
+                return await call(client)
+            finally:
+                await client.aclose()
+        return asyncio.run(main())
+
+    def test_retries_retryable_status(self):
+        """Test that a 503 is retried and the next response returned"""
+        statuses = [503, 200]
+
+        def handler(request):
+            return httpx.Response(statuses.pop(0), json=COMPLETION)
+
+        self.assertEqual(self.run_client(handler, lambda client: client.chat_completion({})), COMPLETION)
+        self.assertEqual(statuses, [])
+
+    def test_connection_errors_are_retried(self):
+        """Test that connect errors are retried, then re-raised"""
+        attempts = []
+
+        def handler(request):
+            attempts.append(1)
+            raise httpx.ConnectError("refused", request=request)
+
+        with self.assertRaises(httpx.ConnectError):
+            self.run_client(handler, lambda client: client.chat_completion({}))
+        self.assertEqual(len(attempts), 3)
+
+    def test_stream_retries_opening(self):
+        """Test that a stream rejected with 429 is reopened and its deltas yielded"""
+        statuses = [429, 200]
+        body = "".join(
+            f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}\n\n" for text in ("{", "}")
+        ) + "data: [DONE]\n\n"
+
+        def handler(request):
+            return httpx.Response(statuses.pop(0), text=body)
+
+        async def collect(client):
+            return [chunk async for chunk in client.stream_chat_completion({})]
+
+        self.assertEqual(self.run_client(handler, collect), ["{", "}"])
+
+class TestConcurrencyBudget(unittest.TestCase):
+    def test_shared_by_sync_and_async_clients(self):
+        """Test that both clients of an API key draw on one budget"""
+        with mock.patch.dict(llm_client._clients, clear=True), \
+                mock.patch.dict(llm_client._async_clients, clear=True), \
+                mock.patch.dict(llm_client._budgets, clear=True):
+            sync_client = get_llm_client("key-a", max_concurrency=2)
+            async_client = get_async_llm_client("key-a")
+            other_client = get_llm_client("key-b")
+            self.assertIs(sync_client._budget, async_client._budget)
+            self.assertIsNot(sync_client._budget, other_client._budget)
+            self.assertEqual(sync_client._budget.max_concurrency, 2)
+
+    def test_limits_sync_and_async_together(self):
+        """Test that threads and coroutines together never exceed the budget"""
+        budget = ConcurrencyBudget(3)
+        active, peak = 0, 0
+        lock = threading.Lock()
+
+        def enter():
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+
+        def leave():
+            nonlocal active
+            with lock:
+                active -= 1
+
+        def sync_work():
+            with budget:
+                enter()
+                time.sleep(0.02)
+                leave()
+
+        async def async_work():
+            async with budget:
+                enter()
+                await asyncio.sleep(0.02)
+                leave()
+
+        async def main():
+            threads = [threading.Thread(target=sync_work) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            await asyncio.gather(*(async_work() for _ in range(6)))
+            for thread in threads:
+                thread.join()
+
+        asyncio.run(main())
+        self.assertEqual(peak, 3)
+        self.assertEqual(budget._available, 3)
+
+    def test_slots_go_to_the_oldest_waiter(self):
+        """Test that a thread queued first gets the slot before a coroutine queued later"""
+        budget = ConcurrencyBudget(1)
+        order = []
+
+        def sync_work():
+            with budget:
+                order.append("sync")
+
+        async def async_work():
+            async with budget:
+                order.append("async")
+
+        async def main():
+            async with budget:
+                thread = threading.Thread(target=sync_work)
+                thread.start()
+                while not budget._waiters:
+                    await asyncio.sleep(0.001)
+                task = asyncio.create_task(async_work())
+                await asyncio.sleep(0.01)
+            await task
+            thread.join()
+
+        asyncio.run(main())
+        self.assertEqual(order, ["sync", "async"])
+
+    def test_cancelled_waiters_hold_no_slot(self):
+        """Test that cancelling a queued or just-granted coroutine frees its slot"""
+        budget = ConcurrencyBudget(1)
+
+        async def wait_for_slot():
+            async with budget:
+                pass
+
+        async def main():
+            async with budget:
+                queued = asyncio.create_task(wait_for_slot())
+                await asyncio.sleep(0)
+            # Granted on release but cancelled before it could run
+            queued.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await queued
+
+            async with budget:
+                queued = asyncio.create_task(wait_for_slot())
+                await asyncio.sleep(0)
+                queued.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await queued
+
+        asyncio.run(main())
+        self.assertEqual(budget._available, 1)
+        self.assertEqual(len(budget._waiters), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,275 @@
+import unittest
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+
+from .. import maps_interface
+from ..itinerary_generator import ItineraryGenerator
+
+LOCATIONS = {
+    "Hawa Mahal": (26.9239, 75.8267),
+    "Amber Fort": (26.9855, 75.8513),
+    "Jal Mahal": (26.9535, 75.8462),
+    "City Palace": (26.9258, 75.8237)
+}
+
+HOTELS = {
+    "hotel-a": (26.92, 75.82, 4.8, 3),
+    "hotel-b": (26.93, 75.83, 4.5, 2),
+    "hotel-c": (26.94, 75.84, 4.1, 1)
+}
+
+class FakeGmaps:
+    """Stands in for googlemaps.Client; lookups of names or IDs in failing raise."""
+    key = "test-key"
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def _check(self, method, argument):
+        self.calls.append((method, argument))
+        if argument in self.failing:
+            raise RuntimeError(f"{argument} failed")
+
+    def places(self, query):
+        self._check("places", query)
+        if query not in LOCATIONS:
+            return {"status": "ZERO_RESULTS", "results": []}
+        lat, lng = LOCATIONS[query]
+        return {"status": "OK", "results": [{
+            "name": query,
+            "formatted_address": f"{query}, Jaipur",
+            "geometry": {"location": {"lat": lat, "lng": lng}},
+            "place_id": f"id-{query}"
+        }]}
+
+    def place(self, place_id, fields=None):
+        self._check("place", place_id)
+        if fields == ["photo"]:
+            return {"result": {"photos": [{"photo_reference": f"ref-{place_id}"}]}}
+        lat, lng, rating, price_level = HOTELS[place_id]
+        return {"result": {
+            "name": place_id.title(),
+            "formatted_address": f"{place_id} road, Jaipur",
+            "geometry": {"location": {"lat": lat, "lng": lng}},
+            "rating": rating,
+            "price_level": price_level,
+            "place_id": place_id,
+            "website": f"https://{place_id}.example"
+        }}
+
+    def places_nearby(self, location, radius, type):
+        self._check("places_nearby", type)
+        return {"status": "OK", "results": [
+            {
+                "name": place_id.title(),
+                "vicinity": "Jaipur",
+                "geometry": {"location": {"lat": lat, "lng": lng}},
+                "rating": rating,
+                "price_level": price_level,
+                "place_id": place_id
+            }
+            for place_id, (lat, lng, rating, price_level) in HOTELS.items()
+        ]}
+
+    def distance_matrix(self, origins, destinations, mode, units):
+        self._check("distance_matrix", (tuple(origins), tuple(destinations)))
+        # Each element names its origin and destination, so tests can check the mapping
+        return {"status": "OK", "rows": [
+            {"elements": [
+                {"status": "OK", "distance": {"text": f"{origin}->{destination}"}, "duration": {"text": "5 mins"}}
+                for destination in destinations
+            ]}
+            for origin in origins
+        ]}
+
+class MapsTestCase(unittest.TestCase):
+    failing = ()
+
+    def setUp(self):
+        self.gmaps = FakeGmaps(self.failing)
+        for patcher in (
+            mock.patch.object(maps_interface, "_gmaps", self.gmaps),
+            mock.patch.object(maps_interface, "PLACE_STORE_PATH", "")
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def calls(self, method):
+        return [argument for name, argument in self.gmaps.calls if name == method]
+
+class TestPartialEnrichment(MapsTestCase):
+    failing = ("Hawa Mahal", "hotel-b")
+
+    def itinerary(self, first_day):
+        return {
+            "destination": "Jaipur",
+            "hotels": [],
+            "days": [
+                {"day": 1, "activities": [{"location": name} for name in first_day]},
+                {"day": 2, "activities": [{"location": "Jal Mahal"}, {"location": "Hawa Mahal"}]}
+            ]
+        }
+
+    def generate(self, itinerary):
+        with mock.patch("API.itinerary_generator.generate_itinerary", return_value=itinerary):
+            return ItineraryGenerator(requests_per_second=0).generate_complete_itinerary("Jaipur", "couple", 2, "moderate", 2)
+
+    def test_failed_lookups_map_to_none(self):
+        """Test that one failed lookup leaves the other locations enriched"""
+        places = maps_interface.enrich_places(["Hawa Mahal", "Amber Fort", "Amber Fort"], rate_limiter=maps_interface.RateLimiter(0))
+        self.assertIsNone(places["Hawa Mahal"])
+        self.assertEqual(places["Amber Fort"]["place_id"], "id-Amber Fort")
+        self.assertIn("photoreference=ref-id-Amber Fort", places["Amber Fort"]["photos"][0])
+        self.assertEqual(self.calls("places").count("Amber Fort"), 1)
+
+    def test_first_activity_not_found(self):
+        """Test that an unlocated first activity skips the hotel search instead of failing"""
+        itinerary = self.generate(self.itinerary(["Hawa Mahal", "Amber Fort"]))
+        first_day = itinerary["days"][0]["activities"]
+        self.assertNotIn("coordinates", first_day[0])
+        self.assertEqual(first_day[1]["coordinates"], {"lat": 26.9855, "lng": 75.8513})
+        self.assertEqual(itinerary["hotels"], [])
+        self.assertEqual(self.calls("places_nearby"), [])
+
+    def test_first_day_without_activities(self):
+        """Test that an empty first day skips the hotel search"""
+        itinerary = self.generate(self.itinerary([]))
+        self.assertEqual(itinerary["hotels"], [])
+        self.assertEqual(itinerary["days"][1]["activities"][0]["place_id"], "id-Jal Mahal")
+
+    def test_hotels_found_near_first_activity(self):
+        """Test that a failed hotel detail lookup only degrades that hotel"""
+        itinerary = self.generate(self.itinerary(["Amber Fort", "Hawa Mahal"]))
+        hotels = itinerary["hotels"]
+        self.assertEqual([hotel["place_id"] for hotel in hotels], ["hotel-a", "hotel-b", "hotel-c"])
+        self.assertEqual([hotel["details_loaded"] for hotel in hotels], [True, False, True])
+        self.assertEqual(hotels[0]["website"], "https://hotel-a.example")
+        self.assertEqual(hotels[1]["name"], "Hotel-B")
+
+class TestNearbyHotels(MapsTestCase):
+    location = {"coordinates": {"lat": 26.9239, "lng": 75.8267}}
+
+    def test_without_details(self):
+        """Test that include_details=False ranks the search results without detail lookups"""
+        hotels = maps_interface.find_nearby_hotels(self.location, max_hotels=2, include_details=False)
+
+        self.assertEqual([hotel["place_id"] for hotel in hotels], ["hotel-a", "hotel-b"])
+        self.assertEqual([hotel["details_loaded"] for hotel in hotels], [False, False])
+        self.assertNotIn("website", hotels[0])
+        self.assertEqual(hotels[0]["coordinates"], {"lat": 26.92, "lng": 75.82})
+        self.assertEqual(self.calls("places_nearby"), ["lodging"])
+        self.assertEqual(self.calls("place"), [])
+
+    def test_details_for_top_hotels_only(self):
+        """Test that details are loaded for the top max_hotels only"""
+        hotels = maps_interface.find_nearby_hotels(self.location, max_hotels=2)
+
+        self.assertEqual([hotel["details_loaded"] for hotel in hotels], [True, True])
+        self.assertEqual(hotels[1]["website"], "https://hotel-b.example")
+        self.assertEqual(sorted(self.calls("place")), ["hotel-a", "hotel-b"])
+
+def stops(seq_idx, count, missing=()):
+    """Stops at distinct coordinates (seq_idx, i); indices in missing have none."""
+    return [
+        {} if i in missing else {"coordinates": {"lat": seq_idx, "lng": i}}
+        for i in range(count)
+    ]
+
+class TestLegDistances(MapsTestCase):
+    def legs(self, stop_sequences, **kwargs):
+        return maps_interface.calculate_leg_distances(
+            stop_sequences,
+            rate_limiter=maps_interface.RateLimiter(0),
+            **kwargs
+        )
+
+    def assertLegsMapped(self, stop_sequences, results):
+        """Each leg reads the element for its own origin and destination"""
+        for seq_idx, (stops, legs) in enumerate(zip(stop_sequences, results)):
+            self.assertEqual(len(legs), max(0, len(stops) - 1))
+            for leg_idx, leg in enumerate(legs):
+                self.assertEqual(leg["distance"], f"{(seq_idx, leg_idx)}->{(seq_idx, leg_idx + 1)}")
+
+    def test_days_share_one_request(self):
+        """Test that the legs of several days are measured by a single request"""
+        days = [stops(0, 3), stops(1, 4), stops(2, 2), stops(3, 1), []]
+        results = self.legs(days)
+
+        self.assertEqual(len(self.calls("distance_matrix")), 1)
+        self.assertLegsMapped(days, results)
+        self.assertEqual(results[3:], [[], []])
+
+    def test_requests_respect_element_limit(self):
+        """Test that requests are cut at the element limit or max_legs_per_request"""
+        days = [stops(0, 12), stops(1, 9), stops(2, 6)]
+        results = self.legs(days)
+
+        requests = self.calls("distance_matrix")
+        self.assertEqual([len(origins) for origins, _ in requests], [10, 10, 4])
+        for origins, destinations in requests:
+            self.assertLessEqual(len(origins) * len(destinations), maps_interface.MAX_MATRIX_ELEMENTS)
+        self.assertLegsMapped(days, results)
+
+        self.gmaps.calls.clear()
+        self.assertEqual(self.legs(days, max_legs_per_request=4), results)
+        self.assertEqual([len(origins) for origins, _ in self.calls("distance_matrix")], [4] * 6)
+
+    def test_stops_without_coordinates(self):
+        """Test that legs touching an unlocated stop are skipped, not requested"""
+        days = [stops(0, 5, missing=(2,)), stops(1, 2, missing=(0,))]
+        results = self.legs(days)
+
+        self.assertIsNone(results[0][1])
+        self.assertIsNone(results[0][2])
+        self.assertEqual(results[0][0]["distance"], "(0, 0)->(0, 1)")
+        self.assertEqual(results[0][3]["distance"], "(0, 3)->(0, 4)")
+        self.assertEqual(results[1], [None])
+        self.assertEqual(self.calls("distance_matrix"), [
+            (((0, 0), (0, 3)), ((0, 1), (0, 4)))
+        ])
+
+    def test_requests_run_concurrently(self):
+        """Test that the chunks are requested in parallel"""
+        barrier = threading.Barrier(3, timeout=5)
+        distance_matrix = self.gmaps.distance_matrix
+
+        def wait_for_all(*args, **kwargs):
+            barrier.wait()
+            return distance_matrix(*args, **kwargs)
+
+        days = [stops(seq_idx, 11) for seq_idx in range(3)]
+        with mock.patch.object(self.gmaps, "distance_matrix", wait_for_all):
+            results = self.legs(days)
+
+        self.assertEqual(len(self.calls("distance_matrix")), 3)
+        self.assertLegsMapped(days, results)
+
+class TestPlaceStoreLookups(MapsTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in (
+            mock.patch.object(maps_interface, "PLACE_STORE_PATH", str(Path(directory.name) / "places.sqlite3")),
+            mock.patch.object(maps_interface, "_place_store", None)
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_locations_resolved_from_store(self):
+        """Test that a stored name skips the text search but photos stay live"""
+        first = maps_interface.get_place_location("Hawa Mahal")
+        second = maps_interface.get_place_location(" hawa-mahal ")
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls("places"), ["Hawa Mahal"])
+
+        for _ in range(2):
+            maps_interface.enrich_places(["Hawa Mahal"], rate_limiter=maps_interface.RateLimiter(0))
+        self.assertEqual(self.calls("places"), ["Hawa Mahal"])
+        self.assertEqual(self.calls("place"), ["id-Hawa Mahal"] * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,19 @@
 import unittest
+import pickle
+import tempfile
 import torch
 import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict
+from unittest import mock
 
-from ..ml.model import ItineraryEncoderDecoder
+from ..ml.model import ItineraryEncoderDecoder, TracedItineraryEncoderDecoder
 from ..ml.tokenizer import ItineraryTokenizer
 from ..ml.model_interface import ModelInterface
+from ..ml.batch_scheduler import MicroBatchScheduler
 from ..openAIAPI import TravelPreferences
 
 class TestModelLoading(unittest.TestCase):
@@ -26,12 +32,222 @@ class TestModelLoading(unittest.TestCase):
         tokenizer = ItineraryTokenizer.from_pretrained(self.tokenizer_path)
         self.assertIsInstance(tokenizer, ItineraryTokenizer)
         
+class TestGeneration(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        torch.manual_seed(0)
+        cls.model = ItineraryEncoderDecoder(
+            vocab_size=50,
+            embed_dim=16,
+            hidden_dim=8,
+            num_layers=2,
+            dropout=0.0,
+            pad_token_id=0,
+            bos_token_id=1,
+            eos_token_id=2
+        ).eval()
+        cls.src_tokens = torch.randint(3, 50, (3, 7))
+        cls.src_tokens[0, 5:] = 0
+        
+    def test_batched_greedy_matches_single(self):
+        """Test that batched greedy decoding ignores padding of other sequences"""
+        src_lengths = [5, 7, 2, 6]
+        for seed in range(10):
+            torch.manual_seed(seed)
+            model = ItineraryEncoderDecoder(50, 16, 8, 2, 0.0, 0, 1, 2).eval()
+            src_tokens = torch.randint(3, 50, (len(src_lengths), max(src_lengths)))
+            for row, length in enumerate(src_lengths):
+                src_tokens[row, length:] = 0
+
+            batch_output = model.generate(src_tokens, max_length=20)
+            for row, length in enumerate(src_lengths):
+                single_output = model.generate(src_tokens[row:row + 1, :length], max_length=20)
+                self.assertTrue(torch.equal(batch_output[row], single_output[0]), f'seed {seed}, row {row}')
+        
+    def test_mmap_loading_matches(self):
+        """Test that a memory-mapped checkpoint generates the same output"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'model.pt'
+            self.model.save_pretrained(path)
+            model = ItineraryEncoderDecoder.from_pretrained(path, mmap=True).eval()
+            self.assertTrue(torch.equal(
+                model.generate(self.src_tokens, max_length=20),
+                self.model.generate(self.src_tokens, max_length=20)
+            ))
+
+    def test_exported_variants_round_trip(self):
+        """Test that quantized and traced exports load back with from_pretrained"""
+        traced = TracedItineraryEncoderDecoder.trace(self.model)
+        self.assertTrue(torch.equal(
+            traced.generate(self.src_tokens, max_length=20),
+            self.model.generate(self.src_tokens, max_length=20)
+        ))
+
+        with tempfile.TemporaryDirectory() as directory:
+            for name, variant in (('int8.pt', self.model.quantize_dynamic()), ('traced.pt', traced)):
+                path = Path(directory) / name
+                variant.save_pretrained(path)
+                model = ItineraryEncoderDecoder.from_pretrained(path).eval()
+                self.assertEqual(model.is_quantized, variant.is_quantized)
+                self.assertTrue(torch.equal(
+                    model.generate(self.src_tokens, max_length=20),
+                    variant.generate(self.src_tokens, max_length=20)
+                ))
+
+    def test_loading_rejects_arbitrary_objects(self):
+        """Test that from_pretrained never unpickles anything but weights"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'model.pt'
+            torch.save({'config': self.model.config, 'model_state_dict': {}, 'payload': Path(directory)}, path)
+            with self.assertRaises(pickle.UnpicklingError):
+                ItineraryEncoderDecoder.from_pretrained(path)
+
+        traced = TracedItineraryEncoderDecoder.trace(self.model)
+        with self.assertRaises(RuntimeError):
+            traced(self.src_tokens, self.src_tokens)
+
+    def test_packed_forward_ignores_padding(self):
+        """Test that teacher forcing with lengths matches running each example unpadded"""
+        tgt_tokens = torch.randint(3, 50, (3, 9))
+        src_lengths, tgt_lengths = torch.tensor([5, 7, 3]), torch.tensor([9, 4, 6])
+        src_tokens = self.src_tokens.clone()
+        for row in range(3):
+            src_tokens[row, src_lengths[row]:] = 0
+            tgt_tokens[row, tgt_lengths[row]:] = 0
+
+        logits = self.model(src_tokens, tgt_tokens, src_lengths=src_lengths, tgt_lengths=tgt_lengths)
+        for row in range(3):
+            single = self.model(src_tokens[row:row + 1, :src_lengths[row]], tgt_tokens[row:row + 1, :tgt_lengths[row]])
+            self.assertTrue(torch.allclose(logits[row, :tgt_lengths[row] - 1], single[0], atol=1e-5))
+
+    def test_padded_generate_matches_unpadded(self):
+        """Test that extra padding columns change no variant's output, greedy or beam"""
+        for seed in range(5):
+            torch.manual_seed(seed)
+            model = ItineraryEncoderDecoder(50, 16, 8, 2, 0.0, 0, 1, 2).eval()
+            src_tokens = torch.randint(3, 50, (3, 6))
+            padded = torch.cat([src_tokens, torch.zeros(3, 4, dtype=torch.long)], dim=1)
+            for variant in (model, model.quantize_dynamic(), TracedItineraryEncoderDecoder.trace(model)):
+                for num_beams in (1, 3):
+                    self.assertTrue(torch.equal(
+                        variant.generate(padded, max_length=20, num_beams=num_beams),
+                        variant.generate(src_tokens, max_length=20, num_beams=num_beams)
+                    ), f'seed {seed}, {type(variant).__name__}, {num_beams} beams')
+
+    def test_beam_search_shape(self):
+        """Test that beam search returns one sequence per input"""
+        output = self.model.generate(self.src_tokens, max_length=20, num_beams=4)
+        self.assertEqual(output.shape, (3, 20))
+        
+    def test_finished_sequences_are_padded(self):
+        """Test that sequences ending with EOS are padded afterwards"""
+        model = ItineraryEncoderDecoder(50, 16, 8, 2, 0.0, 0, 1, 2).eval()
+        with torch.no_grad():
+            model.output_projection.bias[2] = 100.0
+        for num_beams in (1, 3):
+            output = model.generate(self.src_tokens, max_length=20, num_beams=num_beams)
+            self.assertEqual(output[:, 0].tolist(), [2, 2, 2])
+            self.assertTrue(bool(output[:, 1:].eq(0).all()))
+        
+class TestMicroBatchScheduler(unittest.TestCase):
+    def test_concurrent_submissions_are_batched(self):
+        """Test that queued requests are merged into one batch"""
+        calls = []
+        
+        def batch_fn(items):
+            calls.append(list(items))
+            return [item * 2 if item >= 0 else ValueError("negative") for item in items]
+            
+        scheduler = MicroBatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=50)
+        futures = [scheduler.submit(i) for i in (1, 2, -1)]
+        
+        self.assertEqual([futures[0].result(), futures[1].result()], [2, 4])
+        self.assertIsInstance(futures[2].exception(), ValueError)
+        self.assertEqual(calls, [[1, 2, -1]])
+        
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['batch_size_histogram'], {3: 1})
+        scheduler.close()
+
+    def test_queue_depth_histogram(self):
+        """Test that the queue depth seen by each submit is counted"""
+        running, release = threading.Event(), threading.Event()
+
+        def batch_fn(items):
+            running.set()
+            release.wait()
+            return items
+
+        scheduler = MicroBatchScheduler(batch_fn, max_batch_size=1, max_wait_ms=0)
+        futures = [scheduler.submit(0)]
+        running.wait()
+        futures += [scheduler.submit(i) for i in (1, 2, 3)]
+        release.set()
+
+        self.assertEqual([future.result() for future in futures], [0, 1, 2, 3])
+        stats = scheduler.get_stats()
+        # The worker may take the first item before submit() reads the depth
+        self.assertIn(stats['queue_depth_histogram'], ({0: 1, 1: 1, 2: 1, 3: 1}, {1: 2, 2: 1, 3: 1}))
+        scheduler.close()
+        
+class TestModelInterfaceBatching(unittest.TestCase):
+    def setUp(self):
+        self.batches, self.threads = [], set()
+
+        def generate_batch(preferences_list):
+            self.threads.add(threading.current_thread().name)
+            self.batches.append(len(preferences_list))
+            time.sleep(0.02)
+            return [
+                ValueError("invalid output") if preferences.destination == "Nowhere" else {"destination": preferences.destination}
+                for preferences in preferences_list
+            ]
+
+        # Only the parts generate_itinerary and the metrics use; no checkpoint needed
+        self.interface = ModelInterface.__new__(ModelInterface)
+        self.interface.scheduler = MicroBatchScheduler(generate_batch, max_batch_size=8, max_wait_ms=50, name="model-worker")
+        self.interface.executor = ThreadPoolExecutor(max_workers=1)
+        self.interface._metrics_lock, self.interface._grammars_lock = threading.Lock(), threading.Lock()
+        self.interface._grammars = {}
+        self.interface.total_requests = self.interface.total_latency = self.interface.failed_requests = 0
+        self.interface.warmup_seconds, self.interface.constrained_decoding = None, False
+        self.addCleanup(self.interface.close)
+
+    def preferences(self, destination):
+        return TravelPreferences(destination=destination, group_type="family", num_days=3, budget="moderate", num_people=4)
+
+    def test_sync_requests_are_batched(self):
+        """Test that concurrent generate_itinerary calls share forward passes on the scheduler thread"""
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            results = list(pool.map(
+                lambda destination: self.interface.generate_itinerary(self.preferences(destination), fallback_to_api=False),
+                ["Jaipur", "Goa", "Delhi", "Agra", "Pune", "Ooty"]
+            ))
+
+        self.assertEqual([result["destination"] for result in results], ["Jaipur", "Goa", "Delhi", "Agra", "Pune", "Ooty"])
+        self.assertEqual(self.threads, {"model-worker"})
+        self.assertEqual(sum(self.batches), 6)
+        self.assertLess(len(self.batches), 6)
+        self.assertEqual(self.interface.get_performance_metrics()['scheduler']['total_batches'], len(self.batches))
+
+    def test_failed_requests_fall_back(self):
+        """Test that only the requests the model failed on go to the API"""
+        with mock.patch("API.ml.model_interface.api_generate_itinerary", return_value={"destination": "api"}) as api:
+            results = self.interface.generate_batch([self.preferences("Jaipur"), self.preferences("Nowhere")])
+        self.assertEqual(results, [{"destination": "Jaipur"}, {"destination": "api"}])
+        api.assert_called_once()
+        self.assertEqual(self.batches, [2])
+
+        with self.assertRaises(ValueError):
+            self.interface.generate_itinerary(self.preferences("Nowhere"), fallback_to_api=False)
+
 class TestModelInterface(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.model_path = Path(__file__).parent / '../ml/checkpoints/best_model.pt'
         cls.tokenizer_path = Path(__file__).parent / '../ml/checkpoints/tokenizer'
         cls.interface = ModelInterface(cls.model_path, cls.tokenizer_path)
+        cls.interface.warmup()
         
     def test_input_formatting(self):
         """Test input formatting"""
@@ -103,6 +319,7 @@ class TestModelOutputFormat(unittest.TestCase):
         cls.model_path = Path(__file__).parent / '../ml/checkpoints/best_model.pt'
         cls.tokenizer_path = Path(__file__).parent / '../ml/checkpoints/tokenizer'
         cls.interface = ModelInterface(cls.model_path, cls.tokenizer_path)
+        cls.interface.warmup()
         
     def test_output_structure(self):
         """Test output JSON structure"""
@@ -0,0 +1,80 @@
+import unittest
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from ..services.place_store import PlaceStore, normalize_place_name
+
+HAWA_MAHAL = {
+    "place_id": "id-hawa-mahal",
+    "name": "Hawa Mahal",
+    "address": "Hawa Mahal Rd, Jaipur",
+    "rating": 4.6,
+    "coordinates": {"lat": 26.9239, "lng": 75.8267}
+}
+
+class TestPlaceStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.directory.name) / "places.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_normalize_place_name(self):
+        """Test that case, spacing and punctuation don't change the key"""
+        self.assertEqual(normalize_place_name(" Hawa-Mahal "), "hawa mahal")
+        self.assertEqual(normalize_place_name("HAWA  mahal"), "hawa mahal")
+
+    def test_upsert_and_lookup(self):
+        """Test that a place is found by any spelling of its name and a later put replaces it"""
+        store = PlaceStore(self.path)
+        self.assertIsNone(store.get_by_name("Hawa Mahal"))
+
+        store.put_place(HAWA_MAHAL, query_name="Hawa Mahal")
+        self.assertEqual(store.get_by_name("hawa-mahal"), {
+            "place_id": "id-hawa-mahal",
+            "coordinates": {"lat": 26.9239, "lng": 75.8267}
+        })
+
+        store.put_places([{**HAWA_MAHAL, "coordinates": {"lat": 26.924, "lng": 75.827}}])
+        self.assertEqual(store.get_by_name("Hawa Mahal")["coordinates"], {"lat": 26.924, "lng": 75.827})
+        self.assertEqual(store.get_stats(), {"places": 1, "hits": 2, "misses": 1})
+
+    def test_stores_only_ids_and_coordinates(self):
+        """Test that names, addresses and ratings never reach the database"""
+        PlaceStore(self.path).put_place(HAWA_MAHAL, query_name="Hawa Mahal")
+        with sqlite3.connect(self.path) as connection:
+            rows = [
+                row
+                for table in ("places", "place_names")
+                for row in connection.execute(f"SELECT * FROM {table}")
+            ]
+        self.assertNotIn("Hawa Mahal", str(rows))
+        self.assertNotIn("Jaipur", str(rows))
+        self.assertNotIn("4.6", str(rows))
+
+    def test_coordinates_expire(self):
+        """Test that expired coordinates are not returned and are purged, keeping the name mapping"""
+        store = PlaceStore(self.path, coordinates_ttl=timedelta(seconds=0.05))
+        store.put_place(HAWA_MAHAL, query_name="Hawa Mahal")
+        time.sleep(0.06)
+
+        self.assertIsNone(store.get_by_name("Hawa Mahal"))
+        self.assertEqual(store.purge_expired(), 1)
+        self.assertEqual(store.get_stats()["places"], 0)
+
+        store.put_place(HAWA_MAHAL)
+        self.assertEqual(store.get_by_name("Hawa Mahal")["place_id"], "id-hawa-mahal")
+
+    def test_expired_coordinates_purged_on_open(self):
+        """Test that opening the store deletes coordinates older than the TTL"""
+        PlaceStore(self.path).put_place(HAWA_MAHAL)
+        time.sleep(0.01)
+        store = PlaceStore(self.path, coordinates_ttl=timedelta(seconds=0.005))
+        self.assertEqual(store.get_stats()["places"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import json
+import tempfile
+from collections import Counter
+from pathlib import Path
+
+from ..ml.prepare_data import SPLIT_FRACTIONS, assign_split, iter_records, prepare_training_data, validate_record
+
+def record(destination: str, num_days: int, num_people: int = 2) -> dict:
+    return {
+        "input": {"destination": destination, "group_type": "couple", "num_days": num_days, "budget": "luxury", "num_people": num_people},
+        "output": {"destination": destination, "hotels": [], "days": [{"day": day + 1, "activities": []} for day in range(num_days)]}
+    }
+
+class TestPrepareTrainingData(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.records = [record(f"City {index}", 1 + index % 5, 1 + index % 7) for index in range(300)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_input(self, lines, name='raw.jsonl') -> Path:
+        path = self.root / name
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def read_splits(self, output_dir: Path) -> dict:
+        return {split: list(iter_records(output_dir / split)) for split in SPLIT_FRACTIONS}
+
+    def test_validates_deduplicates_and_splits(self):
+        """Test that every valid record lands once, in its hashed split"""
+        lines = [json.dumps(item) for item in self.records]
+        # Duplicates with a different key order, plus invalid lines
+        lines += [json.dumps(item, sort_keys=True) for item in self.records[:20]]
+        lines += ['{"input": ', json.dumps(record("Goa", 2) | {"output": {"days": []}}), '', '[1, 2]']
+        input_path = self.write_input(lines)
+
+        manifest = prepare_training_data(input_path, self.root / 'out', num_shards=4, num_workers=2, chunk_size=2048)
+        splits = self.read_splits(self.root / 'out')
+
+        self.assertEqual(manifest['records_read'], 323)
+        self.assertEqual(manifest['duplicates'], 20)
+        self.assertEqual(manifest['rejected'], {'days_mismatch': 1, 'invalid_json': 1, 'not_an_object': 1})
+        self.assertEqual(sum(manifest['splits'].values()), 300)
+        for split, items in splits.items():
+            self.assertEqual(len(items), manifest['splits'][split])
+            self.assertTrue(all(assign_split(item) == split for item in items))
+        self.assertEqual(
+            Counter(json.dumps(item, sort_keys=True) for items in splits.values() for item in items),
+            Counter(json.dumps(item, sort_keys=True) for item in self.records)
+        )
+
+    def test_output_independent_of_parallelism(self):
+        """Test that worker count and chunk size don't change the shards"""
+        input_path = self.write_input([json.dumps(item) for item in self.records])
+        prepare_training_data(input_path, self.root / 'serial', num_shards=3, num_workers=1)
+        prepare_training_data(input_path, self.root / 'parallel', num_shards=3, num_workers=3, chunk_size=997)
+        for split in SPLIT_FRACTIONS:
+            for shard in (self.root / 'serial' / split).glob('part-*.jsonl'):
+                self.assertEqual(shard.read_bytes(), (self.root / 'parallel' / split / shard.name).read_bytes())
+
+    def test_splits_stable_when_appending(self):
+        """Test that appended records don't move existing ones between splits"""
+        before = self.write_input([json.dumps(item) for item in self.records[:200]], 'before.jsonl')
+        after = self.write_input([json.dumps(item) for item in self.records], 'after.jsonl')
+        prepare_training_data(before, self.root / 'before', num_workers=1)
+        prepare_training_data(after, self.root / 'after', num_workers=1)
+
+        for split, items in self.read_splits(self.root / 'before').items():
+            after_items = {json.dumps(item, sort_keys=True) for item in iter_records(self.root / 'after' / split)}
+            self.assertTrue({json.dumps(item, sort_keys=True) for item in items} <= after_items)
+
+    def test_validate_record(self):
+        """Test that records the trainer can't format are rejected with a reason"""
+        self.assertIsNone(validate_record(record("Jaipur", 3)))
+        self.assertEqual(validate_record(record("Jaipur", 0)), 'bad_input_count')
+        self.assertEqual(validate_record({"input": {}, "output": {}}), 'bad_input_destination')
+        self.assertEqual(validate_record(record("Jaipur", 3) | {"input": {**record("Jaipur", 3)["input"], "num_days": True}}), 'bad_input_num_days')
+
+if __name__ == '__main__':
+    unittest.main()
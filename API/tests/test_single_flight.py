@@ -0,0 +1,260 @@
+import unittest
+import asyncio
+import json
+import threading
+import time
+
+from ..services.single_flight import LeaderFailed, SingleFlight
+from ..services.concurrency import ConcurrencyLimiter, ConcurrencyLimitExceeded
+
+class UnavailableRedis:
+    def set(self, *args, **kwargs):
+        raise ConnectionError("Redis is down")
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = messages
+
+    def subscribe(self, channel):
+        pass
+
+    def get_message(self, timeout):
+        if self.messages:
+            return {"data": self.messages.pop(0)}
+        time.sleep(timeout)
+        return None
+
+    def close(self):
+        pass
+
+class LockedRedis:
+    """Redis where another worker holds the lock for the first held set() calls and publishes messages"""
+
+    def __init__(self, messages=(), held=1):
+        self.messages = list(messages)
+        self.held = held
+        self.set_calls = 0
+        self.published = []
+
+    def set(self, key, value, nx, px):
+        self.set_calls += 1
+        return self.set_calls > self.held
+
+    def pubsub(self, ignore_subscribe_messages):
+        return FakePubSub(self.messages)
+
+    def publish(self, channel, message):
+        self.published.append(json.loads(message))
+
+    def eval(self, *args):
+        return 1
+
+class TestSingleFlight(unittest.TestCase):
+    def run_concurrently(self, single_flight, fn, num_callers=4):
+        """Call do() from several threads once the first caller is running fn"""
+        started = threading.Event()
+        results, errors = [], []
+
+        def leader_fn():
+            started.set()
+            return fn()
+
+        def call(call_fn):
+            try:
+                results.append(single_flight.do("key", call_fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call, args=(leader_fn,))]
+        threads[0].start()
+        started.wait()
+        threads += [threading.Thread(target=call, args=(fn,)) for _ in range(num_callers - 1)]
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_local_waiters_share_one_call(self):
+        """Test that concurrent callers with the same key get the leader's result"""
+        calls = []
+        release = threading.Event()
+
+        def fn():
+            calls.append(1)
+            release.wait()
+            return {"calls": len(calls)}
+
+        single_flight = SingleFlight()
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(single_flight, fn)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [{"calls": 1}] * 4)
+        self.assertEqual(single_flight.get_stats()["leaders"], 1)
+        self.assertEqual(single_flight.get_stats()["local_waiters"], 3)
+        self.assertEqual(single_flight.get_stats()["in_flight"], 0)
+
+    def test_waiters_share_leader_failure(self):
+        """Test that waiters re-raise the leader's error instead of all retrying at once"""
+        calls = []
+        release = threading.Event()
+
+        def fn():
+            calls.append(1)
+            release.wait()
+            raise RuntimeError("generation failed")
+
+        single_flight = SingleFlight()
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(single_flight, fn)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ["generation failed"] * 4)
+        self.assertEqual(single_flight.get_stats()["fallbacks"], 0)
+        self.assertEqual(single_flight.get_stats()["in_flight"], 0)
+
+    def test_waiters_time_out(self):
+        """Test that waiters give up after wait_timeout without running the call"""
+        calls = []
+        release = threading.Event()
+
+        def fn():
+            calls.append(1)
+            release.wait()
+            return "leader"
+
+        single_flight = SingleFlight(wait_timeout=0.1)
+        leader = threading.Thread(target=single_flight.do, args=("key", fn))
+        leader.start()
+        while not single_flight.get_stats()["in_flight"]:
+            time.sleep(0.01)
+
+        try:
+            with self.assertRaises(TimeoutError):
+                single_flight.do("key", fn)
+            self.assertEqual(len(calls), 1)
+        finally:
+            release.set()
+            leader.join()
+
+    def test_redis_down_runs_locally(self):
+        """Test that an unavailable Redis doesn't fail the call"""
+        single_flight = SingleFlight(redis=UnavailableRedis())
+        self.assertEqual(single_flight.do("key", lambda: "ok"), "ok")
+        self.assertEqual(single_flight.get_stats()["leaders"], 1)
+        self.assertEqual(single_flight.get_stats()["remote_waiters"], 0)
+
+class TestDistributedSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def fn(self):
+        self.calls.append(1)
+        return {"days": []}
+
+    def test_remote_waiter_gets_published_result(self):
+        """Test that a waiter in another worker returns the leader's result"""
+        single_flight = SingleFlight(redis=LockedRedis([json.dumps({"status": "ok", "result": {"days": [1]}})]))
+        self.assertEqual(single_flight.do("key", self.fn), {"days": [1]})
+        self.assertEqual(self.calls, [])
+        self.assertEqual(single_flight.get_stats()["remote_waiters"], 1)
+
+    def test_remote_waiter_shares_leader_failure(self):
+        """Test that a published failure is raised instead of every worker retrying"""
+        message = json.dumps({"status": "error", "error": "RuntimeError: generation failed"})
+        single_flight = SingleFlight(redis=LockedRedis([message]))
+        with self.assertRaisesRegex(LeaderFailed, "generation failed"):
+            single_flight.do("key", self.fn)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(single_flight.get_stats()["fallbacks"], 0)
+
+    def test_remote_waiter_takes_over_silent_leader(self):
+        """Test that a waiter takes over once the silent leader's lock is gone, and publishes"""
+        redis = LockedRedis(held=1)
+        single_flight = SingleFlight(redis=redis, wait_timeout=0.05)
+        self.assertEqual(single_flight.do("key", self.fn), {"days": []})
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(redis.published, [{"status": "ok", "result": {"days": []}}])
+        self.assertEqual(single_flight.get_stats()["leaders"], 1)
+
+    def test_remote_waiter_times_out_while_lock_held(self):
+        """Test that a waiter raises TimeoutError if the leader is silent but still holds the lock"""
+        single_flight = SingleFlight(redis=LockedRedis(held=2), wait_timeout=0.05)
+        with self.assertRaises(TimeoutError):
+            single_flight.do("key", self.fn)
+        self.assertEqual(self.calls, [])
+
+    def test_leader_publishes_failure(self):
+        """Test that a failing leader publishes its error and re-raises it"""
+        redis = LockedRedis(held=0)
+
+        def fail():
+            raise ValueError("bad output")
+
+        with self.assertRaises(ValueError):
+            SingleFlight(redis=redis).do("key", fail)
+        self.assertEqual(redis.published, [{"status": "error", "error": "ValueError: bad output"}])
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def test_limits_concurrency(self):
+        """Test that no more than max_concurrency callers hold a slot at once"""
+        limiter = ConcurrencyLimiter(2, queue_timeout=1.0)
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            async with limiter.slot():
+                peak = max(peak, limiter.active)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            await asyncio.gather(*(work() for _ in range(6)))
+
+        asyncio.run(main())
+        self.assertEqual(peak, 2)
+        self.assertEqual(limiter.get_stats()["completed"], 6)
+        self.assertEqual(limiter.get_stats()["active"], 0)
+
+    def test_rejects_after_queue_timeout(self):
+        """Test that a caller waiting longer than queue_timeout is rejected"""
+        limiter = ConcurrencyLimiter(1, queue_timeout=0.05)
+
+        async def main():
+            async with limiter.slot():
+                with self.assertRaises(ConcurrencyLimitExceeded) as context:
+                    async with limiter.slot():
+                        pass
+            return context.exception
+
+        error = asyncio.run(main())
+        self.assertEqual(error.retry_after, 0.05)
+        self.assertEqual(limiter.get_stats()["rejected"], 1)
+        self.assertEqual(limiter.get_stats()["waiting"], 0)
+
+    def test_rejects_when_queue_is_full(self):
+        """Test that callers beyond max_queue are rejected without waiting"""
+        limiter = ConcurrencyLimiter(1, queue_timeout=1.0, max_queue=1)
+
+        async def wait_for_slot():
+            async with limiter.slot():
+                pass
+
+        async def main():
+            async with limiter.slot():
+                queued = asyncio.create_task(wait_for_slot())
+                await asyncio.sleep(0)
+                started = time.monotonic()
+                with self.assertRaises(ConcurrencyLimitExceeded):
+                    async with limiter.slot():
+                        pass
+                self.assertLess(time.monotonic() - started, 0.5)
+            await queued
+
+        asyncio.run(main())
+        self.assertEqual(limiter.get_stats()["rejected"], 1)
+        self.assertEqual(limiter.get_stats()["completed"], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+import unittest
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from .. import maps_interface
+from ..routes import slm
+from .test_maps_interface import FakeGmaps
+
+STREAM_REQUEST = {
+    "destination": "Jaipur",
+    "group_type": "couple",
+    "num_days": 2,
+    "budget": "moderate",
+    "num_people": 2
+}
+DAYS = [
+    {"day": 1, "activities": [{"name": "Amber Fort"}]},
+    {"day": 2, "activities": [{"name": "City Palace"}]}
+]
+HOTELS = [{"name": "hotel-a", "place_id": "hotel-a"}]
+
+def parse_sse(body):
+    """Split a server-sent event stream into (event, data) pairs."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+class FakeCacheService:
+    def __init__(self):
+        self.itineraries = {}
+
+    async def get_cached_itinerary_async(self, params):
+        return self.itineraries.get(json.dumps(params, sort_keys=True))
+
+    def cache_itinerary(self, params, itinerary):
+        self.itineraries[json.dumps(params, sort_keys=True)] = itinerary
+        return True
+
+class FakeGenerator:
+    """Streams events in the order ItineraryGenerator.stream_complete_itinerary does."""
+    def __init__(self, fail_after_first_day=False):
+        self.fail_after_first_day = fail_after_first_day
+        self.calls = 0
+
+    async def stream_complete_itinerary(self, **kwargs):
+        self.calls += 1
+        yield {"type": "day", "day": DAYS[0]}
+        yield {"type": "hotels", "hotels": HOTELS}
+        if self.fail_after_first_day:
+            raise RuntimeError("model unavailable")
+        yield {"type": "day", "day": DAYS[1]}
+        yield {"type": "itinerary", "itinerary": {"days": DAYS, "hotels": HOTELS}}
+
+class RoutesTestCase(unittest.TestCase):
+    def setUp(self):
+        app = FastAPI()
+        app.include_router(slm.router, prefix="/api/slm")
+        self.cache_service = FakeCacheService()
+        self.generator = FakeGenerator()
+        app.dependency_overrides[slm.verify_api_key] = lambda: "test-key"
+        app.dependency_overrides[slm.get_cache_service] = lambda: self.cache_service
+        app.dependency_overrides[slm.get_itinerary_generator] = lambda: self.generator
+        self.client = TestClient(app)
+
+    def stream(self):
+        response = self.client.post("/api/slm/generate/stream", json=STREAM_REQUEST)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        return parse_sse(response.text)
+
+class TestItineraryStream(RoutesTestCase):
+    def test_live_stream(self):
+        """Test that days and hotels stream before the cached final itinerary"""
+        events = self.stream()
+
+        self.assertEqual(
+            [event for event, _ in events],
+            ["day", "hotels", "day", "itinerary"]
+        )
+        self.assertEqual(events[0][1], DAYS[0])
+        self.assertEqual(events[1][1], HOTELS)
+        self.assertEqual(events[3][1], {"days": DAYS, "hotels": HOTELS})
+        self.assertEqual(len(self.cache_service.itineraries), 1)
+
+    def test_replay_matches_live_order(self):
+        """Test that a cache hit replays the events in the live order without generating"""
+        live = self.stream()
+        replayed = self.stream()
+
+        self.assertEqual(replayed, live)
+        self.assertEqual(self.generator.calls, 1)
+
+    def test_error_midway(self):
+        """Test that a failure after the first day ends the stream with an error event"""
+        self.generator.fail_after_first_day = True
+        events = self.stream()
+
+        self.assertEqual([event for event, _ in events], ["day", "hotels", "error"])
+        self.assertIn("model unavailable", events[-1][1]["detail"])
+        self.assertEqual(self.cache_service.itineraries, {})
+        self.assertEqual(slm.generation_limiter.get_stats()["active"], 0)
+
+    def test_invalid_request(self):
+        """Test that non-positive day or people counts are rejected"""
+        response = self.client.post(
+            "/api/slm/generate/stream",
+            json={**STREAM_REQUEST, "num_days": 0}
+        )
+        self.assertEqual(response.status_code, 400)
+
+class TestHotelDetails(RoutesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gmaps = FakeGmaps(failing=("hotel-b",))
+        for patcher in (
+            mock.patch.object(maps_interface, "_gmaps", self.gmaps),
+            mock.patch.object(maps_interface, "PLACE_STORE_PATH", "")
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_details_loaded(self):
+        """Test that the route returns one hotel's live details"""
+        response = self.client.get("/api/slm/hotels/hotel-a")
+
+        self.assertEqual(response.status_code, 200)
+        hotel = response.json()
+        self.assertEqual(hotel["place_id"], "hotel-a")
+        self.assertEqual(hotel["website"], "https://hotel-a.example")
+        self.assertTrue(hotel["details_loaded"])
+        self.assertEqual(self.gmaps.calls, [("place", "hotel-a")])
+
+    def test_lookup_failure(self):
+        """Test that a failed lookup is reported as a bad gateway"""
+        response = self.client.get("/api/slm/hotels/hotel-b")
+
+        self.assertEqual(response.status_code, 502)
+        self.assertIn("hotel-b failed", response.json()["detail"])
+
+class TestServiceDependencies(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(
+            slm,
+            _cache_service=None,
+            _single_flight=None,
+            _itinerary_generator=None
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_generator_created_once(self):
+        """Test that concurrent first requests share one generator"""
+        created = []
+        start = threading.Barrier(8)
+
+        class SlowGenerator:
+            def __init__(self):
+                time.sleep(0.05)
+                created.append(self)
+
+        def get_generator():
+            start.wait()
+            return slm.get_itinerary_generator()
+
+        with mock.patch("API.itinerary_generator.ItineraryGenerator", SlowGenerator):
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                generators = list(executor.map(lambda _: get_generator(), range(8)))
+
+        self.assertEqual(len(created), 1)
+        self.assertTrue(all(generator is created[0] for generator in generators))
+
+    def test_single_flight_shares_cache_connection(self):
+        """Test that single-flight uses the cache service's Redis client and circuit breaker"""
+        with mock.patch.object(slm, "CacheService") as cache_service_class:
+            single_flight = slm.get_single_flight()
+            cache_service = slm.get_cache_service()
+
+        cache_service_class.assert_called_once()
+        self.assertIs(single_flight, slm.get_single_flight())
+        self.assertIs(single_flight.redis, cache_service.redis)
+        self.assertIs(single_flight.circuit_breaker, cache_service.circuit_breaker)
+
+    def test_stream_route_uses_injected_generator(self):
+        """Test that the stream route takes its generator from the dependency"""
+        app = FastAPI()
+        app.include_router(slm.router, prefix="/api/slm")
+        generator = FakeGenerator()
+        app.dependency_overrides[slm.verify_api_key] = lambda: "test-key"
+        app.dependency_overrides[slm.get_cache_service] = FakeCacheService
+        app.dependency_overrides[slm.get_itinerary_generator] = lambda: generator
+
+        with mock.patch("API.itinerary_generator.ItineraryGenerator") as generator_class:
+            response = TestClient(app).post("/api/slm/generate/stream", json=STREAM_REQUEST)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(generator.calls, 1)
+        generator_class.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,15 @@
+import unittest
+
+from ..benchmarks.startup import MODULES, measure_import
+
+class TestStartup(unittest.TestCase):
+    def test_imports_have_no_side_effects(self):
+        """Test that importing the app loads neither torch nor provider clients, and opens no sockets"""
+        for module in MODULES:
+            with self.subTest(module=module):
+                result = measure_import(module)
+                self.assertEqual(result["forbidden"], [])
+                self.assertEqual(result["connections"], [])
+
+if __name__ == '__main__':
+    unittest.main()
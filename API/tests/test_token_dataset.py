@@ -0,0 +1,107 @@
+import unittest
+import json
+import pickle
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from ..ml.token_dataset import LengthBucketSampler, TokenizedItineraryDataset, format_training_example, pretokenize
+
+class CharTokenizer:
+    """One token per character, enough to check the file layout"""
+    vocab_size = 256
+    pad_token_id = 0
+    eos_token_id = 1
+
+    def encode(self, text, max_length=None, padding=False, truncation=True):
+        token_ids = [ord(char) % 256 for char in text]
+        return token_ids[:max_length] if truncation and max_length else token_ids
+
+def record(destination: str, num_days: int) -> dict:
+    return {
+        "input": {"destination": destination, "group_type": "family", "num_days": num_days, "budget": "moderate", "num_people": 4},
+        "output": {"destination": destination, "hotels": [], "days": [{"day": day + 1, "activities": []} for day in range(num_days)]}
+    }
+
+class TestTokenizedItineraryDataset(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.records = [record("Jaipur", 1), record("Goa", 3), record("Udaipur", 2)]
+        data_path = Path(self.directory.name) / 'train.json'
+        with open(data_path, 'w') as f:
+            json.dump(self.records, f)
+        self.tokenizer = CharTokenizer()
+        self.meta = pretokenize(data_path, self.tokenizer, Path(self.directory.name) / 'tokens', max_length=64)
+        self.dataset = TokenizedItineraryDataset(Path(self.directory.name) / 'tokens')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_examples_match_tokenizer(self):
+        """Test that stored examples equal tokenizing on the fly, truncated to max_length"""
+        self.assertEqual(len(self.dataset), 3)
+        self.assertEqual(self.meta['dtype'], 'uint16')
+        for item, example in zip(self.records, self.dataset):
+            input_text, output_text = format_training_example(item)
+            self.assertEqual(example['input_ids'].tolist(), self.tokenizer.encode(input_text, max_length=64))
+            self.assertEqual(example['output_ids'].tolist(), self.tokenizer.encode(output_text, max_length=64))
+            self.assertIsInstance(example['output_ids'], np.memmap)
+
+    def test_collate_pads_to_longest(self):
+        """Test that batches are padded to their longest sequence"""
+        batch = self.dataset.collate([self.dataset[0], self.dataset[2]])
+        lengths = self.dataset.lengths()
+        self.assertEqual(tuple(batch['output_ids'].shape), (2, max(lengths[0], lengths[2])))
+        self.assertTrue(bool(batch['output_ids'][0, lengths[0]:].eq(0).all()))
+
+    def test_pickles_without_arrays(self):
+        """Test that DataLoader workers get a copy that reopens the files"""
+        self.dataset[0]
+        copy = pickle.loads(pickle.dumps(self.dataset))
+        self.assertIsNone(copy._arrays)
+        self.assertEqual(copy[1]['input_ids'].tolist(), self.dataset[1]['input_ids'].tolist())
+
+class TestLengthBucketSampler(unittest.TestCase):
+    def test_batches_cover_all_indices_grouped_by_length(self):
+        """Test that every index appears once and batches hold similar lengths"""
+        lengths = np.random.default_rng(0).integers(1, 500, size=1000)
+        sampler = LengthBucketSampler(lengths, batch_size=10, bucket_multiplier=100)
+        batches = list(sampler)
+
+        self.assertEqual(len(batches), len(sampler))
+        self.assertEqual(sorted(index for batch in batches for index in batch), list(range(1000)))
+        spread = np.mean([np.ptp(lengths[batch]) for batch in batches])
+        self.assertLess(spread, 0.05 * np.ptp(lengths))
+        self.assertNotEqual(batches, list(sampler))
+
+    def test_distributed_shards(self):
+        """Test that ranks get disjoint shards, equally long with drop_last"""
+        lengths = np.random.default_rng(0).integers(1, 500, size=1000)
+        for drop_last in (True, False):
+            shards = [
+                list(LengthBucketSampler(lengths, batch_size=7, bucket_multiplier=20, drop_last=drop_last, num_replicas=3, rank=rank))
+                for rank in range(3)
+            ]
+            indices = [index for shard in shards for batch in shard for index in batch]
+            self.assertEqual(len(indices), len(set(indices)))
+            if drop_last:
+                self.assertEqual(len({len(shard) for shard in shards}), 1)
+            else:
+                self.assertEqual(len(indices), 1000)
+
+    def test_resume_mid_epoch(self):
+        """Test that a start batch skips exactly the batches already seen, for one epoch"""
+        lengths = np.random.default_rng(0).integers(1, 500, size=100)
+        sampler = LengthBucketSampler(lengths, batch_size=8, bucket_multiplier=4, seed=3)
+        sampler.set_epoch(2)
+        epoch = list(sampler)
+
+        sampler.set_epoch(2)
+        sampler.set_start_batch(5)
+        self.assertEqual(len(sampler), len(epoch) - 5)
+        self.assertEqual(list(sampler), epoch[5:])
+        self.assertEqual(len(list(sampler)), len(epoch))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import unittest
+import logging
+import os
+import socket
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Dataset
+
+from ..ml import train_slm
+from ..ml.token_dataset import LengthBucketSampler, collate_padded
+
+VOCAB_SIZE = 50
+GradScaler = torch.amp.GradScaler
+
+def make_examples(count, seed=0, output_lengths=(6, 14)):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'input_ids': rng.integers(3, VOCAB_SIZE, 8).tolist(),
+            'output_ids': rng.integers(3, VOCAB_SIZE, int(rng.integers(*output_lengths))).tolist()
+        }
+        for _ in range(count)
+    ]
+
+def make_model():
+    torch.manual_seed(0)
+    return train_slm.ItineraryEncoderDecoder(VOCAB_SIZE, 16, 16, 1, 0.0, pad_token_id=0)
+
+def collate(batch):
+    return collate_padded(batch, 0)
+
+def parameters(model):
+    return torch.cat([parameter.detach().flatten() for parameter in model.parameters()])
+
+def parameters_of(state_dict):
+    model = make_model()
+    model.load_state_dict(state_dict)
+    return parameters(model)
+
+class RecordingDataset(Dataset):
+    """Examples that remember which indices were read"""
+    def __init__(self, examples):
+        self.examples = examples
+        self.seen = []
+
+    def __len__(self):
+        return len(self.examples)
+
+    def __getitem__(self, idx):
+        self.seen.append(idx)
+        return self.examples[idx]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def train_rank(rank, world_size, port, directory):
+    """One rank of the gloo smoke test, launched by mp.spawn"""
+    logging.disable(logging.CRITICAL)
+    os.environ.update({
+        'MASTER_ADDR': '127.0.0.1',
+        'MASTER_PORT': str(port),
+        'RANK': str(rank),
+        'LOCAL_RANK': str(rank),
+        'WORLD_SIZE': str(world_size)
+    })
+    torch.set_num_threads(1)
+    assert train_slm.setup_distributed('gloo') == (rank, rank, world_size)
+    try:
+        examples = make_examples(14)
+        dataset = RecordingDataset(examples)
+        lengths = [len(example['output_ids']) for example in examples]
+        train_loader = DataLoader(
+            dataset,
+            batch_sampler=LengthBucketSampler(
+                lengths, 2, drop_last=True, num_replicas=world_size, rank=rank
+            ),
+            collate_fn=collate
+        )
+        val_loader = DataLoader(
+            examples,
+            batch_sampler=LengthBucketSampler(
+                lengths, 5, shuffle=False, num_replicas=world_size, rank=rank
+            ),
+            collate_fn=collate
+        )
+        model = DistributedDataParallel(make_model())
+        train_slm.train(
+            model, train_loader, val_loader, 1, 1e-2, torch.device('cpu'), directory,
+            grad_accum_steps=2, checkpoint_every=1
+        )
+        torch.save(
+            {'parameters': parameters(model.module), 'seen': dataset.seen},
+            Path(directory) / f'result_rank{rank}.pt'
+        )
+    finally:
+        dist.destroy_process_group()
+
+class TestLaunch(unittest.TestCase):
+    def test_single_process_without_torchrun(self):
+        """Test that setup_distributed is a no-op when not launched by torchrun"""
+        with mock.patch.dict(os.environ, {'WORLD_SIZE': '1'}):
+            self.assertEqual(train_slm.setup_distributed(), (0, 0, 1))
+        self.assertFalse(dist.is_initialized())
+
+    def test_launch_with_torchrun(self):
+        """Test that the script re-runs itself under torchrun with its arguments"""
+        with mock.patch.object(train_slm.subprocess, 'call', return_value=0) as call, \
+                mock.patch.object(train_slm.sys, 'argv', ['train_slm.py', '--nproc_per_node', '2']), \
+                mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(train_slm.launch_with_torchrun(2), 0)
+
+        command = call.call_args.args[0]
+        self.assertEqual(command[1:5], ['-m', 'torch.distributed.run', '--standalone', '--nproc_per_node=2'])
+        self.assertEqual(command[5], os.path.abspath(train_slm.__file__))
+        self.assertEqual(command[6:], ['--nproc_per_node', '2'])
+        self.assertIn('OMP_NUM_THREADS', call.call_args.kwargs['env'])
+
+class TestGradientAccumulation(unittest.TestCase):
+    def train(self, batch_size, grad_accum_steps):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        # Equal lengths, so the mean over micro-batches is the mean over tokens
+        examples = make_examples(5, output_lengths=(12, 13))
+        model = make_model()
+        # SGD steps in proportion to the gradient, so a wrong divisor shows
+        # (AdamW's first step is nearly independent of the gradient's scale)
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(train_slm.optim, 'AdamW', torch.optim.SGD):
+            train_slm.train(
+                model,
+                DataLoader(examples, batch_size=batch_size, collate_fn=collate),
+                DataLoader(examples, batch_size=5, collate_fn=collate),
+                1, 1e-2, torch.device('cpu'), directory,
+                grad_accum_steps=grad_accum_steps,
+                max_grad_norm=1e9,
+                checkpoint_every=0
+            )
+        return parameters(model)
+
+    def test_short_last_group_is_averaged_over_its_size(self):
+        """Test that a last group of 5 micro-batches steps like one batch of all 5"""
+        initial = parameters(make_model())
+        accumulated = self.train(batch_size=1, grad_accum_steps=8)
+        single_step = self.train(batch_size=5, grad_accum_steps=1)
+
+        self.assertFalse(torch.allclose(accumulated, initial))
+        torch.testing.assert_close(accumulated, single_step, rtol=0, atol=1e-6)
+
+class TestMixedPrecision(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.losses = []
+        self.scalers = []
+
+    def train(self, num_epochs, resume=False):
+        """Train bf16 on CPU, recording losses and scalers"""
+        batch_loss = train_slm._batch_loss
+
+        def record_loss(*args):
+            loss = batch_loss(*args)
+            self.losses.append((loss.item(), args[-1]))
+            return loss
+
+        def make_scaler(device, enabled):
+            # CPU-capable and enabled, so its state is not empty; bf16 itself needs no scaling
+            self.scalers.append(GradScaler('cpu', init_scale=1024.0, growth_interval=1))
+            return self.scalers[-1]
+
+        examples = make_examples(5)
+        with mock.patch.object(train_slm, '_batch_loss', record_loss), \
+                mock.patch.object(train_slm.torch.amp, 'GradScaler', make_scaler):
+            train_slm.train(
+                make_model(),
+                DataLoader(examples, batch_size=5, collate_fn=collate),
+                DataLoader(examples, batch_size=5, collate_fn=collate),
+                num_epochs, 1e-2, torch.device('cpu'), self.directory,
+                precision='bf16',
+                resume=resume
+            )
+
+    def test_bf16_step_and_scaler_checkpoint(self):
+        """Test that a bf16 step has a finite loss and the scaler state survives a resume"""
+        self.train(num_epochs=1)
+        self.assertTrue(self.losses)
+        for loss, dtype in self.losses:
+            self.assertEqual(dtype, torch.bfloat16)
+            self.assertTrue(np.isfinite(loss))
+
+        manager = train_slm.CheckpointManager(Path(self.directory) / 'checkpoints')
+        state, _ = manager.load(manager.latest())
+        # One finite step grows the scale once
+        self.assertEqual(state['scaler']['scale'], 2048.0)
+
+        self.train(num_epochs=2, resume=True)
+        self.assertEqual(self.scalers[-1].get_scale(), 4096.0)
+
+class TestDistributedTraining(unittest.TestCase):
+    def test_gloo_two_ranks(self):
+        """Test two CPU ranks: disjoint shards, identical weights and rank-0 checkpoints"""
+        with tempfile.TemporaryDirectory() as directory:
+            mp.spawn(train_rank, args=(2, free_port(), directory), nprocs=2, join=True)
+
+            results = [torch.load(Path(directory) / f'result_rank{rank}.pt') for rank in range(2)]
+            torch.testing.assert_close(results[0]['parameters'], results[1]['parameters'])
+            self.assertFalse(set(results[0]['seen']) & set(results[1]['seen']))
+            self.assertEqual(len(results[0]['seen']), len(results[1]['seen']))
+            self.assertTrue((Path(directory) / 'best_model.pt').exists())
+
+            manager = train_slm.CheckpointManager(Path(directory) / 'checkpoints', world_size=2)
+            checkpoints = manager.checkpoints()
+            self.assertEqual([path.name for path in checkpoints], ['step_00000001', 'step_00000002'])
+            for path in checkpoints:
+                self.assertEqual(
+                    sorted(file.name for file in path.iterdir()),
+                    ['done_rank0_of_2', 'done_rank1_of_2', 'rng_rank0.pt', 'rng_rank1.pt', 'state.pt']
+                )
+            state, _ = manager.load(checkpoints[-1])
+            self.assertEqual(state['world_size'], 2)
+            self.assertEqual((state['epoch'], state['batches_done'], state['global_step']), (1, 0, 2))
+            torch.testing.assert_close(parameters_of(state['model']), results[0]['parameters'])
+
+if __name__ == '__main__':
+    unittest.main()